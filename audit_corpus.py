@@ -0,0 +1,180 @@
+import os
+import argparse
+import json
+import logging
+import sys
+from collections import Counter
+from typing import Optional
+
+import chromadb
+
+import pdftovector
+
+# --- Configuration ---
+PDF_DIRECTORY = pdftovector.PDF_DIRECTORY
+CHROMA_DB_PATH = pdftovector.CHROMA_DB_PATH
+COLLECTION_NAME = pdftovector.COLLECTION_NAME
+SCAN_PAGE_SIZE = 1000  # Chunk metadatas read per request by the fallback scan
+ID_CHECK_BATCH = 1000  # Chunk IDs looked up per request by the per-file check
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def open_collection(db_path: str = CHROMA_DB_PATH):
+    """The syllabus collection, or None if the database has none."""
+    try:
+        return chromadb.PersistentClient(path=db_path).get_collection(name=COLLECTION_NAME)
+    except Exception as e:
+        logging.warning(f"No collection '{COLLECTION_NAME}' in {db_path}: {e}")
+        return None
+
+
+def load_summary(db_path: str = CHROMA_DB_PATH) -> Optional[dict[str, dict]]:
+    """Per-source summary written by pdftovector.py as each file's chunks are stored
+    (sha256, size_bytes, chunk_count, subject, grade_band, ingested_at), or None without one."""
+    manifest = pdftovector.load_manifest(os.path.join(db_path, os.path.basename(pdftovector.MANIFEST_PATH)))
+    return None if manifest is None else manifest["files"]
+
+
+def summary_matches_collection(summary: Optional[dict[str, dict]], collection) -> bool:
+    """True if the summary accounts for exactly the chunks in the collection (an O(1) check)."""
+    return summary is not None and sum(entry["chunk_count"] for entry in summary.values()) == collection.count()
+
+
+def scan_sources(collection, page_size: int = SCAN_PAGE_SIZE) -> Counter:
+    """Chunks per source_pdf, counted page by page from the metadata alone (no documents or embeddings)."""
+    counts: Counter = Counter()
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        counts.update((metadata or {}).get("source_pdf") for metadata in page["metadatas"])
+        offset += len(page["ids"])
+    return counts
+
+
+def source_pdfs(db_path: str = CHROMA_DB_PATH) -> set[str]:
+    """Names of the PDFs with chunks in the collection; from the summary when it accounts for
+    every chunk, otherwise from a paginated metadata scan."""
+    collection = open_collection(db_path)
+    if collection is None:
+        return set()
+    summary = load_summary(db_path)
+    if summary_matches_collection(summary, collection):
+        return set(summary)
+    logging.info("Ingest summary missing or out of step with the collection; scanning chunk metadata.")
+    return {name for name in scan_sources(collection) if name}
+
+
+def check_chunk_ids(collection, summary: dict[str, dict]) -> dict[str, str]:
+    """Problems with each file's stored chunks, found by ID lookups only (O(#files)).
+
+    Chunk IDs are deterministic (pdftovector.make_chunk_id), so a file with chunk_count chunks
+    must have its first and last chunk stored and no chunk after the last (a file with no
+    chunks must have no chunk 1).
+    """
+    expected = {}
+    for name, entry in summary.items():
+        count = entry["chunk_count"]
+        if count:
+            expected[pdftovector.make_chunk_id(name, 1)] = (name, True)
+            expected[pdftovector.make_chunk_id(name, count)] = (name, True)
+        expected[pdftovector.make_chunk_id(name, count + 1)] = (name, False)
+    lookup = list(expected)
+    stored = set()
+    for start in range(0, len(lookup), ID_CHECK_BATCH):
+        stored.update(collection.get(ids=lookup[start:start + ID_CHECK_BATCH], include=[])["ids"])
+    problems = {}
+    for chunk_id, (name, should_exist) in expected.items():
+        if should_exist and chunk_id not in stored:
+            problems[name] = "chunks missing from the collection"
+        elif not should_exist and chunk_id in stored:
+            problems.setdefault(name, "more chunks stored than recorded")
+    return problems
+
+
+def audit(pdf_directory: str = PDF_DIRECTORY, db_path: str = CHROMA_DB_PATH, scan: bool = False,
+          check_hashes: bool = True) -> list[dict]:
+    """One row per PDF on disk, in the summary or in the collection, with its status.
+
+    Statuses: ok, not_ingested (on disk only), changed (content differs from what was ingested),
+    stale (ingested but no longer on disk), count_mismatch (stored chunks differ from the
+    summary) and untracked (chunks in the collection the summary doesn't know about).
+    """
+    on_disk = {f: os.path.join(pdf_directory, f) for f in os.listdir(pdf_directory)
+               if f.lower().endswith(".pdf")} if os.path.isdir(pdf_directory) else {}
+    collection = open_collection(db_path)
+    summary = load_summary(db_path) or {}
+
+    stored: Optional[Counter] = None
+    id_problems: dict[str, str] = {}
+    if collection is not None:
+        if scan or not summary_matches_collection(summary, collection):
+            if not scan:
+                logging.warning(f"The ingest summary accounts for {sum(e['chunk_count'] for e in summary.values())} "
+                                f"chunks but the collection holds {collection.count()}; scanning chunk metadata.")
+            stored = scan_sources(collection)
+        else:
+            id_problems = check_chunk_ids(collection, summary)
+
+    names = set(on_disk) | set(summary) | {name for name in (stored or {}) if name}
+    rows = []
+    for name in sorted(names):
+        entry = summary.get(name)
+        row = {"file": name, "on_disk": name in on_disk, "summary_chunks": entry["chunk_count"] if entry else None,
+               "stored_chunks": stored.get(name, 0) if stored is not None else None, "sha256_match": None,
+               "ingested_at": entry.get("ingested_at") if entry else None, "status": "ok", "detail": ""}
+        if entry and name in on_disk:
+            if os.path.getsize(on_disk[name]) != entry.get("size_bytes"):
+                row["sha256_match"] = False
+            elif check_hashes:
+                row["sha256_match"] = pdftovector.file_sha256(on_disk[name]) == entry["sha256"]
+
+        if entry is None and name in on_disk and not row["stored_chunks"]:
+            row["status"], row["detail"] = "not_ingested", "run pdftovector.py"
+        elif name not in on_disk and entry is not None:
+            row["status"], row["detail"] = "stale", "file removed; run pdftovector.py to purge its chunks"
+        elif entry is None:
+            row["status"], row["detail"] = "untracked", "chunks not in the ingest summary; run pdftovector.py --full"
+        elif row["sha256_match"] is False:
+            row["status"], row["detail"] = "changed", "file changed since ingest; run pdftovector.py"
+        elif name in id_problems:
+            row["status"], row["detail"] = "count_mismatch", id_problems[name]
+        elif stored is not None and row["stored_chunks"] != entry["chunk_count"]:
+            row["status"], row["detail"] = "count_mismatch", f"{row['stored_chunks']} chunks stored"
+        rows.append(row)
+    if stored is not None and stored.get(None):
+        rows.append({"file": None, "on_disk": False, "summary_chunks": None, "stored_chunks": stored[None],
+                     "sha256_match": None, "ingested_at": None, "status": "untracked",
+                     "detail": "chunks without source_pdf metadata"})
+    return rows
+
+
+def print_report(rows: list[dict]) -> None:
+    print(f"{'file':<48} {'status':<15} {'summary':>8} {'stored':>7} {'sha256':>7}  detail")
+    for row in rows:
+        sha = {True: "ok", False: "differs", None: "-"}[row["sha256_match"]]
+        print(f"{str(row['file'] or '(no source)'):<48} {row['status']:<15} "
+              f"{row['summary_chunks'] if row['summary_chunks'] is not None else '-':>8} "
+              f"{row['stored_chunks'] if row['stored_chunks'] is not None else '-':>7} {sha:>7}  {row['detail']}")
+    statuses = Counter(row["status"] for row in rows)
+    print(", ".join(f"{count} {status}" for status, count in sorted(statuses.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Audit the syllabus collection against the PDF directory.")
+    parser.add_argument("--pdf-dir", default=PDF_DIRECTORY)
+    parser.add_argument("--db", default=CHROMA_DB_PATH)
+    parser.add_argument("--scan", action="store_true",
+                        help="Count stored chunks per file with a full metadata scan instead of trusting the ingest summary.")
+    parser.add_argument("--no-hash", action="store_true", help="Compare file sizes only, without re-hashing the PDFs.")
+    parser.add_argument("--json", action="store_true", help="Print the rows as JSON.")
+    args = parser.parse_args()
+    rows = audit(args.pdf_dir, args.db, scan=args.scan, check_hashes=not args.no_hash)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_report(rows)
+    sys.exit(0 if all(row["status"] == "ok" for row in rows) else 1)
@@ -0,0 +1,235 @@
+import os
+import argparse
+import json
+import logging
+import math
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+
+import numpy_index
+import pdftovector
+import retrieval
+from embedding_cache import CachedEncoder, EmbeddingCache
+
+# --- Configuration ---
+JUDGMENTS_PATH = "./benchmarks/retrieval_judgments.v1.jsonl"  # Bump the version when judgments change
+CONFIGS_PATH = "./benchmarks/retrieval_configs.json"
+INDEX_DIR = "./benchmarks/indexes"  # One ChromaDB directory per indexed configuration
+RESULTS_DIR = "./benchmarks/results"
+CUTOFFS = [1, 3, 5, 10]
+REPEATS = 5  # Timed passes over the queries after the first (cold) pass
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def load_judgments(path: str = JUDGMENTS_PATH) -> list[dict]:
+    """Queries with their relevant sources.
+
+    Each line is {"id", "query", "subject"?, "grade"?, "relevant": [{"source_pdf", "pages"?, "relevance"?}]}.
+    source_pdf may list several interchangeable files (e.g. duplicate uploads); without "pages"
+    any chunk of the source counts. relevance defaults to 1 and weights nDCG.
+    """
+    judgments = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                judgments.append(json.loads(line))
+    return judgments
+
+
+def load_configs(path: str = CONFIGS_PATH) -> list[dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def index_settings(config: dict, configs: dict[str, dict]) -> dict:
+    """The settings that shape a configuration's index; "index" reuses another configuration's index."""
+    source = configs[config["index"]] if "index" in config else config
+    return {
+        "name": source["name"],
+        "embedding_model": source.get("embedding_model", pdftovector.EMBEDDING_MODEL_NAME),
+        "chunk_max_tokens": source.get("chunk_max_tokens", pdftovector.CHUNK_MAX_TOKENS),
+        "chunk_overlap_tokens": source.get("chunk_overlap_tokens", pdftovector.CHUNK_OVERLAP_TOKENS),
+        "hnsw": source.get("hnsw"),
+    }
+
+
+def matches(metadata: dict, item: dict) -> bool:
+    sources = item["source_pdf"] if isinstance(item["source_pdf"], list) else [item["source_pdf"]]
+    if metadata.get("source_pdf") not in sources:
+        return False
+    pages = item.get("pages")
+    if not pages:
+        return True
+    page_start, page_end = metadata.get("page_start"), metadata.get("page_end")
+    if page_start is None:
+        return False
+    return any(page_start <= page <= page_end for page in pages)
+
+
+def score_ranking(hits: list[dict], relevant: list[dict], cutoffs: list[int] = CUTOFFS) -> dict:
+    """recall@k, reciprocal rank and nDCG@max(cutoffs) for one ranked hit list.
+
+    A hit counts for the first judged item it matches that no earlier hit has matched, so
+    several chunks of the same page are credited once.
+    """
+    found_at: dict[int, int] = {}  # judged item -> rank (1-based)
+    gains = []
+    first_relevant = None
+    for rank, hit in enumerate(hits, 1):
+        gain = 0
+        for i, item in enumerate(relevant):
+            if matches(hit["metadata"], item):
+                if first_relevant is None:
+                    first_relevant = rank
+                if i not in found_at:
+                    found_at[i] = rank
+                    gain = item.get("relevance", 1)
+                    break
+        gains.append(gain)
+    depth = max(cutoffs)
+    dcg = sum(gain / math.log2(rank + 1) for rank, gain in enumerate(gains[:depth], 1))
+    ideal = sorted((item.get("relevance", 1) for item in relevant), reverse=True)[:depth]
+    idcg = sum(gain / math.log2(rank + 1) for rank, gain in enumerate(ideal, 1))
+    scores = {f"recall@{k}": sum(1 for rank in found_at.values() if rank <= k) / len(relevant) for k in cutoffs}
+    scores["mrr"] = 1 / first_relevant if first_relevant else 0.0
+    scores[f"ndcg@{depth}"] = dcg / idcg if idcg else 0.0
+    return scores
+
+
+def build_index(settings: dict, scratch_dir: str, rebuild: bool = False) -> dict:
+    """Builds (or incrementally refreshes) a configuration's index and returns its build statistics.
+
+    Builds embed with an empty embedding cache so build times include the model. The statistics
+    of the last build that did any work are kept beside the index.
+    """
+    db_path = os.path.join(INDEX_DIR, settings["name"])
+    stats_path = os.path.join(db_path, "benchmark_build.json")
+    build_cache = EmbeddingCache(settings["embedding_model"], cache_dir=os.path.join(scratch_dir, f"build-{settings['name']}"))
+    encoder = CachedEncoder(settings["embedding_model"], cache=build_cache)
+    stats = pdftovector.main(full_rebuild=rebuild, pdf_directory=pdftovector.PDF_DIRECTORY, db_path=db_path,
+                             embedding_model=settings["embedding_model"],
+                             chunk_max_tokens=settings["chunk_max_tokens"],
+                             chunk_overlap_tokens=settings["chunk_overlap_tokens"],
+                             hnsw_params=settings["hnsw"], encoder=encoder)
+    if stats is None:
+        raise SystemExit(f"No PDFs in {pdftovector.PDF_DIRECTORY}.")
+    if stats["processed_files"] or not os.path.exists(stats_path):
+        with open(stats_path, 'w', encoding='utf-8') as f:
+            json.dump({**stats, "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds")}, f, indent=2)
+        return stats
+    with open(stats_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def run_queries(config: dict, judgments: list[dict], depth: int, repeats: int) -> tuple[list[list[dict]], list[float], list[float]]:
+    """(hits per query, cold latencies, warm latencies) in seconds.
+
+    The first pass embeds every query (cold); later passes hit the embedding cache (warm), as
+    repeated questions do in the app.
+    """
+    search = config.get("search", {})  # Extra retrieve() keyword arguments
+    results, cold, warm = [], [], []
+    for attempt in range(1 + repeats):
+        for judgment in judgments:
+            start = time.perf_counter()
+            hits = retrieval.retrieve(judgment["query"],
+                                      subject=judgment.get("subject") if config.get("filters", True) else None,
+                                      grade=judgment.get("grade") if config.get("filters", True) else None,
+                                      k=depth, **search)
+            (cold if attempt == 0 else warm).append(time.perf_counter() - start)
+            if attempt == 0:
+                results.append(hits)
+    return results, cold, warm
+
+
+def benchmark(config: dict, configs: dict[str, dict], judgments: list[dict], scratch_dir: str,
+              rebuild: bool = False, repeats: int = REPEATS) -> dict:
+    settings = index_settings(config, configs)
+    build = build_index(settings, scratch_dir, rebuild)
+    backend = config.get("backend", "chroma")
+    db_path = os.path.join(INDEX_DIR, settings["name"])
+    if backend == "numpy" and numpy_index.index_dtype(os.path.join(db_path, numpy_index.NUMPY_INDEX_DIRNAME)) is None:
+        # Exported once; pdftovector.py keeps the export current on later builds.
+        import chromadb
+        collection = chromadb.PersistentClient(path=db_path).get_collection(name=pdftovector.COLLECTION_NAME)
+        numpy_index.export_collection(collection, os.path.join(db_path, numpy_index.NUMPY_INDEX_DIRNAME),
+                                      config.get("numpy_dtype", numpy_index.DEFAULT_DTYPE))
+
+    encoder = CachedEncoder(settings["embedding_model"],
+                            cache=EmbeddingCache(settings["embedding_model"],
+                                                 cache_dir=os.path.join(scratch_dir, f"query-{config['name']}")))
+    retrieval.configure(db_path=db_path, encoder=encoder, backend=backend)
+    encoder.encode(["warm-up"])  # Load the model outside the timed queries
+
+    depth = max(CUTOFFS)
+    results, cold, warm = run_queries(config, judgments, depth, repeats)
+    per_query = {judgment["id"]: score_ranking(hits, judgment["relevant"])
+                 for judgment, hits in zip(judgments, results)}
+    metrics = {name: float(np.mean([scores[name] for scores in per_query.values()]))
+               for name in next(iter(per_query.values()))}
+    latency = {
+        "cold_p50_ms": 1000 * float(np.percentile(cold, 50)), "cold_p99_ms": 1000 * float(np.percentile(cold, 99)),
+        "warm_p50_ms": 1000 * float(np.percentile(warm, 50)) if warm else None,
+        "warm_p99_ms": 1000 * float(np.percentile(warm, 99)) if warm else None,
+    }
+    return {"config": config, "index": settings, "build": build, "metrics": metrics, "latency": latency,
+            "per_query": per_query}
+
+
+def print_report(reports: list[dict]) -> None:
+    metric_names = list(reports[0]["metrics"])
+    header = f"{'config':<22}" + "".join(f"{name:>10}" for name in metric_names)
+    header += f"{'p50 ms':>9}{'p99 ms':>9}{'warm p50':>10}{'build s':>9}{'chunks':>8}"
+    print(header)
+    for report in reports:
+        latency = report["latency"]
+        row = f"{report['config']['name']:<22}" + "".join(f"{report['metrics'][name]:>10.3f}" for name in metric_names)
+        row += f"{latency['cold_p50_ms']:>9.1f}{latency['cold_p99_ms']:>9.1f}"
+        row += f"{latency['warm_p50_ms'] if latency['warm_p50_ms'] is not None else float('nan'):>10.1f}"
+        row += f"{report['build']['seconds']:>9.1f}{report['build']['chunks']:>8}"
+        print(row)
+
+
+def main(config_names: Optional[list[str]] = None, judgments_path: str = JUDGMENTS_PATH,
+         configs_path: str = CONFIGS_PATH, rebuild: bool = False, repeats: int = REPEATS,
+         output: Optional[str] = None) -> list[dict]:
+    judgments = load_judgments(judgments_path)
+    configs = {config["name"]: config for config in load_configs(configs_path)}
+    selected = config_names or list(configs)
+    unknown = [name for name in selected if name not in configs]
+    if unknown:
+        raise SystemExit(f"Unknown configuration(s) {unknown}; known: {list(configs)}")
+    logging.info(f"Benchmarking {len(selected)} configuration(s) on {len(judgments)} judged queries from {judgments_path}")
+
+    reports = []
+    with tempfile.TemporaryDirectory(prefix="retrieval-bench-") as scratch_dir:
+        for name in selected:
+            logging.info(f"--- {name} ---")
+            reports.append(benchmark(configs[name], configs, judgments, scratch_dir, rebuild, repeats))
+    print_report(reports)
+
+    output = output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({"judgments": os.path.basename(judgments_path), "reports": reports}, f, indent=2)
+    logging.info(f"Results written to {output}")
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure retrieval quality and latency for index/search configurations.")
+    parser.add_argument("configs", nargs="*", help=f"Configuration names from {CONFIGS_PATH} (default: all).")
+    parser.add_argument("--judgments", default=JUDGMENTS_PATH)
+    parser.add_argument("--config-file", default=CONFIGS_PATH)
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild indexes from scratch to measure build time.")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="Warm (cached-embedding) passes over the queries.")
+    parser.add_argument("--output", help=f"Results JSON (default: {RESULTS_DIR}/<timestamp>.json).")
+    args = parser.parse_args()
+    main(config_names=args.configs or None, judgments_path=args.judgments, configs_path=args.config_file,
+         rebuild=args.rebuild, repeats=args.repeats, output=args.output)
@@ -0,0 +1,285 @@
+import os
+import argparse
+import json
+import logging
+import re
+import shutil
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+# --- Configuration ---
+BM25_DIRNAME = "bm25_index"  # Kept inside the ChromaDB directory, like the ingest manifest
+INDEX_VERSION = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+READ_PAGE_SIZE = 1000  # Chunks read from ChromaDB per request when (re)building
+MIN_CODE_PREFIX_PARTS = 3  # B5.2.1.1.5 is also indexed as B5.2.1.1 and B5.2.1 (content standard, sub-strand)
+
+# Curriculum codes (B5.2.1.1.5, KG1.1.1) are kept whole instead of being split at the dots.
+TOKEN_RE = re.compile(r"[a-z]{1,2}\d+(?:\.\d+)+|[^\W_]+")
+STOPWORDS = frozenset("""a an and are as at be by for from has have in is it its of on or that the their them
+they this to was were will with e g eg""".split())
+
+# Metadata fields the index can filter on, like ChromaDB `where` filters built by retrieval.build_where
+CATEGORICAL_FIELDS = ["subject", "doc_kind"]
+NUMERIC_FIELDS = ["grade_min", "grade_max"]
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def tokenize(text: str, expand_codes: bool = False) -> list[str]:
+    """Lower-cased word and curriculum-code tokens without stopwords.
+
+    With expand_codes (used for indexed chunks), each code is followed by its parent codes, so a
+    query for a content standard also finds the chunks that only mention its indicators.
+    """
+    tokens = []
+    for token in TOKEN_RE.findall(text.casefold()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if expand_codes and "." in token:
+            parts = token.split(".")
+            tokens.extend(".".join(parts[:n]) for n in range(MIN_CODE_PREFIX_PARTS, len(parts)))
+    return tokens
+
+
+def write_fields(directory: str, metadatas: list[dict]) -> dict[str, list[str]]:
+    """Saves the filterable metadata fields as one array per field; returns the categorical value lists."""
+    categories = {}
+    for field in CATEGORICAL_FIELDS:
+        values = sorted({str(meta.get(field, "")) for meta in metadatas})
+        categories[field] = values
+        codes = {value: code for code, value in enumerate(values)}
+        np.save(os.path.join(directory, f"{field}.npy"),
+                np.array([codes[str(meta.get(field, ""))] for meta in metadatas], dtype=np.int16))
+    for field in NUMERIC_FIELDS:
+        np.save(os.path.join(directory, f"{field}.npy"),
+                np.array([meta.get(field, 0) for meta in metadatas], dtype=np.int16))
+    return categories
+
+
+def load_fields(directory: str) -> dict[str, np.ndarray]:
+    return {field: np.load(os.path.join(directory, f"{field}.npy"), mmap_mode="r")
+            for field in CATEGORICAL_FIELDS + NUMERIC_FIELDS}
+
+
+def where_mask(where: Optional[dict], fields: dict[str, np.ndarray], categories: dict[str, list[str]],
+               size: int) -> Optional[np.ndarray]:
+    """Boolean mask of the documents a ChromaDB `where` filter accepts (None = all).
+
+    Supports the operators retrieval.build_where produces: $and/$or, equality, $ne,
+    $lt/$lte/$gt/$gte and $in. Raises ValueError for anything else.
+    """
+    if not where:
+        return None
+    if len(where) == 1 and next(iter(where)) in ("$and", "$or"):
+        operator, clauses = next(iter(where.items()))
+        masks = [where_mask(clause, fields, categories, size) for clause in clauses]
+        masks = [np.ones(size, dtype=bool) if m is None else m for m in masks]
+        return np.logical_and.reduce(masks) if operator == "$and" else np.logical_or.reduce(masks)
+    result = np.ones(size, dtype=bool)
+    for field, condition in where.items():
+        if field not in fields:
+            raise ValueError(f"Index cannot filter on {field!r}")
+        conditions = condition if isinstance(condition, dict) else {"$eq": condition}
+        for operator, value in conditions.items():
+            result &= _compare(np.asarray(fields[field]), categories.get(field), field, operator, value)
+    return result
+
+
+def _compare(column: np.ndarray, values: Optional[list[str]], field: str, operator: str, value) -> np.ndarray:
+    if field in CATEGORICAL_FIELDS:
+        if operator in ("$eq", "$ne"):
+            matched = column == (values.index(str(value)) if str(value) in values else -1)
+            return matched if operator == "$eq" else ~matched
+        if operator == "$in":
+            codes = [values.index(str(v)) for v in value if str(v) in values]
+            return np.isin(column, codes)
+        raise ValueError(f"Unsupported operator {operator} on {field!r}")
+    comparisons = {"$eq": np.equal, "$ne": np.not_equal, "$lt": np.less, "$lte": np.less_equal,
+                   "$gt": np.greater, "$gte": np.greater_equal}
+    if operator == "$in":
+        return np.isin(column, value)
+    if operator not in comparisons:
+        raise ValueError(f"Unsupported operator {operator} on {field!r}")
+    return comparisons[operator](column, value)
+
+
+def _write_arrays(directory: str, ids: list[str], documents: list[str], metadatas: list[dict],
+                  k1: float, b: float, collection_count: int) -> None:
+    term_counts: list[Counter] = []
+    doc_lengths = np.zeros(len(documents), dtype=np.int32)
+    vocabulary: dict[str, int] = {}
+    for i, document in enumerate(documents):
+        tokens = tokenize(document or "", expand_codes=True)
+        counts = Counter(tokens)
+        doc_lengths[i] = len(tokens)
+        term_counts.append(counts)
+        for term in counts:
+            vocabulary.setdefault(term, 0)
+            vocabulary[term] += 1
+
+    # CSR layout: postings of term t are doc_ids/tfs[indptr[t]:indptr[t + 1]], in document order.
+    terms = sorted(vocabulary)
+    term_ids = {term: t for t, term in enumerate(terms)}
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([vocabulary[term] for term in terms])
+    doc_ids = np.zeros(indptr[-1], dtype=np.int32)
+    tfs = np.zeros(indptr[-1], dtype=np.uint16)
+    fill = indptr[:-1].copy()
+    for doc, counts in enumerate(term_counts):
+        for term, tf in counts.items():
+            t = term_ids[term]
+            doc_ids[fill[t]] = doc
+            tfs[fill[t]] = min(tf, np.iinfo(np.uint16).max)
+            fill[t] += 1
+    n_docs = len(documents)
+    df = np.diff(indptr).astype(np.float64)
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    categories = write_fields(directory, metadatas)
+
+    np.save(os.path.join(directory, "indptr.npy"), indptr)
+    np.save(os.path.join(directory, "doc_ids.npy"), doc_ids)
+    np.save(os.path.join(directory, "tfs.npy"), tfs)
+    np.save(os.path.join(directory, "idf.npy"), idf)
+    np.save(os.path.join(directory, "doc_lengths.npy"), doc_lengths)
+    with open(os.path.join(directory, "terms.json"), "w", encoding="utf-8") as f:
+        json.dump(terms, f)
+    with open(os.path.join(directory, "ids.json"), "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+    # meta.json is written last and marks a complete index.
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": INDEX_VERSION, "k1": k1, "b": b, "n_docs": n_docs,
+                   "avgdl": float(doc_lengths.mean()) if n_docs else 0.0,
+                   "collection_count": collection_count, "categories": categories}, f)
+
+
+def build_index(ids: list[str], documents: list[str], metadatas: list[dict], directory: str,
+                k1: float = BM25_K1, b: float = BM25_B, collection_count: Optional[int] = None) -> None:
+    """Writes a BM25 index over the given chunks to `directory`, replacing any previous index.
+
+    The new index is written beside the old one and swapped in, so readers never see a partial index.
+    """
+    tmp_directory = directory + ".tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    _write_arrays(tmp_directory, ids, documents, metadatas, k1, b,
+                  len(ids) if collection_count is None else collection_count)
+    old_directory = directory + ".old"
+    shutil.rmtree(old_directory, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old_directory)
+    os.replace(tmp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+
+
+def rebuild_from_collection(collection, directory: str, page_size: int = READ_PAGE_SIZE) -> int:
+    """Rebuilds the index from every chunk stored in a ChromaDB collection; returns the chunk count."""
+    ids, documents, metadatas = [], [], []
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+        offset += len(page["ids"])
+    build_index(ids, documents, metadatas, directory, collection_count=len(ids))
+    logging.info(f"Built BM25 index over {len(ids)} chunks in {directory}.")
+    return len(ids)
+
+
+def index_is_current(directory: str, collection_count: int) -> bool:
+    """True if a complete index exists for a collection of this size."""
+    try:
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return False
+    return meta.get("version") == INDEX_VERSION and meta.get("collection_count") == collection_count
+
+
+class BM25Index:
+    """Read-only, memory-mapped BM25 index with ChromaDB-style metadata filtering."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(directory, "terms.json"), "r", encoding="utf-8") as f:
+            self.term_ids = {term: t for t, term in enumerate(json.load(f))}
+        with open(os.path.join(directory, "ids.json"), "r", encoding="utf-8") as f:
+            self.ids: list[str] = json.load(f)
+
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+        self.indptr = load("indptr")
+        self.doc_ids = load("doc_ids")
+        self.tfs = load("tfs")
+        self.idf = load("idf")
+        k1, b = self.meta["k1"], self.meta["b"]
+        avgdl = self.meta["avgdl"] or 1.0
+        # Per-document part of the BM25 denominator, precomputed once
+        self._norm = (k1 * (1 - b + b * np.asarray(load("doc_lengths"), dtype=np.float32) / avgdl)).astype(np.float32)
+        self._k1 = k1
+        self.fields = load_fields(directory)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def mask(self, where: Optional[dict]) -> Optional[np.ndarray]:
+        """Boolean mask of the documents a ChromaDB `where` filter accepts (None = all); see where_mask."""
+        return where_mask(where, self.fields, self.meta["categories"], len(self))
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for the query."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.term_ids.get(term)
+            if t is None:
+                continue
+            start, end = self.indptr[t], self.indptr[t + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            # Each document appears once per term's postings, so fancy-index accumulation is safe.
+            scores[docs] += self.idf[t] * tf * (self._k1 + 1) / (tf + self._norm[docs])
+        return scores
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> list[tuple[str, float]]:
+        """The k best-scoring (chunk id, score) pairs among the documents in mask, best first."""
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self.ids[i], float(scores[i])) for i in order]
+
+
+if __name__ == "__main__":
+    # Rebuilds the index from the collection (pdftovector.py does this after every ingest), e.g.
+    # python bm25_index.py --query "B5.2.1.1"
+    import chromadb
+
+    from pdftovector import CHROMA_DB_PATH, COLLECTION_NAME
+
+    parser = argparse.ArgumentParser(description="Build the BM25 index over the syllabus collection and optionally query it.")
+    parser.add_argument("--db", default=CHROMA_DB_PATH)
+    parser.add_argument("--query", help="Print the top chunks for this query after building.")
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    collection = chromadb.PersistentClient(path=args.db).get_collection(name=COLLECTION_NAME)
+    directory = os.path.join(args.db, BM25_DIRNAME)
+    rebuild_from_collection(collection, directory)
+    if args.query:
+        for chunk_id, score in BM25Index(directory).search(args.query, args.k):
+            print(f"{score:8.3f}  {chunk_id}")
@@ -1,15 +1,15 @@
 import os
-import chromadb
 import logging
 
+from audit_corpus import source_pdfs
+
 # --- Configuration ---
 # Ensure these match your ingestion script (process_syllabi_to_vectordb.py)
 # This is the directory where your original PDF files are stored.
 PDF_DIRECTORY = "./syllabus/"
 
-# Ensure these match your ingestion script and checksourcepdf.py
+# Ensure this matches your ingestion script
 CHROMA_DB_PATH = "./syllabusvectordb"
-COLLECTION_NAME = "syllabus_collection"
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -34,45 +34,14 @@ def get_pdfs_from_directory(directory_path: str) -> set[str]:
 
 def get_source_pdfs_from_chromadb() -> set[str]:
     """
-    Connects to ChromaDB, retrieves all metadata, and returns unique source_pdf values.
+    Returns the unique source_pdf values in ChromaDB (see audit_corpus.py for chunk counts and hashes).
     """
-    source_pdfs_in_db = set()
     try:
-        # 1. Initialize ChromaDB Client
-        client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-        logging.info(f"ChromaDB client initialized. Accessing data from {CHROMA_DB_PATH}")
-
-        # 2. Get the Collection
-        collection = client.get_collection(name=COLLECTION_NAME)
-        logging.info(f"Successfully connected to collection: '{COLLECTION_NAME}'")
-
-        total_documents = collection.count()
-        if total_documents == 0:
-            logging.warning("The collection is empty. No source PDFs found in DB metadata.")
-            return set()
-
-        logging.info(f"Total documents in collection: {total_documents}. Fetching metadata...")
-
-        # 3. Retrieve all metadata
-        results = collection.get(
-            include=['metadatas']
-        )
-
-        if not results or not results.get('metadatas'):
-            logging.warning("No metadata found in the collection.")
-            return set()
-
-        # 4. Extract unique source_pdf values
-        for metadata_item in results['metadatas']:
-            if metadata_item and 'source_pdf' in metadata_item:
-                source_pdfs_in_db.add(metadata_item['source_pdf'])
-
-        logging.info(f"Found {len(source_pdfs_in_db)} unique source_pdf entries in ChromaDB metadata.")
+        source_pdfs_in_db = source_pdfs(CHROMA_DB_PATH)
+        logging.info(f"Found {len(source_pdfs_in_db)} unique source_pdf entries in ChromaDB.")
         return source_pdfs_in_db
-
     except Exception as e:
         logging.error(f"An error occurred while accessing ChromaDB: {e}")
-        logging.error("Please ensure the CHROMA_DB_PATH and COLLECTION_NAME are correct.")
         return set()
 
 def main():
@@ -0,0 +1,216 @@
+import os
+import json
+import hashlib
+import heapq
+import logging
+import re
+import threading
+import unicodedata
+from typing import Optional
+
+import numpy as np
+
+# --- Configuration ---
+# One sub-directory per embedding model, each holding a memory-mapped float32 matrix
+# (vectors.f32) and a JSON index mapping text hashes to matrix rows.
+EMBEDDING_CACHE_DIR = "./embedding_cache"
+EMBEDDING_CACHE_MAX_ENTRIES = 100_000  # Least recently used entries are evicted beyond this
+EVICTION_FRACTION = 0.05  # Share of entries evicted at once when the cache is full
+INITIAL_CAPACITY_ROWS = 1024
+
+
+def normalize_text(text: str) -> str:
+    """Normalizes text for cache lookups: Unicode NFC and collapsed whitespace."""
+    return ' '.join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model_name: str, text: str) -> str:
+    """Hash of (model name, normalized text) used as the cache key."""
+    return hashlib.blake2b(f"{model_name}\0{normalize_text(text)}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache for one model with hit/miss counters and LRU eviction.
+
+    Hits only update the in-memory recency; the index is rewritten by save() when entries were
+    added or evicted (carrying the recency along), not after every lookup.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR,
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.directory = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.index_path = os.path.join(self.directory, "index.json")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._dim: Optional[int] = None
+        self._rows: dict[str, int] = {}
+        self._last_used: dict[str, int] = {}
+        self._free_rows: list[int] = []
+        self._capacity = 0
+        self._tick = 0
+        self._vectors: Optional[np.memmap] = None
+        self._dirty = False
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.index_path) or not os.path.exists(self.vectors_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"Ignoring unreadable embedding cache index {self.index_path}: {e}")
+            return
+        if index.get("model_name") != self.model_name:
+            return
+        self._dim = index["dim"]
+        self._rows = index["rows"]
+        self._last_used = index["last_used"]
+        self._tick = index["tick"]
+        self._capacity = os.path.getsize(self.vectors_path) // (4 * self._dim)
+        used = set(self._rows.values())
+        self._free_rows = [row for row in range(self._capacity) if row not in used]
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self._dim))
+        logging.info(f"Loaded embedding cache for '{self.model_name}' with {len(self._rows)} entries.")
+
+    def _grow(self, needed_rows: int) -> None:
+        """Extends the backing file so at least needed_rows more rows are free."""
+        new_capacity = max(INITIAL_CAPACITY_ROWS, self._capacity)
+        while new_capacity - self._capacity + len(self._free_rows) < needed_rows:
+            new_capacity *= 2
+        new_capacity = min(new_capacity, max(self.max_entries, self._capacity))
+        if new_capacity <= self._capacity:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if self._vectors is not None:
+            self._vectors.flush()
+            del self._vectors
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(new_capacity * self._dim * 4)
+        self._free_rows.extend(range(self._capacity, new_capacity))
+        self._capacity = new_capacity
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self._dim))
+
+    def _evict(self, count: int) -> None:
+        """Drops the `count` least recently used entries."""
+        for key in heapq.nsmallest(count, self._last_used, key=self._last_used.__getitem__):
+            self._free_rows.append(self._rows.pop(key))
+            del self._last_used[key]
+        self.evictions += count
+
+    def get_many(self, keys: list[str]) -> list[Optional[np.ndarray]]:
+        """Returns the cached vector for each key, or None where it is missing."""
+        results: list[Optional[np.ndarray]] = []
+        with self._lock:
+            for key in keys:
+                row = self._rows.get(key)
+                if row is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self._tick += 1
+                self._last_used[key] = self._tick
+                results.append(np.array(self._vectors[row]))
+        return results
+
+    def put_many(self, keys: list[str], vectors: np.ndarray) -> None:
+        """Stores vectors (one row per key), evicting old entries if the cache is full."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+            elif vectors.shape[1] != self._dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match cache dimension {self._dim}.")
+            new_keys = {key: i for i, key in enumerate(keys) if key not in self._rows}
+            if not new_keys:
+                return
+            # Never try to keep more entries than fit in the cache.
+            new_items = list(new_keys.items())[-self.max_entries:]
+            overflow = len(self._rows) + len(new_items) - self.max_entries
+            if overflow > 0:
+                self._evict(min(len(self._rows), max(overflow, int(self.max_entries * EVICTION_FRACTION))))
+            if len(self._free_rows) < len(new_items):
+                self._grow(len(new_items))
+            for key, i in new_items:
+                row = self._free_rows.pop()
+                self._vectors[row] = vectors[i]
+                self._rows[key] = row
+                self._tick += 1
+                self._last_used[key] = self._tick
+            self._dirty = True
+
+    def save(self) -> None:
+        """Flushes vectors and writes the index atomically, if entries were added or evicted since the last save."""
+        with self._lock:
+            if not self._dirty or self._dim is None:
+                return
+            self._vectors.flush()
+            index = {"model_name": self.model_name, "dim": self._dim, "tick": self._tick,
+                     "rows": self._rows, "last_used": self._last_used}
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class CachedEncoder:
+    """SentenceTransformer wrapper that consults an EmbeddingCache before running the model.
+
+    The model is only loaded on the first cache miss. Instances can be passed to ChromaDB
+    as an embedding_function.
+    """
+
+    def __init__(self, model_name: str, cache: Optional[EmbeddingCache] = None, batch_size: int = 64):
+        self.model_name = model_name
+        self.cache = cache if cache is not None else EmbeddingCache(model_name)
+        self.batch_size = batch_size
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                logging.info(f"Loading embedding model '{self.model_name}'...")
+                self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def encode(self, texts: list[str], batch_size: Optional[int] = None) -> np.ndarray:
+        """Returns a float32 matrix with one embedding per text."""
+        keys = [cache_key(self.model_name, text) for text in texts]
+        cached = self.cache.get_many(keys)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            computed = self.model.encode([texts[i] for i in missing], batch_size=batch_size or self.batch_size,
+                                         convert_to_numpy=True, show_progress_bar=False).astype(np.float32)
+            self.cache.put_many([keys[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                cached[i] = vector
+        if not cached:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(cached)
+
+    def __call__(self, input: list[str]) -> list[list[float]]:
+        """ChromaDB embedding function interface."""
+        return self.encode(list(input)).tolist()
@@ -0,0 +1,269 @@
+import os
+import argparse
+import json
+import logging
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from llm_engine import MODELS_DIR, N_THREADS, find_model_file
+from sft_data import iter_holdout_texts, iter_jsonl, resolve_data_files
+
+# --- Configuration ---
+ADAPTER_DIR = "./llama3.2-1b-syllabus-finetuned"  # OUTPUT_DIR of finetune_llama.py
+FINETUNE_DATA_FILE = "./syllabus_finetune_data.jsonl"
+LLAMA_CPP_DIR = os.environ.get("SUGURU_LLAMA_CPP_DIR", "./llama.cpp")  # Checkout with the convert script and a build of the quantize tool
+GGUF_NAME = "suguru-syllabus-1b"
+# float16 merge written here, next to the adapter. finetune_llama.py's final_merged_checkpoint is
+# merged onto the 4-bit training weights and cannot be converted.
+MERGED_DIR_NAME = "merged_fp16"
+QUANT_TYPES = ["Q4_K_M", "Q5_K_M", "Q8_0"]
+EVAL_SAMPLES = 50  # Held-out entries scored for perplexity
+EVAL_CTX = 1024
+LATENCY_PROMPTS = 5  # Held-out prompts timed for generation latency
+LATENCY_MAX_TOKENS = 64
+PERPLEXITY_TOLERANCE = 0.03  # Quantizations within 3% of the best perplexity compete on latency, then size
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def merged_is_current(merged_dir: str, adapter_file: Path) -> bool:
+    """True if merged_dir holds an unquantized merge saved after the adapter was."""
+    merged_config = Path(merged_dir) / "config.json"
+    if not merged_config.exists() or merged_config.stat().st_mtime < adapter_file.stat().st_mtime:
+        return False
+    try:
+        with open(merged_config, "r", encoding="utf-8") as f:
+            quantized = "quantization_config" in json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return False
+    if quantized:
+        logging.warning(f"{merged_dir} was merged onto quantized weights; merging again in float16.")
+    return not quantized
+
+
+def merge_adapter(adapter_dir: str, merged_dir: str) -> str:
+    """Merges the LoRA adapter into its base model in float16 and saves it with the tokenizer.
+
+    The merge is redone when the adapter is newer than the saved merged model or that model was
+    merged onto quantized weights. Merging onto float16 base weights (rather than the 4-bit
+    weights used in training) keeps the merge exact and convertible to GGUF.
+    """
+    adapter_file = next((Path(adapter_dir) / name for name in ("adapter_model.safetensors", "adapter_model.bin")
+                         if (Path(adapter_dir) / name).exists()), None)
+    if adapter_file is None:
+        raise FileNotFoundError(f"No LoRA adapter in {adapter_dir}; run finetune_llama.py first.")
+    if merged_is_current(merged_dir, adapter_file):
+        logging.info(f"Using merged model at {merged_dir}")
+        return merged_dir
+
+    import torch
+    from peft import AutoPeftModelForCausalLM
+    from transformers import AutoTokenizer
+
+    logging.info(f"Merging {adapter_dir} into its base model...")
+    model = AutoPeftModelForCausalLM.from_pretrained(adapter_dir, torch_dtype=torch.float16, low_cpu_mem_usage=True)
+    model = model.merge_and_unload()
+    model.save_pretrained(merged_dir, safe_serialization=True)
+    AutoTokenizer.from_pretrained(adapter_dir).save_pretrained(merged_dir)
+    logging.info(f"Merged model saved to {merged_dir}")
+    return merged_dir
+
+
+def _find_tool(names: list[str], search_dirs: list[Path]) -> Optional[Path]:
+    for name in names:
+        for directory in search_dirs:
+            if (directory / name).exists():
+                return directory / name
+        found = shutil.which(name)
+        if found:
+            return Path(found)
+    return None
+
+
+def find_llama_cpp_tools(llama_cpp_dir: str = LLAMA_CPP_DIR) -> tuple[Path, Path]:
+    """(HF-to-GGUF convert script, quantize binary); both have been renamed across llama.cpp versions."""
+    root = Path(llama_cpp_dir)
+    convert = _find_tool(["convert_hf_to_gguf.py", "convert-hf-to-gguf.py"], [root])
+    quantize = _find_tool(["llama-quantize", "quantize"], [root / "build" / "bin", root])
+    if convert is None or quantize is None:
+        raise FileNotFoundError(f"llama.cpp convert script or quantize binary not found under {root} "
+                                f"(set SUGURU_LLAMA_CPP_DIR to a built llama.cpp checkout).")
+    return convert, quantize
+
+
+def _run(command: list) -> None:
+    logging.info("Running: " + " ".join(str(part) for part in command))
+    subprocess.run([str(part) for part in command], check=True)
+
+
+def convert_to_gguf(merged_dir: str, gguf_dir: Path, convert_script: Path) -> Path:
+    output = gguf_dir / f"{GGUF_NAME}-f16.gguf"
+    if not output.exists() or output.stat().st_mtime < (Path(merged_dir) / "config.json").stat().st_mtime:
+        _run([sys.executable, convert_script, merged_dir, "--outtype", "f16", "--outfile", output])
+    return output
+
+
+def quantize(f16_path: Path, gguf_dir: Path, quantize_binary: Path, quant_types: list[str]) -> dict[str, Path]:
+    outputs = {}
+    for quant_type in quant_types:
+        output = gguf_dir / f"{GGUF_NAME}-{quant_type}.gguf"
+        if not output.exists() or output.stat().st_mtime < f16_path.stat().st_mtime:
+            _run([quantize_binary, f16_path, output, quant_type])
+        outputs[quant_type] = output
+    return outputs
+
+
+def perplexity(model_path: Path, texts: list[str], n_ctx: int = EVAL_CTX) -> dict:
+    """Token-level perplexity over texts, plus prompt-evaluation throughput."""
+    from llama_cpp import Llama
+
+    llm = Llama(model_path=str(model_path), n_ctx=n_ctx, n_threads=N_THREADS, logits_all=True, verbose=False)
+    nll, count, eval_seconds = 0.0, 0, 0.0
+    for text in texts:
+        tokens = llm.tokenize(text.encode("utf-8"), add_bos=False, special=True)[:n_ctx]
+        if len(tokens) < 2:
+            continue
+        llm.reset()
+        start = time.perf_counter()
+        llm.eval(tokens)
+        eval_seconds += time.perf_counter() - start
+        logits = np.asarray(llm.scores[:len(tokens) - 1], dtype=np.float64)
+        peak = logits.max(axis=1, keepdims=True)
+        log_norm = (peak[:, 0] + np.log(np.exp(logits - peak).sum(axis=1)))
+        targets = np.asarray(tokens[1:])
+        nll -= float((logits[np.arange(len(targets)), targets] - log_norm).sum())
+        count += len(targets)
+    del llm
+    return {"perplexity": float(np.exp(nll / count)) if count else float("nan"),
+            "eval_tokens_per_second": count / eval_seconds if eval_seconds else 0.0}
+
+
+def generation_latency(model_path: Path, prompts: list[str], max_tokens: int = LATENCY_MAX_TOKENS) -> dict:
+    """Load time, time to first token and per-token decode time, as main.py's loader would run the model."""
+    from llama_cpp import Llama
+
+    start = time.perf_counter()
+    llm = Llama(model_path=str(model_path), n_ctx=EVAL_CTX, n_threads=N_THREADS, verbose=False)
+    load_seconds = time.perf_counter() - start
+    first_token, per_token = [], []
+    for prompt in prompts:
+        start = time.perf_counter()
+        first = None
+        produced = 0
+        for _ in llm.create_completion(prompt, max_tokens=max_tokens, temperature=0.0, stream=True):
+            produced += 1
+            if first is None:
+                first = time.perf_counter() - start
+        total = time.perf_counter() - start
+        if first is not None:
+            first_token.append(first)
+            if produced > 1:
+                per_token.append((total - first) / (produced - 1))
+    del llm
+    return {"load_seconds": load_seconds,
+            "first_token_ms": 1000 * float(np.median(first_token)) if first_token else float("nan"),
+            "ms_per_token": 1000 * float(np.median(per_token)) if per_token else float("nan")}
+
+
+def choose(results: dict[str, dict], tolerance: float = PERPLEXITY_TOLERANCE) -> str:
+    """Among quantizations within tolerance of the best perplexity, the fastest per token, then the smallest."""
+    best = min(result["perplexity"] for result in results.values())
+    eligible = [name for name, result in results.items() if result["perplexity"] <= best * (1 + tolerance)]
+    return min(eligible, key=lambda name: (results[name]["ms_per_token"], results[name]["size_mb"]))
+
+
+def print_report(results: dict[str, dict], chosen: str) -> None:
+    print(f"{'quant':<8} {'size MB':>8} {'ppl':>8} {'eval tok/s':>11} {'load s':>7} {'first ms':>9} {'ms/tok':>7}")
+    for name, r in results.items():
+        marker = "  <- chosen" if name == chosen else ""
+        print(f"{name:<8} {r['size_mb']:>8.0f} {r['perplexity']:>8.3f} {r['eval_tokens_per_second']:>11.1f} "
+              f"{r['load_seconds']:>7.2f} {r['first_token_ms']:>9.0f} {r['ms_per_token']:>7.1f}{marker}")
+
+
+def evaluation_texts(data_file: str, eval_file: Optional[str] = None, samples: int = EVAL_SAMPLES) -> tuple[list[str], str]:
+    """(texts, description) to evaluate on: eval_file if given, else the fine-tuning holdout split.
+
+    Without held-out entries, falls back to the first fine-tuning entries. The model has seen
+    those, so perplexities are optimistic, but quantizations are still compared on equal terms.
+    """
+    if eval_file:
+        sources = [(iter_jsonl(resolve_data_files(eval_file)), eval_file)]
+    else:
+        data_files = resolve_data_files(data_file)
+        sources = [(({"text": text} for text in iter_holdout_texts(data_files)), f"held-out entries of {data_file}"),
+                   (iter_jsonl(data_files), f"training entries of {data_file} (no held-out entries)")]
+    for entries, description in sources:
+        texts = []
+        for entry in entries:
+            texts.append(entry["text"])
+            if len(texts) >= samples:
+                break
+        if texts:
+            return texts, description
+        if not eval_file:
+            logging.warning(f"No held-out entries in {data_file}; evaluating on training entries instead "
+                            f"(pass --eval-file for unseen data).")
+    raise SystemExit(f"No entries to evaluate on in {eval_file or data_file}.")
+
+
+def main(adapter_dir: str = ADAPTER_DIR, data_file: str = FINETUNE_DATA_FILE, quant_types: Optional[list[str]] = None,
+         merged_dir: Optional[str] = None, install: bool = True, chosen: Optional[str] = None,
+         eval_file: Optional[str] = None):
+    quant_types = quant_types or QUANT_TYPES
+    merged_dir = merged_dir or os.path.join(adapter_dir, MERGED_DIR_NAME)
+    gguf_dir = Path(adapter_dir) / "gguf"
+    gguf_dir.mkdir(parents=True, exist_ok=True)
+
+    convert_script, quantize_binary = find_llama_cpp_tools()
+    merge_adapter(adapter_dir, merged_dir)
+    f16_path = convert_to_gguf(merged_dir, gguf_dir, convert_script)
+    artifacts = quantize(f16_path, gguf_dir, quantize_binary, quant_types)
+
+    texts, description = evaluation_texts(data_file, eval_file)
+    # Latency is measured on the user turns, as the app would prompt the model.
+    prompts = [text.rpartition("<|start_header_id|>assistant")[0] + "<|start_header_id|>assistant<|end_header_id|>\n\n"
+               for text in texts[:LATENCY_PROMPTS]]
+    logging.info(f"Evaluating {len(artifacts)} quantizations on {len(texts)} {description}...")
+
+    results = {}
+    for name, path in artifacts.items():
+        results[name] = {"path": str(path), "size_mb": path.stat().st_size / 2 ** 20,
+                         **perplexity(path, texts), **generation_latency(path, prompts)}
+        logging.info(f"{name}: {results[name]}")
+
+    if chosen is not None and chosen not in results:
+        raise SystemExit(f"--choose {chosen} is not one of the exported quantizations {list(results)}.")
+    chosen = chosen or choose(results)
+    print_report(results, chosen)
+    with open(gguf_dir / "export_report.json", "w", encoding="utf-8") as f:
+        json.dump({"chosen": chosen, "eval_entries": len(texts), "eval_data": description, "results": results}, f, indent=2)
+
+    if install:
+        destination = Path(MODELS_DIR) / artifacts[chosen].name
+        os.makedirs(MODELS_DIR, exist_ok=True)
+        shutil.copy2(artifacts[chosen], destination)
+        logging.info(f"Installed {chosen} as {destination}")
+        loaded = find_model_file(MODELS_DIR)
+        if loaded is not None and Path(loaded).resolve() != destination.resolve():
+            logging.warning(f"main.py will load {loaded} first; remove it or set SUGURU_MODEL_PATH={destination}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the LoRA adapter, export quantized GGUF files and install the best one.")
+    parser.add_argument("--adapter-dir", default=ADAPTER_DIR)
+    parser.add_argument("--data", default=FINETUNE_DATA_FILE, help="Fine-tuning data; its holdout split is used for evaluation.")
+    parser.add_argument("--eval-file", help="JSONL with a \"text\" field to evaluate on instead of the holdout split.")
+    parser.add_argument("--quant", nargs="+", default=QUANT_TYPES, help="llama.cpp quantization types to export.")
+    parser.add_argument("--merged-dir", help=f"Merged float16 HF checkpoint (default: <adapter-dir>/{MERGED_DIR_NAME}).")
+    parser.add_argument("--choose", help="Install this quantization instead of the automatic choice.")
+    parser.add_argument("--no-install", action="store_true", help=f"Compare only; don't copy the chosen file to {MODELS_DIR}/.")
+    args = parser.parse_args()
+    main(adapter_dir=args.adapter_dir, data_file=args.data, quant_types=args.quant, merged_dir=args.merged_dir,
+         install=not args.no_install, chosen=args.choose, eval_file=args.eval_file)
@@ -0,0 +1,114 @@
+import os
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# --- Configuration ---
+FEEDBACK_CACHE_PATH = "./data/feedback_cache.sqlite3"
+FEEDBACK_CACHE_MAX_ENTRIES = 20_000  # Least recently used entries are dropped beyond this
+FEEDBACK_CACHE_TTL_SECONDS = 7 * 24 * 3600  # Feedback older than this is regenerated
+PRUNE_EVERY_PUTS = 100
+
+
+def normalize_answer(answer: str) -> str:
+    """Case- and whitespace-insensitive form of an answer, ignoring trailing punctuation."""
+    return ' '.join(answer.split()).casefold().rstrip(".!?")
+
+
+def feedback_key(exercise_id: str, answer: str, model_version: str) -> str:
+    return hashlib.sha256(f"{model_version}\0{exercise_id}\0{normalize_answer(answer)}".encode("utf-8")).hexdigest()
+
+
+class FeedbackCache:
+    """Disk-backed LRU cache of generated feedback, shared by all sessions and processes.
+
+    Keyed on (exercise ID, normalized answer, model version). Entries expire after
+    ttl_seconds and the least recently used ones are dropped beyond max_entries.
+    Hit/miss counters are kept both for this process and, in the database, for its lifetime.
+    """
+
+    def __init__(self, path: str = FEEDBACK_CACHE_PATH, max_entries: int = FEEDBACK_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = FEEDBACK_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS feedback (
+                key TEXT PRIMARY KEY,
+                exercise_id TEXT NOT NULL,
+                feedback TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS feedback_last_access ON feedback (last_access)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _count(self, name: str) -> None:
+        self._conn.execute("INSERT INTO counters (name, value) VALUES (?, 1) "
+                           "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def get(self, exercise_id: str, answer: str, model_version: str) -> Optional[str]:
+        """Returns cached feedback, or None on a miss or expired entry."""
+        key = feedback_key(exercise_id, answer, model_version)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT feedback, created_at FROM feedback WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM feedback WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                self._count("misses")
+                return None
+            self._conn.execute("UPDATE feedback SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self.hits += 1
+            self._count("hits")
+            return row[0]
+
+    def put(self, exercise_id: str, answer: str, model_version: str, feedback: str) -> None:
+        key = feedback_key(exercise_id, answer, model_version)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO feedback (key, exercise_id, feedback, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)", (key, exercise_id, feedback, now, now))
+            self._puts += 1
+            if self._puts % PRUNE_EVERY_PUTS == 0:
+                self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        expired = self._conn.execute("DELETE FROM feedback WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+        count = self._conn.execute("SELECT COUNT(*) FROM feedback").fetchone()[0]
+        evicted = 0
+        if count > self.max_entries:
+            evicted = self._conn.execute(
+                "DELETE FROM feedback WHERE key IN (SELECT key FROM feedback ORDER BY last_access LIMIT ?)",
+                (count - self.max_entries,)).rowcount
+        if expired or evicted:
+            logging.info(f"Feedback cache pruned {expired} expired and {evicted} least recently used entries.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM feedback").fetchone()[0]
+            counters = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+        lookups = self.hits + self.misses
+        lifetime_hits = counters.get("hits", 0)
+        lifetime_lookups = lifetime_hits + counters.get("misses", 0)
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "lifetime_hits": lifetime_hits,
+            "lifetime_hit_rate": lifetime_hits / lifetime_lookups if lifetime_lookups else 0.0,
+        }
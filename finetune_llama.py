@@ -1,17 +1,37 @@
 import os
+import argparse
+import math
+import resource
+import time
 import torch
-from datasets import load_dataset
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
     BitsAndBytesConfig,
+    Trainer,
+    TrainerCallback,
     TrainingArguments,
     LlamaTokenizerFast, # Llama 3 uses LlamaTokenizerFast
 )
+from transformers.trainer_utils import get_last_checkpoint
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
-from trl import SFTTrainer
 import logging
 
+from sft_data import (
+    MIN_TRANSFORMERS_FOR_PACKING,
+    SFT_CACHE_DIR,
+    PackedCollator,
+    PackedDataset,
+    PaddedCollator,
+    PaddedDataset,
+    build_token_cache,
+    pack_sequences,
+    padding_ratio,
+    resolve_data_files,
+    transformers_supports_packing,
+    transformers_version,
+)
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -38,18 +58,109 @@ MAX_GRAD_NORM = 0.3
 WARMUP_RATIO = 0.03
 LR_SCHEDULER_TYPE = "cosine"
 MAX_SEQ_LENGTH = 1024 # Adjust based on your data and VRAM. Llama 3.2 1B context length is 131072, but fine-tuning often uses smaller.
+# Pack several short samples into each MAX_SEQ_LENGTH row (with attention kept inside each sample) instead of
+# padding every sample; falls back to length-bucketed batches on transformers versions without 4D mask support.
+USE_PACKING = True
 
 # Quantization config (for QLoRA - 4-bit NormalFloat)
 USE_4BIT_QUANTIZATION = True # Set to True to use QLoRA, False for LoRA without 4-bit.
 BNB_4BIT_COMPUTE_DTYPE = "bfloat16" # Or "float16" if bfloat16 not supported
 BNB_4BIT_QUANT_TYPE = "nf4" # "nf4" (NormalFloat4) or "fp4"
 
-def main():
-    logging.info(f"Starting fine-tuning for model: {MODEL_NAME}")
+# CPU training (used automatically when no CUDA device is available)
+# bitsandbytes 4-bit and paged 8-bit optimizers need CUDA, so CPU runs train plain LoRA with AdamW.
+CPU_THREADS = int(os.environ.get("SUGURU_TRAIN_THREADS", os.cpu_count() or 1)) # Intra-op threads (matrix kernels)
+CPU_INTEROP_THREADS = int(os.environ.get("SUGURU_TRAIN_INTEROP_THREADS", 2)) # Inter-op threads (independent ops)
+CPU_OPTIM = "adamw_torch"
+GRADIENT_CHECKPOINTING = True # Recompute activations in the backward pass; trades ~30% speed for much less RAM
+
+# Checkpoints
+SAVE_STEPS = 100 # Save a resumable checkpoint every N optimizer steps
+SAVE_TOTAL_LIMIT = 3 # Older step checkpoints are deleted
+
+def cpu_supports_bf16() -> bool:
+    """True if the CPU has native bfloat16 instructions (AVX512-BF16 or AMX), where bf16 autocast pays off."""
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ThroughputCallback(TrainerCallback):
+    """Logs effective (non-padding) training tokens per second and the padding ratio of the batches seen.
+
+    With log_every_step, each optimizer step's time, throughput and the process's peak RSS are also logged.
+    """
+
+    def __init__(self, collator, log_every_step: bool = False):
+        self.collator = collator
+        self.log_every_step = log_every_step
+        self._start = None
+        self._real = self._total = 0
+        self._step_start = None
+        self._step_real = 0
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self._start = time.perf_counter()
+        self._real, self._total = self.collator.real_tokens, self.collator.total_tokens
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        if self._step_start is None:
+            self._step_start = time.perf_counter()
+            self._step_real = self.collator.real_tokens
+
+    def on_step_end(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        if self.log_every_step and self._step_start is not None:
+            elapsed = now - self._step_start
+            tokens = self.collator.real_tokens - self._step_real
+            logging.info(f"Step {state.global_step}/{state.max_steps}: {elapsed:.2f}s, "
+                         f"{tokens / elapsed if elapsed else 0.0:.1f} tokens/s, peak RSS {peak_rss_mb():.0f} MB")
+        self._step_start = now
+        self._step_real = self.collator.real_tokens
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs is None or self._start is None or "loss" not in logs:
+            return
+        elapsed = time.perf_counter() - self._start
+        real = self.collator.real_tokens - self._real
+        total = self.collator.total_tokens - self._total
+        logs["effective_tokens_per_second"] = round(real / elapsed, 1) if elapsed else 0.0
+        logs["padding_ratio"] = round(1 - real / total, 4) if total else 0.0
+        logs["peak_rss_mb"] = round(peak_rss_mb())
+        self._start = time.perf_counter()
+        self._real, self._total = self.collator.real_tokens, self.collator.total_tokens
+
+
+def main(model_name: str = MODEL_NAME, data_file: str = FINETUNE_DATA_FILE, output_dir: str = OUTPUT_DIR,
+         max_seq_length: int = MAX_SEQ_LENGTH, use_packing: bool = USE_PACKING,
+         use_4bit: bool = USE_4BIT_QUANTIZATION, max_steps: int = -1, use_cpu: bool = False,
+         gradient_checkpointing: bool = GRADIENT_CHECKPOINTING, save_steps: int = SAVE_STEPS, resume: bool = True):
+    logging.info(f"Starting fine-tuning for model: {model_name}")
+
+    use_cpu = use_cpu or not torch.cuda.is_available()
+    cpu_bf16 = False
+    if use_cpu:
+        # Thread counts must be set before torch runs any parallel work.
+        torch.set_num_threads(CPU_THREADS)
+        torch.set_num_interop_threads(CPU_INTEROP_THREADS)
+        if use_4bit:
+            logging.info("No CUDA device: training without 4-bit quantization.")
+            use_4bit = False
+        cpu_bf16 = cpu_supports_bf16()
+        logging.info(f"CPU training with {CPU_THREADS} intra-op / {CPU_INTEROP_THREADS} inter-op threads, "
+                     f"{'bf16 autocast' if cpu_bf16 else 'float32'}.")
 
     # 1. Load Tokenizer
     # Llama 3 uses LlamaTokenizerFast. Ensure you have sentencepiece installed.
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, trust_remote_code=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
     
     # Llama models usually don't have a pad token. Add one if it's missing.
     # Using EOS token as PAD token is a common practice for Llama.
@@ -62,14 +173,24 @@ def main():
     logging.info(f"Tokenizer loaded. Pad token ID: {tokenizer.pad_token_id}")
 
     # 2. Load Dataset
-    logging.info(f"Loading dataset from {FINETUNE_DATA_FILE}")
-    dataset = load_dataset("json", data_files=FINETUNE_DATA_FILE, split="train")
-    logging.info(f"Dataset loaded. Number of examples: {len(dataset)}")
-    # You might want to shuffle the dataset: dataset = dataset.shuffle(seed=42)
+    # Tokenized once into a memory-mapped cache under SFT_CACHE_DIR; later runs reuse it.
+    data_files = resolve_data_files(data_file)
+    logging.info(f"Loading dataset from {', '.join(data_files)}")
+    cache = build_token_cache(data_files, tokenizer, max_seq_length, SFT_CACHE_DIR)
+    train_indices, eval_indices = cache.split()
+    logging.info(f"Dataset loaded. Number of examples: {len(train_indices)} train, {len(eval_indices)} held out")
+
+    if use_packing and not transformers_supports_packing():
+        logging.warning(f"transformers {'.'.join(map(str, transformers_version()))} ignores custom 4D attention masks "
+                        f"(packing needs >= {'.'.join(map(str, MIN_TRANSFORMERS_FOR_PACKING))}, see requirements.txt); "
+                        f"falling back to length-bucketed padded batches.")
+        use_packing = False
 
     # 3. Configure BitsAndBytes for 4-bit quantization (QLoRA)
     bnb_config = None
-    if USE_4BIT_QUANTIZATION:
+    # On CPU the weights stay float32 (bf16 autocast is enabled in the training arguments where supported).
+    compute_dtype = torch.float32 if use_cpu else torch.bfloat16
+    if use_4bit:
         compute_dtype = getattr(torch, BNB_4BIT_COMPUTE_DTYPE)
         bnb_config = BitsAndBytesConfig(
             load_in_4bit=True,
@@ -80,13 +201,13 @@ def main():
         logging.info("Using 4-bit quantization (QLoRA).")
 
     # 4. Load Pre-trained Model
-    logging.info(f"Loading base model: {MODEL_NAME}")
+    logging.info(f"Loading base model: {model_name}")
     model = AutoModelForCausalLM.from_pretrained(
-        MODEL_NAME,
-        quantization_config=bnb_config if USE_4BIT_QUANTIZATION else None,
-        device_map="auto", # Automatically distributes model across available GPUs/CPU
+        model_name,
+        quantization_config=bnb_config if use_4bit else None,
+        device_map=None if use_cpu else "auto", # Automatically distributes model across available GPUs/CPU
         trust_remote_code=True,
-        torch_dtype=compute_dtype if USE_4BIT_QUANTIZATION and bnb_config else torch.bfloat16 # Use bfloat16 for faster training if not quantizing to 4-bit or if compute_dtype is bfloat16
+        torch_dtype=compute_dtype # Use bfloat16 for faster training if not quantizing to 4-bit or if compute_dtype is bfloat16
     )
     # If not using device_map="auto" and loading on a single GPU: model.to(device)
     
@@ -95,9 +216,12 @@ def main():
     # model.config.pad_token_id = tokenizer.pad_token_id # Ensure model config knows about pad token
 
     # Prepare model for k-bit training if using quantization
-    if USE_4BIT_QUANTIZATION:
-        model = prepare_model_for_kbit_training(model)
+    if use_4bit:
+        model = prepare_model_for_kbit_training(model, use_gradient_checkpointing=gradient_checkpointing)
         logging.info("Model prepared for k-bit training.")
+    elif gradient_checkpointing:
+        # With frozen base weights, checkpointed blocks need an input that requires grad to backpropagate into LoRA.
+        model.enable_input_require_grads()
 
     # 5. Configure LoRA
     peft_config = LoraConfig(
@@ -112,54 +236,105 @@ def main():
     logging.info("LoRA configured and PEFT model created.")
     model.print_trainable_parameters()
 
-    # 6. Set up Training Arguments
+    # 6. Build packed (or length-bucketed) datasets
+    if use_packing:
+        # Packed rows carry a block-diagonal mask in the model's compute dtype.
+        collator = PackedCollator(tokenizer.pad_token_id, mask_dtype=compute_dtype)
+        train_packs = pack_sequences(cache.lengths, train_indices, max_seq_length)
+        train_dataset = PackedDataset(cache, train_packs)
+        eval_dataset = PackedDataset(cache, pack_sequences(cache.lengths, eval_indices, max_seq_length))
+        logging.info(f"Packed {len(train_indices)} examples into {len(train_packs)} sequences "
+                     f"(padding ratio {padding_ratio(cache.lengths, train_packs, max_seq_length):.1%}, "
+                     f"{padding_ratio(cache.lengths, [[i] for i in train_indices], max_seq_length):.1%} unpacked).")
+    else:
+        collator = PaddedCollator(tokenizer.pad_token_id)
+        train_dataset = PaddedDataset(cache, train_indices)
+        eval_dataset = PaddedDataset(cache, eval_indices)
+
+    # 7. Set up Training Arguments
     training_args = TrainingArguments(
-        output_dir=OUTPUT_DIR,
+        output_dir=output_dir,
         num_train_epochs=NUM_TRAIN_EPOCHS,
         per_device_train_batch_size=PER_DEVICE_TRAIN_BATCH_SIZE,
         gradient_accumulation_steps=GRADIENT_ACCUMULATION_STEPS,
         learning_rate=LEARNING_RATE,
         weight_decay=WEIGHT_DECAY,
-        optim=OPTIM_PAGED_ADAMW if USE_4BIT_QUANTIZATION else "adamw_torch",
+        optim=OPTIM_PAGED_ADAMW if use_4bit else CPU_OPTIM if use_cpu else "adamw_torch",
         fp16=False, # Set to True if not using bfloat16 and your GPU supports fp16
-        bf16=True if not USE_4BIT_QUANTIZATION and torch.cuda.is_bf16_supported() else False, # Enable bf16 if supported and not using 4-bit
+        bf16=cpu_bf16 if use_cpu else not use_4bit and torch.cuda.is_bf16_supported(), # Enable bf16 if supported and not using 4-bit
+        use_cpu=use_cpu,
+        gradient_checkpointing=gradient_checkpointing,
+        gradient_checkpointing_kwargs={"use_reentrant": False} if gradient_checkpointing else None,
         max_grad_norm=MAX_GRAD_NORM,
         warmup_ratio=WARMUP_RATIO,
         lr_scheduler_type=LR_SCHEDULER_TYPE,
+        max_steps=max_steps, # -1 trains for num_train_epochs; a small value gives a quick smoke test
         logging_steps=25, # Log every 25 steps
-        save_strategy="epoch", # Save checkpoints at the end of each epoch
+        save_strategy="steps", # Step checkpoints, so an interrupted run loses at most save_steps of work
+        save_steps=save_steps,
+        save_total_limit=SAVE_TOTAL_LIMIT,
         report_to="tensorboard", # Or "wandb", "none"
         # ddp_find_unused_parameters=False, # Set to False if using DDP and encountering issues
+        group_by_length=not use_packing, # Bucket unpacked samples by length to cut padding
+        remove_unused_columns=False, # The collators build the model inputs themselves
     )
 
-    # 7. Initialize SFTTrainer
-    trainer = SFTTrainer(
+    # 8. Initialize Trainer
+    trainer = Trainer(
         model=model,
-        train_dataset=dataset,
-        peft_config=peft_config, # Pass peft_config again if not already applied, but get_peft_model does this
-        dataset_text_field="text", # Name of the column in your dataset that contains the formatted text
-        max_seq_length=MAX_SEQ_LENGTH,
+        train_dataset=train_dataset,
+        data_collator=collator,
         tokenizer=tokenizer,
         args=training_args,
-        packing=False, # Set to True if your dataset is pre-packed for efficiency, False otherwise
+        callbacks=[ThroughputCallback(collator, log_every_step=use_cpu)],
     )
 
-    # 8. Start Fine-tuning
+    # 9. Start Fine-tuning
     logging.info("Starting training...")
-    trainer.train()
-    logging.info("Training finished.")
+    start = time.perf_counter()
+    real_tokens = collator.real_tokens
+    checkpoint = get_last_checkpoint(output_dir) if resume and os.path.isdir(output_dir) else None
+    if checkpoint:
+        logging.info(f"Resuming from {checkpoint}")
+    trainer.train(resume_from_checkpoint=checkpoint)
+    elapsed = time.perf_counter() - start
+    logging.info(f"Training finished in {elapsed:.0f}s "
+                 f"({(collator.real_tokens - real_tokens) / elapsed:.1f} effective tokens/s, peak RSS {peak_rss_mb():.0f} MB).")
+
+    if len(eval_dataset):
+        metrics = trainer.evaluate(eval_dataset=eval_dataset)
+        logging.info(f"Held-out loss {metrics['eval_loss']:.4f} (perplexity {math.exp(metrics['eval_loss']):.2f}).")
 
-    # 9. Save the Fine-tuned Model Adapter
-    logging.info(f"Saving LoRA adapter to {OUTPUT_DIR}")
-    trainer.model.save_pretrained(OUTPUT_DIR) # Saves only the LoRA adapter
-    tokenizer.save_pretrained(OUTPUT_DIR) # Save tokenizer for easy loading later
+    # 10. Save the Fine-tuned Model Adapter
+    logging.info(f"Saving LoRA adapter to {output_dir}")
+    trainer.model.save_pretrained(output_dir) # Saves only the LoRA adapter
+    tokenizer.save_pretrained(output_dir) # Save tokenizer for easy loading later
     logging.info("Model adapter and tokenizer saved.")
 
     # To save the full model (merged):
     merged_model = model.merge_and_unload()
-    merged_model.save_pretrained(os.path.join(OUTPUT_DIR, "final_merged_checkpoint"))
-    tokenizer.save_pretrained(os.path.join(OUTPUT_DIR, "final_merged_checkpoint"))
+    merged_model.save_pretrained(os.path.join(output_dir, "final_merged_checkpoint"))
+    tokenizer.save_pretrained(os.path.join(output_dir, "final_merged_checkpoint"))
     logging.info("Full merged model saved (optional).")
+    logging.info("Run export_gguf.py to convert it to quantized GGUF files for the app.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # A quick CPU check with a tiny model, e.g.:
+    # python finetune_llama.py --model hf-internal-testing/tiny-random-LlamaForCausalLM --cpu --max-steps 10
+    parser = argparse.ArgumentParser(description="LoRA fine-tune a Llama model on the exported syllabus data.")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--data", default=FINETUNE_DATA_FILE)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--max-seq-length", type=int, default=MAX_SEQ_LENGTH)
+    parser.add_argument("--max-steps", type=int, default=-1, help="Stop after this many optimizer steps (-1 = full epochs).")
+    parser.add_argument("--no-packing", action="store_true", help="Pad samples in length-bucketed batches instead of packing.")
+    parser.add_argument("--no-quantization", action="store_true", help="Train without 4-bit quantization.")
+    parser.add_argument("--cpu", action="store_true", help="Train on CPU even if a GPU is available.")
+    parser.add_argument("--no-gradient-checkpointing", action="store_true")
+    parser.add_argument("--save-steps", type=int, default=SAVE_STEPS, help="Optimizer steps between checkpoints.")
+    parser.add_argument("--no-resume", action="store_true", help="Start over instead of resuming from the last checkpoint.")
+    args = parser.parse_args()
+    main(model_name=args.model, data_file=args.data, output_dir=args.output_dir, max_seq_length=args.max_seq_length,
+         use_packing=USE_PACKING and not args.no_packing, use_4bit=USE_4BIT_QUANTIZATION and not args.no_quantization,
+         max_steps=args.max_steps, use_cpu=args.cpu, gradient_checkpointing=not args.no_gradient_checkpointing,
+         save_steps=args.save_steps, resume=not args.no_resume)
\ No newline at end of file
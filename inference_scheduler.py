@@ -0,0 +1,472 @@
+import os
+import argparse
+import codecs
+import ctypes
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+from llm_engine import (MIN_P, N_BATCH, N_THREADS, REPEAT_LAST_N, REPEAT_PENALTY, STOP_SEQUENCES, TEMPERATURE, TOP_K,
+                        TOP_P, LlamaCppModel, PrefixStateCache, find_model_file, kv_bytes_per_token)
+
+# --- Configuration ---
+SCHEDULER_SLOTS = int(os.environ.get("SUGURU_SCHEDULER_SLOTS", 8))  # Requests decoded together in one batch
+SLOT_CTX = int(os.environ.get("SUGURU_SLOT_CTX", 1024))  # Prompt + completion tokens per request
+# KV-cache memory for prompt prefixes kept resident between requests, least recently used evicted first
+PREFIX_KV_MB = int(os.environ.get("SUGURU_PREFIX_KV_MB", 128))
+STEP_TOKENS = N_BATCH  # Tokens per llama_decode call: one per decoding request, the rest for prompt prefill
+MAX_QUEUED = int(os.environ.get("SUGURU_MAX_QUEUED", 64))  # Waiting requests beyond this are rejected
+LATENCY_WINDOW = 500  # Recent requests used for the latency percentiles
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_DONE = object()
+
+
+def _common_prefix_length(a: list[int], b: list[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class GenerationRequest:
+    """One prompt being served by the scheduler; its text arrives on `output` piece by piece."""
+
+    def __init__(self, tokens: list[int], max_tokens: int, session: str, prefix_key: Optional[str], prefix_len: int):
+        self.tokens = tokens
+        self.max_tokens = max_tokens
+        self.session = session
+        self.prefix_key = prefix_key
+        self.prefix_len = prefix_len  # Prompt tokens covered by the shared prefix
+        self.output: queue.Queue = queue.Queue()
+        self.seq_id = -1
+        self.n_past = 0  # Tokens of this sequence already in the KV cache
+        self.pending: Optional[int] = None  # Sampled token not yet fed back to the model
+        self.recent: deque = deque(tokens[-REPEAT_LAST_N:], maxlen=REPEAT_LAST_N)  # For the repeat penalty
+        self.generated = 0
+        self.text = ""
+        self.emitted = 0  # Characters of text already put on output
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.cancelled = False
+        self.submitted_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+
+
+class InferenceScheduler:
+    """Serves concurrent generation requests with continuous batching on one llama.cpp context.
+
+    Up to `slots` requests are active at once, each in its own KV-cache sequence. Every
+    llama_decode call advances all decoding requests by one token and fills the remaining batch
+    space with prompt tokens of requests still being prefilled, so new requests join (and finished
+    ones leave) between steps instead of waiting for a whole generation. Waiting requests are
+    admitted round-robin across sessions, so one busy session cannot starve the others.
+
+    Prompt prefixes (see rag.py) are kept resident in spare sequences; a request starting with a
+    resident prefix shares those KV cells and only prefills the rest of its prompt. Residency is
+    budgeted by the KV bytes of the prefix tokens, so many short prefixes fit where a few long
+    ones would; the least recently used prefixes are evicted first.
+
+    The scheduler decodes on the model's own llama.cpp context, which must hold slots * slot_ctx
+    tokens; the rest of the context (up to prefix_kv_mb) holds resident prefixes (see load()).
+    The model must not be used directly while the scheduler runs.
+    """
+
+    def __init__(self, model: LlamaCppModel, slots: int = SCHEDULER_SLOTS, slot_ctx: int = SLOT_CTX,
+                 prefix_kv_mb: int = PREFIX_KV_MB, step_tokens: int = STEP_TOKENS,
+                 max_queued: int = MAX_QUEUED):
+        import llama_cpp
+
+        self.llm = model.llm
+        self._ctx = self.llm._ctx.ctx
+        n_ctx = llama_cpp.llama_n_ctx(self._ctx)
+        if n_ctx < slot_ctx * slots:
+            raise ValueError(f"The model's context holds {n_ctx} tokens; {slots} slots of {slot_ctx} tokens "
+                             f"need {slot_ctx * slots}.")
+        if self.llm.n_batch < step_tokens:
+            raise ValueError(f"The model's batch size is {self.llm.n_batch}; steps of {step_tokens} tokens need at least that.")
+        self.llm.reset()
+        llama_cpp.llama_kv_cache_clear(self._ctx)
+        self.name = f"{model.name}, {slots} slots"
+        self.version = model.version
+        self.slots = slots
+        self.slot_ctx = slot_ctx
+        self.step_tokens = step_tokens
+        self.max_queued = max_queued
+        self._model_ptr = self.llm._model.model
+        self._n_vocab = llama_cpp.llama_n_vocab(self._model_ptr)
+        self._eos = llama_cpp.llama_token_eos(self._model_ptr)
+
+        self._batch = llama_cpp.llama_batch_init(step_tokens, 0, 1)
+        # Candidate buffer for llama.cpp's samplers, refilled from the logits for every sampled token
+        self._candidate_data = np.zeros(self._n_vocab, dtype=np.dtype(
+            [("id", np.intc), ("logit", np.single), ("p", np.single)], align=True))
+        self._candidate_ids = np.arange(self._n_vocab, dtype=np.intc)
+        self._candidates = llama_cpp.llama_token_data_array(
+            data=self._candidate_data.ctypes.data_as(llama_cpp.llama_token_data_p), size=self._n_vocab, sorted=False)
+
+        self._kv_bytes_per_token = kv_bytes_per_token(self.llm.model_path)
+        self.prefix_budget = min(prefix_kv_mb * 1024 * 1024, (n_ctx - slot_ctx * slots) * self._kv_bytes_per_token)
+
+        self._free_seqs = list(range(slots))
+        self._active: list[GenerationRequest] = []
+        self._waiting: OrderedDict[str, deque] = OrderedDict()  # session -> its queued requests
+        self._queued = 0
+        # Resident prefixes: prefix hash -> (sequence id, prefix tokens), least recently used first
+        self._prefixes: OrderedDict[str, tuple[int, list[int]]] = OrderedDict()
+        self._prefix_bytes = 0
+        self._free_prefix_seqs: list[int] = []
+        self._next_prefix_seq = slots
+        self._prefill_turn = 0
+
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self._first_token_latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self._counters = {"completed": 0, "rejected": 0, "failed": 0, "steps": 0, "batch_tokens": 0,
+                          "generated_tokens": 0, "busy_seconds": 0.0, "prefix_hits": 0, "prefix_evictions": 0}
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self._thread.start()
+        logging.info(f"Inference scheduler started: {slots} slots x {slot_ctx} tokens, "
+                     f"{self.prefix_budget / (1024 * 1024):.1f} MB for shared prefixes, {step_tokens} tokens per step.")
+
+    @classmethod
+    def load(cls, model_path: Path, slots: int = SCHEDULER_SLOTS, slot_ctx: int = SLOT_CTX,
+             prefix_kv_mb: int = PREFIX_KV_MB, step_tokens: int = STEP_TOKENS,
+             max_queued: int = MAX_QUEUED, n_threads: int = N_THREADS) -> "InferenceScheduler":
+        """Loads the GGUF model with a context sized for the slots and resident prefixes and
+        starts a scheduler on it, so only one KV cache is allocated."""
+        # Never more room for prefixes than for the requests themselves (matters only for tiny models)
+        prefix_tokens = min(prefix_kv_mb * 1024 * 1024 // kv_bytes_per_token(model_path), slot_ctx * slots)
+        model = LlamaCppModel(model_path, n_threads=n_threads, n_ctx=slot_ctx * slots + prefix_tokens,
+                              n_batch=step_tokens, prefix_cache_mb=0)
+        return cls(model, slots=slots, slot_ctx=slot_ctx, prefix_kv_mb=prefix_kv_mb,
+                   step_tokens=step_tokens, max_queued=max_queued)
+
+    # --- Client side ---
+
+    def submit(self, prompt: str, max_tokens: int = 100, prefix: Optional[str] = None,
+               session: str = "") -> GenerationRequest:
+        """Queues a prompt; raises RuntimeError if the queue is full and ValueError if the prompt is too long."""
+        if prefix is not None and not prompt.startswith(prefix):
+            raise ValueError("prefix must be the beginning of prompt")
+        tokens = self.llm.tokenize(prompt.encode("utf-8"), special=True)
+        if len(tokens) >= self.slot_ctx:
+            raise ValueError(f"Prompt is {len(tokens)} tokens; at most {self.slot_ctx - 1} fit in a slot.")
+        prefix_key, prefix_len = None, 0
+        if prefix:
+            prefix_key = PrefixStateCache.key(prefix)
+            prefix_len = _common_prefix_length(self.llm.tokenize(prefix.encode("utf-8"), special=True), tokens)
+        request = GenerationRequest(tokens, min(max_tokens, self.slot_ctx - len(tokens)), session,
+                                    prefix_key, prefix_len)
+        with self._cond:
+            if self._queued >= self.max_queued:
+                self._counters["rejected"] += 1
+                raise RuntimeError("Too many students are waiting for feedback; please try again shortly.")
+            self._waiting.setdefault(session, deque()).append(request)
+            self._queued += 1
+            self._cond.notify()
+        return request
+
+    def stream_response(self, prompt: str, max_tokens: int = 100, prefix: Optional[str] = None,
+                        session: str = "") -> Iterator[str]:
+        """Same interface as LlamaCppModel.stream_response, served through the shared batch."""
+        request = self.submit(prompt, max_tokens=max_tokens, prefix=prefix, session=session)
+        try:
+            while True:
+                item = request.output.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            request.cancelled = True
+
+    def generate_response(self, prompt: str, max_tokens: int = 100, prefix: Optional[str] = None,
+                          session: str = "") -> str:
+        return "".join(self.stream_response(prompt, max_tokens=max_tokens, prefix=prefix, session=session)).strip()
+
+    def stats(self) -> dict:
+        with self._cond:
+            latencies = sorted(self._latencies)
+            first_token = sorted(self._first_token_latencies)
+            stats = dict(self._counters)
+            stats["queue_depth"] = self._queued
+            stats["active"] = len(self._active)
+            stats["resident_prefixes"] = len(self._prefixes)
+            stats["prefix_megabytes"] = self._prefix_bytes / (1024 * 1024)
+
+        def percentile(values, q):
+            return float(np.percentile(values, q)) if values else 0.0
+
+        stats["latency_p50"] = percentile(latencies, 50)
+        stats["latency_p95"] = percentile(latencies, 95)
+        stats["first_token_p50"] = percentile(first_token, 50)
+        stats["first_token_p95"] = percentile(first_token, 95)
+        stats["tokens_per_second"] = (stats["generated_tokens"] / stats["busy_seconds"]
+                                      if stats["busy_seconds"] else 0.0)
+        stats["mean_batch_tokens"] = stats["batch_tokens"] / stats["steps"] if stats["steps"] else 0.0
+        return stats
+
+    def close(self) -> None:
+        import llama_cpp
+
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join()
+        llama_cpp.llama_batch_free(self._batch)
+        llama_cpp.llama_kv_cache_clear(self._ctx)
+
+    # --- Scheduler thread ---
+
+    def _admit(self) -> None:
+        """Moves waiting requests into free slots, taking one per session in turn."""
+        import llama_cpp
+
+        while self._free_seqs and self._waiting:
+            session, requests = next(iter(self._waiting.items()))
+            request = requests.popleft()
+            del self._waiting[session]
+            if requests:
+                self._waiting[session] = requests  # Back of the line for this session's next request
+            self._queued -= 1
+            if request.cancelled:
+                continue
+            request.seq_id = self._free_seqs.pop()
+            resident = self._prefixes.get(request.prefix_key) if request.prefix_key else None
+            if resident is not None:
+                prefix_seq, prefix_tokens = resident
+                reuse = min(_common_prefix_length(prefix_tokens, request.tokens), len(request.tokens) - 1)
+                llama_cpp.llama_kv_cache_seq_cp(self._ctx, prefix_seq, request.seq_id, 0, reuse)
+                request.n_past = reuse
+                self._prefixes.move_to_end(request.prefix_key)
+                self._counters["prefix_hits"] += 1
+            self._active.append(request)
+
+    def _evict_prefix(self) -> None:
+        """Drops the least recently used resident prefix."""
+        import llama_cpp
+
+        _, (old_seq, old_tokens) = self._prefixes.popitem(last=False)
+        llama_cpp.llama_kv_cache_seq_rm(self._ctx, old_seq, -1, -1)
+        self._free_prefix_seqs.append(old_seq)
+        self._prefix_bytes -= len(old_tokens) * self._kv_bytes_per_token
+        self._counters["prefix_evictions"] += 1
+
+    def _keep_prefix(self, request: GenerationRequest) -> None:
+        """Keeps a request's freshly prefilled prefix resident for later requests."""
+        import llama_cpp
+
+        size = request.prefix_len * self._kv_bytes_per_token
+        if size > self.prefix_budget:
+            return
+        while self._prefix_bytes + size > self.prefix_budget:
+            self._evict_prefix()
+        if self._free_prefix_seqs:
+            prefix_seq = self._free_prefix_seqs.pop()
+        else:
+            prefix_seq = self._next_prefix_seq
+            self._next_prefix_seq += 1
+        llama_cpp.llama_kv_cache_seq_cp(self._ctx, request.seq_id, prefix_seq, 0, request.prefix_len)
+        self._prefixes[request.prefix_key] = (prefix_seq, request.tokens[:request.prefix_len])
+        self._prefix_bytes += size
+
+    def _finish(self, request: GenerationRequest, error: Optional[Exception] = None) -> None:
+        import llama_cpp
+
+        llama_cpp.llama_kv_cache_seq_rm(self._ctx, request.seq_id, -1, -1)
+        self._active.remove(request)
+        self._free_seqs.append(request.seq_id)
+        if error is not None:
+            self._counters["failed"] += 1
+            request.output.put(error)
+            return
+        self._flush_text(request, final=True)
+        request.output.put(_DONE)
+        self._counters["completed"] += 1
+        self._latencies.append(time.perf_counter() - request.submitted_at)
+
+    def _flush_text(self, request: GenerationRequest, final: bool = False) -> None:
+        # Hold back a possible partial stop sequence until more text (or the end) arrives.
+        hold = 0 if final else max(len(stop) for stop in STOP_SEQUENCES) - 1
+        end = max(request.emitted, len(request.text) - hold)
+        if end > request.emitted:
+            request.output.put(request.text[request.emitted:end])
+            request.emitted = end
+
+    def _sample(self, request: GenerationRequest, batch_index: int) -> int:
+        """Samples the next token for `request` with the same settings LlamaCppModel passes to create_completion."""
+        import llama_cpp
+
+        logits = np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(self._ctx, batch_index), shape=(self._n_vocab,))
+        self._candidate_data["id"] = self._candidate_ids
+        self._candidate_data["logit"] = logits
+        self._candidate_data["p"] = 0.0
+        self._candidates.size = self._n_vocab
+        self._candidates.sorted = False
+        candidates = ctypes.byref(self._candidates)
+        recent = (llama_cpp.llama_token * len(request.recent))(*request.recent)
+        llama_cpp.llama_sample_repetition_penalties(self._ctx, candidates, recent, len(recent), REPEAT_PENALTY, 0.0, 0.0)
+        if TEMPERATURE <= 0:
+            return llama_cpp.llama_sample_token_greedy(self._ctx, candidates)
+        llama_cpp.llama_sample_top_k(self._ctx, candidates, TOP_K, 1)
+        llama_cpp.llama_sample_top_p(self._ctx, candidates, TOP_P, 1)
+        llama_cpp.llama_sample_min_p(self._ctx, candidates, MIN_P, 1)
+        llama_cpp.llama_sample_temp(self._ctx, candidates, TEMPERATURE)
+        return llama_cpp.llama_sample_token(self._ctx, candidates)
+
+    def _accept(self, request: GenerationRequest, token: int) -> None:
+        """Handles a token sampled for `request`: emits its text or finishes the request."""
+        if request.first_token_at is None:
+            request.first_token_at = time.perf_counter()
+            self._first_token_latencies.append(request.first_token_at - request.submitted_at)
+        if token == self._eos:
+            self._finish(request)
+            return
+        request.generated += 1
+        request.recent.append(token)
+        self._counters["generated_tokens"] += 1
+        request.text += request.decoder.decode(self.llm.detokenize([token]))
+        for stop in STOP_SEQUENCES:
+            position = request.text.find(stop)
+            if position != -1:
+                request.text = request.text[:position]
+                self._finish(request)
+                return
+        if request.generated >= request.max_tokens or request.n_past + 1 >= self.slot_ctx:
+            self._finish(request)
+            return
+        request.pending = token
+        self._flush_text(request)
+
+    def _step(self) -> None:
+        """Runs one llama_decode over every active request."""
+        import llama_cpp
+
+        for request in [r for r in self._active if r.cancelled]:
+            self._finish(request)
+
+        entries = []  # (request, token, position, wants_logits)
+        for request in self._active:
+            if request.pending is not None:
+                entries.append((request, request.pending, request.n_past, True))
+        prefilling = [r for r in self._active if r.pending is None and r.n_past < len(r.tokens)]
+        budget = self.step_tokens - len(entries)
+        if prefilling and budget > 0:
+            # Rotate which prefilling request goes first so long prompts share the spare capacity.
+            self._prefill_turn = (self._prefill_turn + 1) % len(prefilling)
+            prefilling = prefilling[self._prefill_turn:] + prefilling[:self._prefill_turn]
+            for i, request in enumerate(prefilling):
+                share = max(1, budget // (len(prefilling) - i))
+                chunk = request.tokens[request.n_past:request.n_past + min(share, budget)]
+                for offset, token in enumerate(chunk):
+                    position = request.n_past + offset
+                    entries.append((request, token, position, position == len(request.tokens) - 1))
+                budget -= len(chunk)
+                if budget <= 0:
+                    break
+        if not entries:
+            return
+
+        for i, (request, token, position, wants_logits) in enumerate(entries):
+            self._batch.token[i] = token
+            self._batch.pos[i] = position
+            self._batch.n_seq_id[i] = 1
+            self._batch.seq_id[i][0] = request.seq_id
+            self._batch.logits[i] = wants_logits
+        self._batch.n_tokens = len(entries)
+
+        start = time.perf_counter()
+        while True:
+            result = llama_cpp.llama_decode(self._ctx, self._batch)
+            if result == 0:
+                break
+            if result == 1 and self._prefixes:
+                # KV cache full: drop the least recently used resident prefix and retry.
+                self._evict_prefix()
+                continue
+            error = RuntimeError(f"llama_decode failed ({result})")
+            for request in {id(entry[0]): entry[0] for entry in entries}.values():
+                self._finish(request, error)
+            return
+        self._counters["busy_seconds"] += time.perf_counter() - start
+        self._counters["steps"] += 1
+        self._counters["batch_tokens"] += len(entries)
+
+        advanced: dict[int, int] = {}
+        for request, _, _, _ in entries:
+            advanced[id(request)] = advanced.get(id(request), 0) + 1
+        sampled = []
+        for i, (request, _, _, wants_logits) in enumerate(entries):
+            if wants_logits:
+                sampled.append((request, self._sample(request, i)))
+        for request in {id(entry[0]): entry[0] for entry in entries}.values():
+            was_prefilling = request.n_past < request.prefix_len
+            request.n_past += advanced[id(request)]
+            request.pending = None
+            if (was_prefilling and request.n_past >= request.prefix_len and request.prefix_key
+                    and request.prefix_key not in self._prefixes):
+                self._keep_prefix(request)
+        for request, token in sampled:
+            self._accept(request, token)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopping and not self._active and not self._waiting:
+                    self._cond.wait()
+                if self._stopping:
+                    break
+                self._admit()
+            try:
+                self._step()
+            except Exception as e:
+                logging.error(f"Inference scheduler step failed: {e}")
+                with self._cond:
+                    for request in list(self._active):
+                        self._finish(request, e)
+            # Waiting requests are admitted as soon as a slot frees up, between decode steps.
+            with self._cond:
+                self._admit()
+
+
+if __name__ == "__main__":
+    # Load test: simulates a classroom of students requesting feedback at the same time.
+    parser = argparse.ArgumentParser(description="Run concurrent generations through the inference scheduler.")
+    parser.add_argument("--model", type=Path, default=None, help="GGUF file (defaults to the one in models/).")
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--max-tokens", type=int, default=48)
+    parser.add_argument("--slots", type=int, default=SCHEDULER_SLOTS)
+    args = parser.parse_args()
+
+    model_file = args.model or find_model_file()
+    if model_file is None:
+        raise SystemExit("No GGUF model found in models/ and SUGURU_MODEL_PATH is not set.")
+    scheduler = InferenceScheduler.load(model_file, slots=args.slots)
+    prefix = "You are SuguruAI, a friendly tutor following the Ghana B3 mathematics curriculum.\nLesson: Counting\n"
+
+    def student(i: int) -> None:
+        scheduler.generate_response(f"{prefix}\nExercise: 'Count from {i} to {i + 5}'\nStudent answer: "
+                                    f"'{' '.join(str(n) for n in range(i, i + 6))}'\nFeedback:",
+                                    max_tokens=args.max_tokens, prefix=prefix, session=f"student-{i}")
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=student, args=(i,)) for i in range(args.users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"{args.users} concurrent requests in {time.perf_counter() - start:.1f}s")
+    print(scheduler.stats())
+    scheduler.close()
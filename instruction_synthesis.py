@@ -0,0 +1,218 @@
+import hashlib
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+
+import numpy as np
+
+from syllabus_chunker import count_tokens
+from text_utils import split_sentences
+
+# --- Configuration ---
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16  # LSH bands; MINHASH_PERMUTATIONS / MINHASH_BANDS rows each
+SHINGLE_WORDS = 5
+NEAR_DUPLICATE_THRESHOLD = 0.8  # Estimated Jaccard similarity above which a sample is dropped
+MIN_CHUNK_TOKENS = 25  # Chunks shorter than this (after trimming overlap) carry too little to train on
+MIN_RESPONSE_TOKENS = 8  # Model outputs shorter than this are discarded
+GENERATION_MAX_TOKENS = 200
+
+WORD_RE = re.compile(r"\w+")
+ASSISTANT_HEADER = "<|start_header_id|>assistant<|end_header_id|>\n\n"
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def format_llama3_pair(instruction: str, response: str) -> str:
+    return (f"<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\n{instruction}<|eot_id|>"
+            f"{ASSISTANT_HEADER}{response}<|eot_id|>")
+
+
+def response_of(text: str) -> str:
+    """The assistant turn of a formatted pair; near-duplicates are judged on it alone."""
+    return text.rpartition(ASSISTANT_HEADER)[2].removesuffix("<|eot_id|>")
+
+
+def trim_overlap(previous_text: str, text: str) -> str:
+    """Drops the leading sentences of `text` that the chunker carried over from the previous chunk."""
+    carried = {' '.join(s.split()).casefold() for s in split_sentences(previous_text)}
+    sentences = split_sentences(text)
+    start = 0
+    while start < len(sentences) and ' '.join(sentences[start].split()).casefold() in carried:
+        start += 1
+    return ' '.join(' '.join(s.split()) for s in sentences[start:]) if start else text
+
+
+class MinHashDeduplicator:
+    """Streaming near-duplicate filter using MinHash signatures and LSH banding.
+
+    Each accepted text costs one small signature, so memory grows with the number of kept
+    samples rather than their length.
+    """
+
+    def __init__(self, num_perm: int = MINHASH_PERMUTATIONS, bands: int = MINHASH_BANDS,
+                 threshold: float = NEAR_DUPLICATE_THRESHOLD, shingle_words: int = SHINGLE_WORDS, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2 ** 63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.threshold = threshold
+        self.shingle_words = shingle_words
+        self._signatures: list[np.ndarray] = []
+        self._buckets: dict[tuple[int, bytes], list[int]] = {}
+        self.duplicates = 0
+
+    def signature(self, text: str) -> np.ndarray:
+        words = WORD_RE.findall(text.casefold())
+        n = self.shingle_words
+        shingles = {' '.join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+        hashes = np.array([int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+                           for s in shingles], dtype=np.uint64)
+        # Universal hashing (a * x + b mod 2^64), one row per permutation
+        return (np.outer(self._a, hashes) + self._b[:, None]).min(axis=1)
+
+    def add(self, text: str) -> bool:
+        """Records `text` and returns True, or returns False if it nearly duplicates a recorded text."""
+        signature = self.signature(text)
+        keys = [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+        candidates = {i for key in keys for i in self._buckets.get(key, ())}
+        for i in candidates:
+            if np.mean(self._signatures[i] == signature) >= self.threshold:
+                self.duplicates += 1
+                return False
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        for key in keys:
+            self._buckets.setdefault(key, []).append(index)
+        return True
+
+
+def _focus(metadata: dict) -> str:
+    return (metadata.get("sub_strand") or metadata.get("strand") or metadata.get("content_standard")
+            or "this part of the syllabus")
+
+
+def _variant(key: str, options: list[str]) -> str:
+    """Picks a phrasing deterministically, so reruns produce the same dataset."""
+    return options[int(hashlib.md5(key.encode("utf-8")).hexdigest(), 16) % len(options)]
+
+
+def template_pairs(text: str, metadata: dict, chunk_id: str) -> list[dict]:
+    """Instruction pairs answered by the chunk text itself."""
+    subject = metadata.get("subject", "").replace("_", " ") or "the"
+    grade = metadata.get("grade_band", "")
+    focus = _focus(metadata)
+    indicators = [code for code in (metadata.get("indicators") or "").split(",") if code]
+    if indicators:
+        instruction = _variant(chunk_id, [
+            f"What are learners expected to do for indicator {indicators[0]} in {grade} {subject}?",
+            f"Explain the {grade} {subject} curriculum indicator {indicators[0]}.",
+            f"Which exemplars support indicator {indicators[0]} ({focus})?",
+        ])
+    else:
+        instruction = _variant(chunk_id, [
+            f"What does the {grade} {subject} curriculum say about {focus}?",
+            f"Summarize the {grade} {subject} syllabus guidance on {focus}.",
+            f"How should {focus} be taught in {grade} {subject}?",
+        ])
+    return [{"task": "curriculum_lookup", "instruction": instruction, "response": text}]
+
+
+def generation_requests(text: str, metadata: dict) -> list[dict]:
+    """Instruction pairs whose responses are written by the local model from the chunk."""
+    subject = metadata.get("subject", "").replace("_", " ")
+    grade = metadata.get("grade_band", "")
+    focus = _focus(metadata)
+    context = (f"You are SuguruAI, a tutor following the Ghana {grade} {subject} curriculum.\n\n"
+               f"Curriculum excerpt:\n{text}\n\n")
+    requests = [
+        {"task": "exercise_generation",
+         "instruction": f"Write a practice exercise with its answer for {grade} {subject} learners on {focus}.",
+         "prompt": context + "Write one practice exercise based on the excerpt, followed by its answer.\nExercise:"},
+        {"task": "grade_rewrite",
+         "instruction": f"Explain this {subject} curriculum point to a {grade} learner in simple words:\n{text}",
+         "prompt": context + "Explain the excerpt to a learner of that grade in short, simple sentences.\nExplanation:"},
+    ]
+    indicators = [code for code in (metadata.get("indicators") or "").split(",") if code]
+    if indicators:
+        requests.append({
+            "task": "indicator_explanation",
+            "instruction": f"In your own words, what does indicator {indicators[0]} ask {grade} learners to do, "
+                           f"and how could a teacher check it?",
+            "prompt": context + f"Explain in your own words what indicator {indicators[0]} asks learners to do "
+                                f"and how a teacher could check it.\nAnswer:"})
+    return requests
+
+
+class InstructionSynthesizer:
+    """Turns syllabus chunks into several varied, de-duplicated instruction/response pairs.
+
+    Chunks are first stripped of the sentences carried over from the previous chunk of the same
+    document. Each chunk yields a template pair answered by the chunk itself and, if a model is
+    given, model-written pairs (exercises, grade-level rewrites, indicator explanations) generated
+    a page at a time. Every pair passes a MinHash near-duplicate filter before it is emitted.
+    """
+
+    def __init__(self, model=None, max_tokens: int = GENERATION_MAX_TOKENS,
+                 deduplicator: Optional[MinHashDeduplicator] = None):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.deduplicator = deduplicator or MinHashDeduplicator()
+        self._previous_text: dict[str, str] = {}  # source -> text of its last chunk
+        self.stats = {"chunks": 0, "short_chunks": 0, "pairs": 0, "near_duplicates": 0, "empty_generations": 0}
+
+    def remember(self, entry: dict) -> None:
+        """Registers an already written entry (e.g. when resuming) with the duplicate filter."""
+        self.deduplicator.add(response_of(entry["text"]))
+
+    def prime(self, documents: list, metadatas: list) -> None:
+        """Records chunks that precede the next page (e.g. when resuming) for overlap trimming."""
+        for doc_text, meta in zip(documents, metadatas):
+            if doc_text and meta:
+                self._previous_text[meta.get('source_pdf', 'Unknown_PDF_Source')] = doc_text
+
+    def _generate(self, prompts: list[str]) -> list[str]:
+        """Runs the prompts through the model; concurrently when it batches requests itself."""
+        if not prompts:
+            return []
+        workers = getattr(self.model, "slots", 1)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda prompt: self.model.generate_response(prompt, max_tokens=self.max_tokens),
+                                 prompts))
+
+    def entries(self, documents: list, metadatas: list, ids: Optional[list] = None) -> Iterator[dict]:
+        """Yields {"text", "task", "source", "chunk"} fine-tuning entries for one page of chunks."""
+        pairs, pending = [], []
+        for i, (doc_text, meta) in enumerate(zip(documents, metadatas)):
+            if not doc_text or not meta:
+                continue
+            self.stats["chunks"] += 1
+            source = meta.get('source_pdf', 'Unknown_PDF_Source')
+            text = trim_overlap(self._previous_text.get(source, ""), doc_text)
+            self._previous_text[source] = doc_text
+            if count_tokens(text) < MIN_CHUNK_TOKENS:
+                self.stats["short_chunks"] += 1
+                continue
+            chunk_id = ids[i] if ids else f"{source}:{meta.get('chunk_number', i)}"
+            pairs.extend({**pair, "source": source, "chunk": chunk_id} for pair in template_pairs(text, meta, chunk_id))
+            if self.model is not None:
+                pending.extend({**request, "source": source, "chunk": chunk_id}
+                               for request in generation_requests(text, meta))
+
+        for request, response in zip(pending, self._generate([request["prompt"] for request in pending])):
+            if count_tokens(response) < MIN_RESPONSE_TOKENS:
+                self.stats["empty_generations"] += 1
+                continue
+            pairs.append({"task": request["task"], "instruction": request["instruction"],
+                          "response": response.strip(), "source": request["source"], "chunk": request["chunk"]})
+
+        for pair in pairs:
+            if not self.deduplicator.add(pair["response"]):
+                self.stats["near_duplicates"] += 1
+                continue
+            self.stats["pairs"] += 1
+            yield {"text": format_llama3_pair(pair["instruction"], pair["response"]), "task": pair["task"],
+                   "source": pair["source"], "chunk": pair["chunk"]}
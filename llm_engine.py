@@ -0,0 +1,269 @@
+import os
+import argparse
+import ctypes
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+# --- Configuration ---
+# Overridable through environment variables so classroom machines can be tuned without code changes.
+MODELS_DIR = Path("models")
+MODEL_PATH = os.environ.get("SUGURU_MODEL_PATH", "")  # Explicit GGUF file; otherwise the first *.gguf in MODELS_DIR
+N_THREADS = int(os.environ.get("SUGURU_LLM_THREADS", max(1, (os.cpu_count() or 2) // 2)))  # ~physical cores
+N_CTX = int(os.environ.get("SUGURU_LLM_CTX", 2048))  # Context window (prompt + generated tokens)
+N_BATCH = int(os.environ.get("SUGURU_LLM_BATCH", 256))  # Prompt tokens evaluated per forward pass
+TEMPERATURE = 0.2
+# Sampling settings shared by create_completion here and the batched sampler in inference_scheduler.py
+TOP_K = 40
+TOP_P = 0.95
+MIN_P = 0.05
+REPEAT_PENALTY = 1.1
+REPEAT_LAST_N = 64  # Recent tokens the repeat penalty looks at
+STOP_SEQUENCES = ["<|eot_id|>", "\nStudent"]
+# Memory budget for saved context states of evaluated prompt prefixes (roughly KV cache size per entry)
+PREFIX_CACHE_MB = int(os.environ.get("SUGURU_PREFIX_CACHE_MB", 512))
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def find_model_file(models_dir: Path = MODELS_DIR) -> Optional[Path]:
+    """Returns the GGUF file to load: SUGURU_MODEL_PATH if set, else the first *.gguf in models_dir."""
+    if MODEL_PATH:
+        return Path(MODEL_PATH)
+    candidates = sorted(Path(models_dir).glob("*.gguf"))
+    return candidates[0] if candidates else None
+
+
+def kv_bytes_per_token(model_path: Path) -> int:
+    """KV-cache bytes one token takes in a llama.cpp context (f16 keys and values in every layer),
+    read from the GGUF metadata without loading the weights."""
+    import llama_cpp
+    from llama_cpp._utils import suppress_stdout_stderr
+
+    params = llama_cpp.llama_model_default_params()
+    params.vocab_only = True
+    with suppress_stdout_stderr():
+        model = llama_cpp.llama_load_model_from_file(str(model_path).encode("utf-8"), params)
+    if not model:
+        raise ValueError(f"Failed to read the GGUF metadata of {model_path}")
+    try:
+        buffer = ctypes.create_string_buffer(128)
+
+        def meta(key: str) -> Optional[int]:
+            if llama_cpp.llama_model_meta_val_str(model, key.encode("utf-8"), buffer, len(buffer)) < 0:
+                return None
+            return int(buffer.value)
+
+        llama_cpp.llama_model_meta_val_str(model, b"general.architecture", buffer, len(buffer))
+        arch = buffer.value.decode("utf-8")
+        n_layer = meta(f"{arch}.block_count")
+        n_embd = meta(f"{arch}.embedding_length")
+        n_head = meta(f"{arch}.attention.head_count")
+        n_head_kv = meta(f"{arch}.attention.head_count_kv") or n_head
+    finally:
+        llama_cpp.llama_free_model(model)
+    return 2 * n_layer * (n_embd // n_head * n_head_kv) * 2
+
+
+class PrefixStateCache:
+    """LRU pool of llama.cpp context states saved right after evaluating a prompt prefix.
+
+    Entries are keyed by a hash of the prefix text and hold the prefix tokens plus the raw
+    context state (mostly the KV cache for those tokens). The least recently used entries are
+    evicted once the pool exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = PREFIX_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[np.ndarray, bytes]] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(prefix: str) -> str:
+        return hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[tuple[np.ndarray, bytes]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, tokens: np.ndarray, state: bytes) -> None:
+        size = tokens.nbytes + len(state)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            old_tokens, old_state = self._entries.pop(key)
+            self._bytes -= old_tokens.nbytes + len(old_state)
+        self._entries[key] = (tokens, state)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (old_tokens, old_state) = self._entries.popitem(last=False)
+            self._bytes -= old_tokens.nbytes + len(old_state)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "megabytes": self._bytes / (1024 * 1024),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class LlamaCppModel:
+    """CPU inference with llama.cpp, exposing the same interface as MockLLMModel in main.py.
+
+    The GGUF file is memory-mapped, so loading is fast and the weights are shared through the
+    page cache. A lock serializes generation because a llama.cpp context is not thread-safe.
+
+    Requests that pass a `prefix` (e.g. the per-subtopic preamble from rag.py) restore the
+    context state saved after that prefix was first evaluated, so only the rest of the prompt
+    is evaluated again.
+    """
+
+    def __init__(self, model_path: Path, n_threads: int = N_THREADS, n_ctx: int = N_CTX, n_batch: int = N_BATCH,
+                 prefix_cache_mb: int = PREFIX_CACHE_MB):
+        from llama_cpp import Llama
+
+        model_path = Path(model_path)
+        start = time.perf_counter()
+        self.llm = Llama(
+            model_path=str(model_path),
+            n_ctx=n_ctx,
+            n_batch=n_batch,
+            n_threads=n_threads,
+            n_gpu_layers=0,
+            use_mmap=True,
+            use_mlock=False,
+            last_n_tokens_size=REPEAT_LAST_N,
+            verbose=False,
+        )
+        self.name = f"llama.cpp ({model_path.name})"
+        # Identifies the weights for caches keyed on model output
+        self.version = f"{model_path.name}:{model_path.stat().st_size}"
+        self.last_stats: dict = {}
+        self.prefix_cache = PrefixStateCache(prefix_cache_mb * 1024 * 1024)
+        self._context_prefix: Optional[str] = None  # Key of the prefix the context currently starts with
+        self._lock = threading.Lock()
+        logging.info(f"Loaded {model_path} in {time.perf_counter() - start:.2f}s "
+                     f"(threads={n_threads}, n_ctx={n_ctx}, n_batch={n_batch}).")
+
+    def _save_context(self) -> tuple[np.ndarray, bytes]:
+        # Llama.save_state() would also copy the n_ctx x n_vocab logits array (hundreds of MB);
+        # the tokens and the raw context state are all a later prompt needs to continue from here.
+        import llama_cpp
+
+        ctx = self.llm._ctx.ctx
+        buffer = (ctypes.c_uint8 * llama_cpp.llama_get_state_size(ctx))()
+        n_bytes = llama_cpp.llama_copy_state_data(ctx, buffer)
+        return self.llm.input_ids[:self.llm.n_tokens].copy(), ctypes.string_at(buffer, n_bytes)
+
+    def _restore_context(self, tokens: np.ndarray, state: bytes) -> None:
+        import llama_cpp
+
+        buffer = (ctypes.c_uint8 * len(state)).from_buffer_copy(state)
+        if llama_cpp.llama_set_state_data(self.llm._ctx.ctx, buffer) != len(state):
+            raise RuntimeError("Failed to restore llama.cpp context state")
+        self.llm.input_ids[:len(tokens)] = tokens
+        self.llm.n_tokens = len(tokens)
+
+    def _prepare_prefix(self, prefix: str) -> str:
+        """Puts the context in the state right after `prefix`; returns "resident", "hit" or "miss".
+
+        create_completion then reuses the longest common token prefix and evaluates only the rest.
+        """
+        key = self.prefix_cache.key(prefix)
+        if key == self._context_prefix:
+            return "resident"
+        entry = self.prefix_cache.get(key)
+        if entry is not None:
+            self._restore_context(*entry)
+            return "hit"
+        self.llm.reset()
+        self.llm.eval(self.llm.tokenize(prefix.encode("utf-8"), special=True))
+        self.prefix_cache.put(key, *self._save_context())
+        return "miss"
+
+    def stream_response(self, prompt: str, max_tokens: int = 100, prefix: Optional[str] = None) -> Iterator[str]:
+        """Yields the completion for `prompt` piece by piece as llama.cpp produces it.
+
+        `prefix`, if given, must be the start of `prompt`; its evaluated state is cached and
+        shared with later prompts that start with the same prefix. Time-to-first-token and
+        total latency are logged separately and kept in last_stats.
+        """
+        if prefix is not None and not prompt.startswith(prefix):
+            raise ValueError("prefix must be the beginning of prompt")
+        with self._lock:
+            start = time.perf_counter()
+            first_token_at = None
+            completion_tokens = 0
+            prompt_tokens = len(self.llm.tokenize(prompt.encode("utf-8")))
+            prefix_status = self._prepare_prefix(prefix) if prefix else "none"
+            self._context_prefix = None
+            for chunk in self.llm.create_completion(prompt, max_tokens=max_tokens, temperature=TEMPERATURE,
+                                                    top_k=TOP_K, top_p=TOP_P, min_p=MIN_P,
+                                                    repeat_penalty=REPEAT_PENALTY, stop=STOP_SEQUENCES,
+                                                    stream=True):
+                text = chunk["choices"][0]["text"]
+                if not text:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    logging.info(f"Time to first token: {first_token_at - start:.2f}s ({prompt_tokens} prompt tokens).")
+                completion_tokens += 1
+                yield text
+            self._context_prefix = self.prefix_cache.key(prefix) if prefix else None
+            elapsed = time.perf_counter() - start
+        ttft = (first_token_at or time.perf_counter()) - start
+        decode_seconds = elapsed - ttft
+        self.last_stats = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "time_to_first_token": ttft,
+            "total_seconds": elapsed,
+            "tokens_per_second": (completion_tokens - 1) / decode_seconds if completion_tokens > 1 and decode_seconds > 0 else 0.0,
+            "prefix_cache": prefix_status,
+        }
+        logging.info(f"Generated {completion_tokens} tokens in {elapsed:.2f}s "
+                     f"(first token {ttft:.2f}s, {self.last_stats['tokens_per_second']:.1f} tokens/s, "
+                     f"prefix cache {prefix_status}).")
+
+    def generate_response(self, prompt: str, max_tokens: int = 100, prefix: Optional[str] = None) -> str:
+        """Generates a complete response for `prompt`; see stream_response for the incremental version."""
+        return "".join(self.stream_response(prompt, max_tokens=max_tokens, prefix=prefix)).strip()
+
+
+if __name__ == "__main__":
+    # Smoke test, e.g. against the tiny GGUF the tests use: python llm_engine.py --model tests/tiny.gguf
+    parser = argparse.ArgumentParser(description="Run one generation with the llama.cpp backend.")
+    parser.add_argument("--model", type=Path, default=None, help="GGUF file (defaults to the one in models/).")
+    parser.add_argument("--prompt", default="What comes after 39?")
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=N_THREADS)
+    args = parser.parse_args()
+
+    model_file = args.model or find_model_file()
+    if model_file is None:
+        raise SystemExit(f"No GGUF model found in {MODELS_DIR}/ and SUGURU_MODEL_PATH is not set.")
+    model = LlamaCppModel(model_file, n_threads=args.threads)
+    for piece in model.stream_response(args.prompt, max_tokens=args.max_tokens):
+        print(piece, end="", flush=True)
+    print()
+    print(model.last_stats)
@@ -1,8 +1,16 @@
 import streamlit as st
 import json
 import os
+import time
+import uuid
 from pathlib import Path
 
+from feedback_cache import FeedbackCache
+from inference_scheduler import InferenceScheduler
+from llm_engine import find_model_file
+from rag import FeedbackPromptBuilder, log_timings
+from syllabus_store import open_store
+
 # Set page configuration
 st.set_page_config(
     page_title="SuguruAI - Ghana Educational System",
@@ -14,6 +22,11 @@ st.set_page_config(
 # Constants and configuration
 MODELS_DIR = Path("models")
 DATA_DIR = Path("data")
+FEEDBACK_CACHE_PATH = DATA_DIR / "feedback_cache.sqlite3"
+SYLLABUS_JSON_PATH = DATA_DIR / "syllabus.json"
+SYLLABUS_DB_PATH = DATA_DIR / "syllabus.sqlite3"
+# Bump when the feedback prompt changes so cached feedback from the old prompt is not reused
+PROMPT_VERSION = "2"
 
 # Create directories if they don't exist
 os.makedirs(MODELS_DIR, exist_ok=True)
@@ -88,28 +101,41 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-# Mock LLM model class (placeholder for actual Llama 2 implementation)
+# Mock LLM model class, used when no GGUF model or llama-cpp-python is available
 class MockLLMModel:
     def __init__(self):
         self.name = "Llama 2 Mock"
+        self.version = "mock"
         print(f"Initialized {self.name}")
     
-    def generate_response(self, prompt, max_tokens=100):
+    def generate_response(self, prompt, max_tokens=100, prefix=None, session=None):
         """Simulate generating a response from the model"""
         # This is a mock response - in the actual implementation, 
         # this would connect to the Llama 2 model
         return f"This is a simulated response to: '{prompt[:50]}...'"
 
+    def stream_response(self, prompt, max_tokens=100, prefix=None, session=None):
+        """Simulate streaming a response word by word"""
+        for word in self.generate_response(prompt, max_tokens).split(" "):
+            yield word + " "
+
 # Initialize model
 @st.cache_resource
 def load_model():
-    # In the actual implementation, this would load the Llama 2 model
-    # For now, return a mock model
-    try:
+    # Loads the GGUF model from MODELS_DIR once per process; falls back to the mock model
+    # so the app still runs on machines without a model or llama-cpp-python.
+    # Requests from all sessions go through one scheduler that batches their decoding steps.
+    model_path = find_model_file(MODELS_DIR)
+    if model_path is None:
+        st.warning(f"No GGUF model found in {MODELS_DIR}/. Using the mock model.")
         return MockLLMModel()
+    try:
+        return InferenceScheduler.load(model_path)
+    except ImportError:
+        st.warning("llama-cpp-python is not installed. Using the mock model.")
     except Exception as e:
         st.error(f"Error loading model: {e}")
-        return None
+    return MockLLMModel()
 
 # Load sample syllabus data
 def get_sample_syllabus():
@@ -238,15 +264,51 @@ def get_sample_syllabus():
         }
     }
 
-# Load syllabus data
-@st.cache_data
+# Load syllabus data: compiled once into an indexed SQLite store (from data/syllabus.json if present,
+# otherwise the sample data) and shared by every session; lessons are read on demand
+@st.cache_resource
 def load_syllabus():
-    # In a real implementation, this would load from a file
-    # For now, return the sample data
-    return get_sample_syllabus()
+    return open_store(str(SYLLABUS_DB_PATH), str(SYLLABUS_JSON_PATH), fallback=get_sample_syllabus)
+
+# Feedback cache shared by every session (and persisted across restarts)
+@st.cache_resource
+def load_feedback_cache():
+    return FeedbackCache(str(FEEDBACK_CACHE_PATH))
+
+# Retrieval-augmented feedback prompts; per-subtopic prefixes are shared by every session
+@st.cache_resource
+def load_prompt_builder():
+    return FeedbackPromptBuilder()
 
 model = load_model()
 syllabus = load_syllabus()
+feedback_cache = load_feedback_cache()
+prompt_builder = load_prompt_builder()
+
+def render_feedback(placeholder, feedback, streaming=False):
+    """Render feedback in the styled box; a cursor marks text that is still being generated"""
+    cursor = "▌" if streaming else ""
+    placeholder.markdown(
+        f"<div class='feedback-box'><strong>Feedback:</strong> {feedback}{cursor}</div>",
+        unsafe_allow_html=True
+    )
+
+def stream_feedback(placeholder, prompt, prefix=None):
+    """Generate feedback token by token, updating the feedback box as tokens arrive.
+
+    prefix (the shared start of prompt) lets the model reuse its cached evaluation of it.
+    Returns None if the model is too busy to take the request."""
+    feedback = ""
+    try:
+        for token in model.stream_response(prompt, prefix=prefix, session=st.session_state.session_id):
+            feedback += token
+            render_feedback(placeholder, feedback, streaming=True)
+    except RuntimeError as e:
+        placeholder.warning(str(e))
+        return None
+    feedback = feedback.strip()
+    render_feedback(placeholder, feedback)
+    return feedback
 
 # Main application layout
 def main():
@@ -259,26 +321,26 @@ def main():
     # Education level selection
     education_level = st.sidebar.selectbox(
         "Select Education Level", 
-        options=list(syllabus.keys())
+        options=syllabus.levels()
     )
     
     # Subject selection based on education level
     subject = st.sidebar.selectbox(
         "Select Subject", 
-        options=list(syllabus[education_level].keys())
+        options=syllabus.subjects(education_level)
     )
     
     # Grade selection based on subject
     grade = st.sidebar.selectbox(
         "Select Grade", 
-        options=list(syllabus[education_level][subject].keys())
+        options=syllabus.grades(education_level, subject)
     )
     
     # Main content area
     st.markdown(f"<h2 class='sub-header'>{subject.capitalize()} - {grade.capitalize()}</h2>", unsafe_allow_html=True)
     
     # Get topics for selected grade and subject
-    topics = syllabus[education_level][subject][grade]
+    topics = syllabus.topics(education_level, subject, grade)
     
     # Initialize session state for tracking current topic and subtopic
     if 'current_topic_idx' not in st.session_state:
@@ -292,10 +354,15 @@ def main():
     
     if 'user_answers' not in st.session_state:
         st.session_state.user_answers = {}
+
+    # Identifies this browser session to the inference scheduler, which shares the model fairly between sessions
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
     
     # Get current topic and subtopic
     current_topic = topics[st.session_state.current_topic_idx]
-    current_subtopic = current_topic["subtopics"][st.session_state.current_subtopic_idx]
+    current_subtopic = syllabus.lesson(education_level, subject, grade,
+                                       st.session_state.current_topic_idx, st.session_state.current_subtopic_idx)
     
     # Display current topic and subtopic
     st.markdown(f"<h3 class='sub-header'>{current_topic['topic']}</h3>", unsafe_allow_html=True)
@@ -335,17 +402,31 @@ def main():
             if user_answer:
                 st.session_state.user_answers[exercise_key] = user_answer
                 
-                # Generate feedback if answer changed
+                feedback_placeholder = st.empty()
+
+                # Generate feedback if answer changed, streaming it into the feedback box.
+                # Identical answers to the same exercise (from any session) reuse cached feedback.
                 if user_answer != previous_answer or f"feedback_{exercise_key}" not in st.session_state:
-                    prompt = f"Student response to exercise: '{exercise}'\nStudent answer: '{user_answer}'\nProvide feedback:"
-                    feedback = model.generate_response(prompt)
-                    st.session_state[f"feedback_{exercise_key}"] = feedback
-                
-                # Display feedback
-                st.markdown(
-                    f"<div class='feedback-box'><strong>Feedback:</strong> {st.session_state[f'feedback_{exercise_key}']}</div>",
-                    unsafe_allow_html=True
-                )
+                    exercise_id = f"{exercise_key}:{exercise}"
+                    model_version = f"{model.version}|prompt-{PROMPT_VERSION}"
+                    feedback = feedback_cache.get(exercise_id, user_answer, model_version)
+                    if feedback is not None:
+                        render_feedback(feedback_placeholder, feedback)
+                    else:
+                        rag_prompt = prompt_builder.build(subject, grade, current_topic['topic'], current_subtopic,
+                                                          exercise, user_answer)
+                        generate_start = time.perf_counter()
+                        feedback = stream_feedback(feedback_placeholder, rag_prompt["prompt"], prefix=rag_prompt["prefix"])
+                        rag_prompt["timings"]["generate"] = time.perf_counter() - generate_start
+                        log_timings(rag_prompt["timings"], rag_prompt["sources"])
+                        # Feedback written without curriculum context is shown but not cached.
+                        if feedback is not None and not rag_prompt["retrieval_failed"]:
+                            feedback_cache.put(exercise_id, user_answer, model_version, feedback)
+                    if feedback is not None:
+                        st.session_state[f"feedback_{exercise_key}"] = feedback
+                else:
+                    # Display feedback
+                    render_feedback(feedback_placeholder, st.session_state[f"feedback_{exercise_key}"])
     
     # Navigation buttons
     col1, col2, col3 = st.columns([1, 2, 1])
@@ -382,6 +463,20 @@ def main():
                 st.session_state.show_exercise = False
             st.rerun()
     
+    # Feedback cache effectiveness
+    cache_stats = feedback_cache.stats()
+    st.sidebar.caption(
+        f"Feedback cache: {cache_stats['hit_rate']:.0%} hit rate since restart "
+        f"({cache_stats['hits']} hits, {cache_stats['misses']} misses), "
+        f"{cache_stats['lifetime_hit_rate']:.0%} overall, {cache_stats['entries']} entries"
+    )
+    if isinstance(model, InferenceScheduler):
+        scheduler_stats = model.stats()
+        st.sidebar.caption(
+            f"Model queue: {scheduler_stats['queue_depth']} waiting, {scheduler_stats['active']} generating; "
+            f"latency p50 {scheduler_stats['latency_p50']:.1f}s, p95 {scheduler_stats['latency_p95']:.1f}s"
+        )
+    
     # Footer
     st.markdown("---")
     st.markdown(
@@ -0,0 +1,306 @@
+import os
+import argparse
+import json
+import logging
+import mmap
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from bm25_index import load_fields, where_mask, write_fields
+
+# --- Configuration ---
+CHROMA_DB_PATH = "./syllabusvectordb"  # Ensure these match your ingestion script (pdftovector.py)
+COLLECTION_NAME = "syllabus_collection"
+NUMPY_INDEX_DIRNAME = "numpy_index"  # Kept inside the ChromaDB directory, like the BM25 index
+INDEX_VERSION = 1
+DTYPES = ["float16", "int8"]  # int8 stores each unit-length row scaled to [-127, 127] with its scale
+DEFAULT_DTYPE = "float16"
+READ_PAGE_SIZE = 1000  # Chunks read from ChromaDB per request when exporting
+RESIDENT_MAX_MB = 256  # Indexes whose float32 form fits in this are upcast once and kept in RAM
+BLOCK_ROWS = 4096  # Larger ones are read from the memory map and upcast this many rows at a time
+PROBE_QUERIES = 200  # Stored embeddings used as queries by --benchmark
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+
+def export_collection(collection, directory: str, dtype: str = DEFAULT_DTYPE, page_size: int = READ_PAGE_SIZE) -> int:
+    """Writes every chunk of a ChromaDB collection to a NumPy index in `directory`; returns the chunk count.
+
+    Embeddings are stored unit-length (so a dot product is the cosine similarity) in a
+    memory-mapped matrix; documents and metadata go to a JSON-lines sidecar with byte offsets.
+    The index is written beside the old one and swapped in, so readers never see a partial index.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported dtype {dtype!r}; choose one of {DTYPES}")
+    total = collection.count()
+    tmp_directory = directory + ".tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+
+    ids, metadatas, offsets = [], [], [0]
+    matrix = scales = None
+    with open(os.path.join(tmp_directory, "chunks.jsonl"), "wb") as sidecar:
+        while len(ids) < total:
+            page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=len(ids))
+            if not page["ids"]:
+                break
+            vectors = _normalize(page["embeddings"])
+            if matrix is None:
+                matrix = open_memmap(os.path.join(tmp_directory, "embeddings.npy"), mode="w+",
+                                     dtype=np.dtype(dtype), shape=(total, vectors.shape[1]))
+                if dtype == "int8":
+                    scales = open_memmap(os.path.join(tmp_directory, "scales.npy"), mode="w+",
+                                         dtype=np.float32, shape=(total,))
+            rows = slice(len(ids), len(ids) + len(vectors))
+            if dtype == "int8":
+                row_scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+                matrix[rows] = np.round(vectors / row_scales[:, None]).astype(np.int8)
+                scales[rows] = row_scales
+            else:
+                matrix[rows] = vectors.astype(np.float16)
+            for document, metadata in zip(page["documents"], page["metadatas"]):
+                line = json.dumps({"document": document, "metadata": metadata}, ensure_ascii=False).encode("utf-8") + b"\n"
+                sidecar.write(line)
+                offsets.append(offsets[-1] + len(line))
+            ids.extend(page["ids"])
+            metadatas.extend(page["metadatas"])
+    if matrix is not None:
+        matrix.flush()
+        if scales is not None:
+            scales.flush()
+    else:
+        np.save(os.path.join(tmp_directory, "embeddings.npy"), np.zeros((0, 0), dtype=np.dtype(dtype)))
+    del matrix, scales
+
+    np.save(os.path.join(tmp_directory, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    categories = write_fields(tmp_directory, metadatas)
+    with open(os.path.join(tmp_directory, "ids.json"), "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+    # meta.json is written last and marks a complete index.
+    with open(os.path.join(tmp_directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": INDEX_VERSION, "dtype": dtype, "collection_count": len(ids),
+                   "categories": categories, "exported_at": datetime.now(timezone.utc).isoformat(timespec="seconds")}, f)
+
+    old_directory = directory + ".old"
+    shutil.rmtree(old_directory, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old_directory)
+    os.replace(tmp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+    logging.info(f"Exported {len(ids)} chunks ({dtype}) to {directory}.")
+    return len(ids)
+
+
+def _read_meta(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return meta if meta.get("version") == INDEX_VERSION else {}
+
+
+def index_dtype(directory: str) -> Optional[str]:
+    """The dtype of a complete index in `directory`, or None if there is none."""
+    return _read_meta(directory).get("dtype")
+
+
+def index_count(directory: str) -> Optional[int]:
+    """The number of chunks in a complete index in `directory`, or None if there is none."""
+    return _read_meta(directory).get("collection_count")
+
+
+class NumpyCollection:
+    """Exact (brute-force) search over an exported NumPy index.
+
+    Implements the part of the ChromaDB collection API that retrieval.py uses (count, query and
+    get, with cosine distances), so it can stand in for the collection. Only the embedding matrix
+    is touched per query; documents and metadata are read from the sidecar for the hits alone.
+    NumPy has no fast float16/int8 matrix product, so a small index (the syllabus is a few
+    thousand chunks) is upcast to float32 once and each query is a single BLAS product.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(directory, "ids.json"), "r", encoding="utf-8") as f:
+            self.ids: list[str] = json.load(f)
+        self.positions = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+        self.matrix = np.load(os.path.join(directory, "embeddings.npy"), mmap_mode="r")
+        self.scales = (np.load(os.path.join(directory, "scales.npy"), mmap_mode="r")
+                       if self.meta["dtype"] == "int8" else None)
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self._resident = None
+        if self.matrix.size * 4 <= RESIDENT_MAX_MB * 2 ** 20:
+            self._resident = np.asarray(self.matrix, dtype=np.float32)
+            if self.scales is not None:
+                self._resident *= np.asarray(self.scales)[:, None]
+        self.fields = load_fields(directory)
+        self._sidecar_file = open(os.path.join(directory, "chunks.jsonl"), "rb")
+        self._sidecar = mmap.mmap(self._sidecar_file.fileno(), 0, access=mmap.ACCESS_READ) if len(self.ids) else b""
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def _similarities(self, query: np.ndarray) -> np.ndarray:
+        if self._resident is not None:
+            return self._resident @ query
+        similarities = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), BLOCK_ROWS):
+            block = np.asarray(self.matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+            similarities[start:start + len(block)] = block @ query
+        if self.scales is not None:
+            similarities *= self.scales
+        return similarities
+
+    def _embeddings(self, positions: list[int]) -> np.ndarray:
+        if self._resident is not None:
+            return self._resident[positions]
+        rows = np.asarray(self.matrix[positions], dtype=np.float32)
+        return rows * np.asarray(self.scales[positions])[:, None] if self.scales is not None else rows
+
+    def _chunk(self, position: int) -> dict:
+        return json.loads(self._sidecar[int(self.offsets[position]):int(self.offsets[position + 1])])
+
+    def _results(self, positions: list[int], include: list[str]) -> dict:
+        chunks = [self._chunk(i) for i in positions] if {"documents", "metadatas"} & set(include) else None
+        results = {"ids": [self.ids[i] for i in positions]}
+        if "documents" in include:
+            results["documents"] = [chunk["document"] for chunk in chunks]
+        if "metadatas" in include:
+            results["metadatas"] = [chunk["metadata"] for chunk in chunks]
+        if "embeddings" in include:
+            results["embeddings"] = self._embeddings(positions) if positions else np.zeros((0, self.matrix.shape[1]))
+        return results
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[dict] = None,
+              include: Optional[list[str]] = None) -> dict:
+        """The n_results nearest chunks per query embedding, in ChromaDB's result layout."""
+        if include is None:
+            include = ["documents", "metadatas", "distances"]
+        mask = where_mask(where, self.fields, self.meta["categories"], len(self.ids))
+        results = {key: [] for key in ["ids", *include]}
+        for query in _normalize(np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.matrix.shape[1])):
+            similarities = self._similarities(query)
+            candidates = np.flatnonzero(mask) if mask is not None else np.arange(len(self.ids))
+            if len(candidates) > n_results:
+                candidates = candidates[np.argpartition(-similarities[candidates], n_results - 1)[:n_results]]
+            order = candidates[np.argsort(-similarities[candidates], kind="stable")].tolist()
+            hits = self._results(order, include)
+            if "distances" in include:
+                hits["distances"] = (1.0 - similarities[order]).tolist()
+            for key in results:
+                results[key].append(hits[key])
+        return results
+
+    def get(self, ids: Optional[list[str]] = None, include: Optional[list[str]] = None,
+            limit: Optional[int] = None, offset: int = 0) -> dict:
+        """Chunks by ID (unknown IDs are skipped, as ChromaDB does) or page by page."""
+        if include is None:  # include=[] means IDs only, as in ChromaDB
+            include = ["documents", "metadatas"]
+        if ids is not None:
+            positions = [self.positions[chunk_id] for chunk_id in ids if chunk_id in self.positions]
+        else:
+            positions = list(range(offset, len(self.ids) if limit is None else min(offset + limit, len(self.ids))))
+        return self._results(positions, include)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss survives fork and exec, so a child would report its parent's peak; VmHWM does not.
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def probe(backend: str, db_path: str, queries: int = PROBE_QUERIES, k: int = 10) -> dict:
+    """Startup time, query latency and peak memory of one backend, as measured in this process."""
+    start = time.perf_counter()
+    if backend == "numpy":
+        collection = NumpyCollection(os.path.join(db_path, NUMPY_INDEX_DIRNAME))
+    else:
+        import chromadb
+        collection = chromadb.PersistentClient(path=db_path).get_collection(name=COLLECTION_NAME)
+    open_seconds = time.perf_counter() - start
+
+    # Stored embeddings of a fixed sample of chunks serve as queries, fetched by ID so only they are loaded.
+    ids = collection.get(include=[], limit=collection.count())["ids"]
+    picks = np.random.default_rng(0).choice(len(ids), size=min(queries, len(ids)), replace=False)
+    sample = collection.get(ids=[ids[i] for i in picks.tolist()], include=["embeddings"])
+    by_id = dict(zip(sample["ids"], np.asarray(sample["embeddings"], dtype=np.float32)))
+    latencies, results = [], []
+    for chunk_id in sorted(by_id):
+        vector = by_id[chunk_id]
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[vector], n_results=k, include=["documents", "metadatas", "distances"])
+        latencies.append(time.perf_counter() - start)
+        results.append(result["ids"][0])
+    return {"backend": backend, "open_seconds": open_seconds, "first_query_ms": 1000 * latencies[0],
+            "p50_ms": 1000 * float(np.percentile(latencies[1:] or latencies, 50)),
+            "p99_ms": 1000 * float(np.percentile(latencies[1:] or latencies, 99)),
+            "peak_rss_mb": _peak_rss_mb(), "results": results}
+
+
+def benchmark(db_path: str, queries: int = PROBE_QUERIES) -> list[dict]:
+    """Runs probe() for each backend in a fresh interpreter, so startup and memory are measured cold."""
+    reports = []
+    for backend in ["chroma", "numpy"]:
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, __file__, "--db", db_path, "--probe", backend, "--queries", str(queries)],
+                                check=True, capture_output=True, text=True).stdout
+        report = json.loads(output.strip().splitlines()[-1])
+        report["process_seconds"] = time.perf_counter() - start
+        reports.append(report)
+    reference = reports[0]["results"]
+    print(f"{'backend':<8} {'process s':>9} {'open s':>7} {'first ms':>9} {'p50 ms':>7} {'p99 ms':>7} "
+          f"{'peak RSS MB':>12} {'overlap@10':>11}")
+    for report in reports:
+        overlap = np.mean([len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(report["results"], reference)])
+        report["overlap_with_chroma"] = float(overlap)
+        print(f"{report['backend']:<8} {report['process_seconds']:>9.2f} {report['open_seconds']:>7.2f} "
+              f"{report['first_query_ms']:>9.1f} {report['p50_ms']:>7.2f} {report['p99_ms']:>7.2f} "
+              f"{report['peak_rss_mb']:>12.0f} {overlap:>11.3f}")
+    return reports
+
+
+if __name__ == "__main__":
+    # Exports the collection (pdftovector.py refreshes an existing export after every ingest), e.g.
+    # python numpy_index.py --dtype int8 --benchmark
+    parser = argparse.ArgumentParser(description="Export the syllabus collection to a NumPy index for exact, ChromaDB-free search.")
+    parser.add_argument("--db", default=CHROMA_DB_PATH)
+    parser.add_argument("--dtype", choices=DTYPES, default=DEFAULT_DTYPE)
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare startup, latency and memory against ChromaDB after exporting.")
+    parser.add_argument("--no-export", action="store_true", help="Use the existing export.")
+    parser.add_argument("--queries", type=int, default=PROBE_QUERIES, help="Queries per backend in the benchmark.")
+    parser.add_argument("--probe", choices=["chroma", "numpy"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        print(json.dumps(probe(args.probe, args.db, args.queries)))
+        sys.exit(0)
+    if not args.no_export:
+        import chromadb
+        collection = chromadb.PersistentClient(path=args.db).get_collection(name=COLLECTION_NAME)
+        export_collection(collection, os.path.join(args.db, NUMPY_INDEX_DIRNAME), args.dtype)
+    if args.benchmark:
+        benchmark(args.db, args.queries)
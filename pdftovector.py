@@ -1,9 +1,22 @@
 import os
+import argparse
+import hashlib
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, Optional
+from datetime import datetime, timezone
 import fitz  # PyMuPDF
 import chromadb
-from chromadb.utils import embedding_functions
-import uuid  # For generating unique IDs for each chunk
 import logging
+import bm25_index
+import numpy_index
+from embedding_cache import CachedEncoder
+from syllabus_chunker import chunk_document
+from syllabus_catalog import describe_source, grade_band_label, grade_range_from_codes
 
 # --- Configuration ---
 # IMPORTANT: Create this directory and place your PDF syllabus files inside it.
@@ -18,130 +31,535 @@ COLLECTION_NAME = "syllabus_collection"
 # For potentially better (but slower) embeddings, consider models like 'all-mpnet-base-v2'.
 EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
 
-# Text chunking parameters (character-based)
-CHUNK_SIZE = 1000  # Max characters per chunk
-CHUNK_OVERLAP = 150  # Characters to overlap between chunks
+# Text chunking parameters (token-based, see syllabus_chunker.py). Chunks end on sentence
+# boundaries and never span two strands, sub-strands or content standards.
+CHUNK_MAX_TOKENS = 200  # Max (approximate) tokens per chunk
+CHUNK_OVERLAP_TOKENS = 40  # Whole sentences of overlap between consecutive chunks
+
+# Parallel extraction: PDFs are split into page ranges that are extracted in worker processes.
+EXTRACTION_WORKERS = os.cpu_count() or 1
+PAGES_PER_TASK = 4  # Pages per task; small enough to spread one large PDF over all workers
+
+# Embedding pipeline: chunks from all PDFs are embedded in fixed-size batches. At most
+# PIPELINE_QUEUE_BATCHES batches wait between extraction -> embedding -> ChromaDB writes,
+# which caps the number of chunks held in memory regardless of PDF size.
+EMBED_BATCH_SIZE = 64
+PIPELINE_QUEUE_BATCHES = 4
+
+# Incremental ingestion: per-file content hashes of everything already in the collection.
+# Kept inside the ChromaDB directory so deleting the database also resets the manifest.
+MANIFEST_PATH = os.path.join(CHROMA_DB_PATH, "ingest_manifest.json")
+MANIFEST_VERSION = 1
+
+# HNSW build/search settings pinned by tune_hnsw.py; new collections are created with them.
+HNSW_SETTINGS_PATH = os.path.join(CHROMA_DB_PATH, "hnsw_settings.json")
+
+# Bump when the per-chunk metadata schema (or how its values are derived, e.g. page spans)
+# changes; the next ingest then rebuilds the collection.
+METADATA_VERSION = 3
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extracts all text content from a PDF file."""
+def clean_text(pages: list[str]) -> str:
+    """Joins page texts and removes excessive newlines and leading/trailing whitespace."""
+    return ' '.join("\n".join(pages).split())
+
+
+def extract_pages_serial(pdf_path: str) -> list[str]:
+    """Extracts every page of a PDF in the current process. Returns [] on error."""
     try:
-        doc = fitz.open(pdf_path)
-        full_text = ""
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            full_text += page.get_text("text") + "\n"  # Add newline between pages for clarity
-        doc.close()
-        # Basic cleaning: remove excessive newlines and leading/trailing whitespace
-        cleaned_text = ' '.join(full_text.split())
-        return cleaned_text
+        with fitz.open(pdf_path) as doc:
+            return [doc.load_page(page_num).get_text("text") for page_num in range(len(doc))]
     except Exception as e:
         logging.error(f"Error extracting text from {pdf_path}: {e}")
-        return ""
+        return []
 
 
-def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> list[str]:
-    """Splits text into overlapping chunks."""
-    if not text:
-        return []
-    if chunk_overlap >= chunk_size:
-        raise ValueError("chunk_overlap must be less than chunk_size.")
+def extract_text_from_pdf(pdf_path: str) -> str:
+    """Extracts all text content from a PDF file."""
+    return clean_text(extract_pages_serial(pdf_path))
 
-    chunks = []
-    current_pos = 0
-    text_len = len(text)
 
-    while current_pos < text_len:
-        end_pos = min(current_pos + chunk_size, text_len)
-        chunk = text[current_pos:end_pos]
-        chunks.append(chunk)
+# PDFs opened by the current worker process, so consecutive page ranges of the same file
+# don't reopen it. Bounded because a worker can touch every PDF in the directory.
+_worker_documents: "OrderedDict[str, fitz.Document]" = OrderedDict()
+_WORKER_MAX_OPEN_DOCUMENTS = 4
 
-        if end_pos == text_len:  # Reached the end
-            break
 
-        current_pos += (chunk_size - chunk_overlap)
-        if current_pos >= text_len: # Ensure we don't go past the end if overlap logic pushes it
-            break
+def _extract_page_range(pdf_path: str, start: int, end: int) -> tuple[str, int, list[str]]:
+    """Extracts the text of pages [start, end) of a PDF. Runs inside a worker process."""
+    doc = _worker_documents.pop(pdf_path, None)
+    if doc is None:
+        doc = fitz.open(pdf_path)
+    _worker_documents[pdf_path] = doc
+    while len(_worker_documents) > _WORKER_MAX_OPEN_DOCUMENTS:
+        _worker_documents.popitem(last=False)[1].close()
+    return pdf_path, start, [doc.load_page(page_num).get_text("text") for page_num in range(start, end)]
+
 
-    return [c for c in chunks if c.strip()] # Filter out any empty/whitespace-only chunks
+def iter_extracted_pages(pdf_paths: list[str], workers: int = EXTRACTION_WORKERS,
+                         pages_per_task: int = PAGES_PER_TASK) -> Iterator[tuple[str, list[str]]]:
+    """Extracts PDFs in parallel at page granularity and yields (pdf_path, page_texts) per document.
 
+    Documents are yielded as soon as all of their pages are done, not in input order. A document
+    that fails to extract is yielded with an empty page list. Only a bounded number of page-range
+    tasks is in flight at a time, so memory stays flat however many PDFs there are.
+    """
+    tasks = []
+    page_counts = {}
+    for pdf_path in pdf_paths:
+        try:
+            with fitz.open(pdf_path) as doc:
+                page_count = doc.page_count
+        except Exception as e:
+            logging.error(f"Error opening {pdf_path}: {e}")
+            yield pdf_path, []
+            continue
+        if page_count == 0:
+            yield pdf_path, []
+            continue
+        page_counts[pdf_path] = page_count
+        tasks.extend((pdf_path, start, min(start + pages_per_task, page_count))
+                     for start in range(0, page_count, pages_per_task))
 
-def main():
-    """Main function to process PDFs and store them in ChromaDB."""
-    if not os.path.exists(PDF_DIRECTORY):
-        os.makedirs(PDF_DIRECTORY)
-        logging.info(f"Created directory {PDF_DIRECTORY}. Please add your PDF syllabus files there and re-run.")
+    if workers <= 1:
+        for pdf_path in page_counts:
+            yield pdf_path, extract_pages_serial(pdf_path)
         return
 
-    # 1. Initialize Embedding Function for ChromaDB
-    # This allows ChromaDB to generate embeddings automatically when documents are added.
-    sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=EMBEDDING_MODEL_NAME
-    )
+    pending_pages: dict[str, list] = {path: [None] * count for path, count in page_counts.items()}
+    remaining: dict[str, int] = {path: count for path, count in page_counts.items()}
+    failed: set[str] = set()
+    task_iter = iter(tasks)
+    max_in_flight = workers * 2
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        for task in task_iter:
+            in_flight[pool.submit(_extract_page_range, *task)] = task
+            if len(in_flight) >= max_in_flight:
+                break
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                pdf_path, start, end = in_flight.pop(future)
+                try:
+                    _, _, page_texts = future.result()
+                except Exception as e:
+                    logging.error(f"Error extracting pages {start}-{end - 1} of {pdf_path}: {e}")
+                    failed.add(pdf_path)
+                    page_texts = [""] * (end - start)
+                pending_pages[pdf_path][start:end] = page_texts
+                remaining[pdf_path] -= end - start
+                if remaining[pdf_path] == 0:
+                    pages = pending_pages.pop(pdf_path)
+                    yield pdf_path, [] if pdf_path in failed else pages
+
+            for task in task_iter:
+                in_flight[pool.submit(_extract_page_range, *task)] = task
+                if len(in_flight) >= max_in_flight:
+                    break
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """Returns the SHA-256 hex digest of a file's contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_chunk_id(pdf_name: str, chunk_number: int) -> str:
+    """Deterministic chunk ID, so re-ingesting a file replaces its chunks instead of duplicating them."""
+    return f"{os.path.splitext(pdf_name)[0]}_chunk_{chunk_number}"
+
+
+def ingest_config(embedding_model: str = EMBEDDING_MODEL_NAME, chunk_max_tokens: int = CHUNK_MAX_TOKENS,
+                  chunk_overlap_tokens: int = CHUNK_OVERLAP_TOKENS, hnsw_params: Optional[dict] = None) -> dict:
+    """Settings that change the stored chunks/embeddings. A change forces a full rebuild."""
+    config = {
+        "embedding_model": embedding_model,
+        "chunker": "syllabus_chunker",
+        "chunk_max_tokens": chunk_max_tokens,
+        "chunk_overlap_tokens": chunk_overlap_tokens,
+        "metadata_version": METADATA_VERSION,
+    }
+    if hnsw_params:
+        config["hnsw"] = hnsw_params
+    return config
+
+
+def describe_document(pdf_name: str, chunks: list[dict]) -> dict:
+    """Catalog metadata (subject, grade band, document kind) shared by all chunks of a PDF.
+
+    The grade band comes from the filename; if it names no grades (e.g. "science.pdf") it is
+    taken from the curriculum codes in the document, and failing that covers every grade.
+    """
+    source = describe_source(pdf_name)
+    if source["grade_min"] is None:
+        codes = [chunk["content_standard"] for chunk in chunks if chunk["content_standard"]]
+        grade_range = grade_range_from_codes(codes)
+        if grade_range:
+            source["grade_min"], source["grade_max"] = grade_range
+            source["grade_band"] = grade_band_label(*grade_range)
+        else:
+            source["grade_min"], source["grade_max"] = -1, 9  # KG1-B9: match any grade filter
+    return source
+
+
+def load_manifest(path: str = MANIFEST_PATH) -> Optional[dict]:
+    """Loads the ingest manifest, or returns None if it is missing or unreadable."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logging.warning(f"Could not read ingest manifest {path}: {e}. Falling back to a full rebuild.")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest: dict, path: str = MANIFEST_PATH) -> None:
+    """Writes the manifest atomically so an interrupted run never leaves it half-written."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
 
-    # 2. Initialize ChromaDB Client and Collection
-    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-    logging.info(f"ChromaDB client initialized. Data will be stored in {CHROMA_DB_PATH}")
+
+def load_hnsw_settings(path: str = HNSW_SETTINGS_PATH) -> Optional[dict]:
+    """The "hnsw:*" collection settings pinned by tune_hnsw.py, or None if none are pinned."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["params"]
+    except (OSError, json.JSONDecodeError, KeyError) as e:
+        logging.warning(f"Could not read HNSW settings {path}: {e}. Using ChromaDB's defaults.")
+        return None
+
+
+_STOP = object()  # Sentinel that shuts down a pipeline stage
+
+
+class EmbeddingPipeline:
+    """Embeds chunks and writes them to ChromaDB on background threads.
+
+    add_document() buffers chunks across documents and hands fixed-size batches to an
+    embedding thread, which passes them on to a writer thread calling collection.add().
+    Both hand-offs go through bounded queues, so a slow stage blocks the ones before it
+    instead of letting chunks pile up in memory.
+    """
+
+    def __init__(self, collection, encoder: CachedEncoder,
+                 batch_size: int = EMBED_BATCH_SIZE, queue_batches: int = PIPELINE_QUEUE_BATCHES):
+        self.collection = collection
+        self.encoder = encoder
+        self.batch_size = batch_size
+        self._embed_queue = queue.Queue(maxsize=queue_batches)
+        self._write_queue = queue.Queue(maxsize=queue_batches)
+        self._ids, self._documents, self._metadatas = [], [], []
+        self._pending_callbacks = []  # (chunk position of a document's last chunk, callback)
+        self._buffered_total = 0
+        self._flushed_total = 0
+        self._error = None
+        self.stats = {"chunks": 0, "batches": 0, "embed_seconds": 0.0, "write_seconds": 0.0}
+        self._threads = [
+            threading.Thread(target=self._embed_worker, name="embed", daemon=True),
+            threading.Thread(target=self._write_worker, name="chroma-write", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def add_document(self, ids: list[str], documents: list[str], metadatas: list[dict], on_stored=None) -> None:
+        """Queues one document's chunks. on_stored() runs on the writer thread once all of them are in ChromaDB."""
+        self._ids.extend(ids)
+        self._documents.extend(documents)
+        self._metadatas.extend(metadatas)
+        self._buffered_total += len(ids)
+        if on_stored is not None:
+            self._pending_callbacks.append((self._buffered_total, on_stored))
+        while len(self._ids) >= self.batch_size:
+            self._flush(self.batch_size)
+        self._release_callbacks()
+
+    def close(self) -> None:
+        """Flushes the last partial batch and waits for every stage to finish."""
+        if self._ids:
+            self._flush(len(self._ids))
+        self._release_callbacks()
+        self._put(self._embed_queue, _STOP)
+        for thread in self._threads:
+            thread.join()
+        if self._error is not None:
+            raise RuntimeError(f"Embedding pipeline failed: {self._error}") from self._error
+
+    def abort(self) -> None:
+        """Stops the background stages without flushing buffered chunks."""
+        self._fail(RuntimeError("pipeline aborted"))
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+    def _flush(self, n: int) -> None:
+        batch = ("add", self._ids[:n], self._documents[:n], self._metadatas[:n])
+        del self._ids[:n], self._documents[:n], self._metadatas[:n]
+        self._flushed_total += n
+        self._put_or_raise(self._embed_queue, batch)
+
+    def _release_callbacks(self) -> None:
+        # A document's callback may only follow the batch holding its last chunk.
+        while self._pending_callbacks and self._pending_callbacks[0][0] <= self._flushed_total:
+            self._put_or_raise(self._embed_queue, ("callback", self._pending_callbacks.pop(0)[1]))
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """Blocking put that gives up once another stage has failed."""
+        while self._error is None:
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _put_or_raise(self, q: queue.Queue, item) -> None:
+        if not self._put(q, item):
+            raise RuntimeError(f"Embedding pipeline failed: {self._error}") from self._error
+
+    def _fail(self, error: BaseException) -> None:
+        if self._error is None:
+            self._error = error
+
+    def _encode(self, documents: list[str]) -> list[list[float]]:
+        # Cache hits skip the model entirely; it is only loaded on the first miss.
+        return self.encoder.encode(documents, batch_size=self.batch_size).tolist()
+
+    def _embed_worker(self) -> None:
+        try:
+            while True:
+                item = self._embed_queue.get()
+                if item is _STOP:
+                    break
+                if item[0] == "add":
+                    _, ids, documents, metadatas = item
+                    start = time.perf_counter()
+                    item = ("add", ids, documents, metadatas, self._encode(documents))
+                    self.stats["embed_seconds"] += time.perf_counter() - start
+                if not self._put(self._write_queue, item):
+                    return
+        except BaseException as e:
+            logging.error(f"Embedding stage failed: {e}")
+            self._fail(e)
+        finally:
+            self._put(self._write_queue, _STOP)
+
+    def _write_worker(self) -> None:
+        try:
+            while True:
+                item = self._write_queue.get()
+                if item is _STOP:
+                    break
+                if item[0] == "callback":
+                    item[1]()
+                    continue
+                _, ids, documents, metadatas, embeddings = item
+                start = time.perf_counter()
+                self.collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+                self.stats["write_seconds"] += time.perf_counter() - start
+                self.stats["chunks"] += len(ids)
+                self.stats["batches"] += 1
+        except BaseException as e:
+            logging.error(f"ChromaDB write stage failed: {e}")
+            self._fail(e)
+
+
+def main(full_rebuild: bool = False, workers: int = EXTRACTION_WORKERS, embed_batch_size: int = EMBED_BATCH_SIZE,
+         pdf_directory: str = PDF_DIRECTORY, db_path: str = CHROMA_DB_PATH,
+         embedding_model: str = EMBEDDING_MODEL_NAME, chunk_max_tokens: int = CHUNK_MAX_TOKENS,
+         chunk_overlap_tokens: int = CHUNK_OVERLAP_TOKENS, hnsw_params: Optional[dict] = None,
+         encoder: Optional[CachedEncoder] = None) -> Optional[dict]:
+    """Main function to process PDFs and store them in ChromaDB.
+
+    By default only new or changed PDFs are (re-)embedded, and chunks of PDFs that were
+    removed from pdf_directory are purged. Pass full_rebuild=True to start from scratch.
+    Text extraction runs in `workers` processes; embedding runs in batches of `embed_batch_size`.
+    The remaining arguments override the module settings, e.g. to build benchmark indexes
+    (hnsw_params are extra "hnsw:*" collection settings; by default the ones tune_hnsw.py
+    pinned for db_path). Returns build statistics.
+    """
+    start_time = time.perf_counter()
+    if not os.path.exists(pdf_directory):
+        os.makedirs(pdf_directory)
+        logging.info(f"Created directory {pdf_directory}. Please add your PDF syllabus files there and re-run.")
+        return None
+
+    # 1. Initialize ChromaDB Client and Collection
+    client = chromadb.PersistentClient(path=db_path)
+    logging.info(f"ChromaDB client initialized. Data will be stored in {db_path}")
+    manifest_path = os.path.join(db_path, os.path.basename(MANIFEST_PATH))
+    if hnsw_params is None:
+        hnsw_params = load_hnsw_settings(os.path.join(db_path, os.path.basename(HNSW_SETTINGS_PATH)))
+
+    # Without a manifest we can't tell what the collection holds (e.g. chunks from older runs
+    # with random IDs), so rebuild it; same if chunking/embedding settings have changed.
+    manifest = None if full_rebuild else load_manifest(manifest_path)
+    config = ingest_config(embedding_model, chunk_max_tokens, chunk_overlap_tokens, hnsw_params)
+    if manifest is None or manifest.get("config") != config:
+        if not full_rebuild:
+            logging.info("No usable ingest manifest for the current settings. Rebuilding the collection from scratch.")
+        try:
+            client.delete_collection(name=COLLECTION_NAME)
+            logging.info(f"Deleted existing collection '{COLLECTION_NAME}'.")
+        except Exception:
+            pass  # Collection did not exist yet
+        manifest = {"version": MANIFEST_VERSION, "config": config, "files": {}}
 
     collection = client.get_or_create_collection(
         name=COLLECTION_NAME,
-        embedding_function=sentence_transformer_ef,
-        metadata={"hnsw:space": "cosine"}  # Optional: specify distance metric, cosine is common for text
+        # No embedding function: EmbeddingPipeline computes the embeddings itself.
+        metadata={"hnsw:space": "cosine", **(hnsw_params or {})}  # Optional: specify distance metric, cosine is common for text
     )
     logging.info(f"Using ChromaDB collection: '{COLLECTION_NAME}'")
 
-    # 3. Process PDF Files
-    pdf_files = [os.path.join(PDF_DIRECTORY, f) for f in os.listdir(PDF_DIRECTORY) if f.lower().endswith(".pdf")]
+    # 2. Work out what changed since the last run
+    pdf_files = sorted(os.path.join(pdf_directory, f) for f in os.listdir(pdf_directory) if f.lower().endswith(".pdf"))
 
     if not pdf_files:
-        logging.warning(f"No PDF files found in {PDF_DIRECTORY}. Please add your syllabus PDFs.")
-        return
+        logging.warning(f"No PDF files found in {pdf_directory}. Please add your syllabus PDFs.")
 
-    logging.info(f"Found {len(pdf_files)} PDF files to process.")
+    files_manifest = manifest["files"]
+    current_names = {os.path.basename(p) for p in pdf_files}
 
-    for pdf_path in pdf_files:
-        logging.info(f"Processing {pdf_path}...")
-        full_text = extract_text_from_pdf(pdf_path)
+    removed = sorted(set(files_manifest) - current_names)
+    for pdf_name in removed:
+        collection.delete(where={"source_pdf": pdf_name})
+        del files_manifest[pdf_name]
+        logging.info(f"Purged chunks of removed file {pdf_name}.")
+    if removed:
+        save_manifest(manifest, manifest_path)
 
-        if not full_text:
-            logging.warning(f"No text extracted from {pdf_path}, or an error occurred. Skipping.")
+    to_process = []
+    for pdf_path in pdf_files:
+        pdf_name = os.path.basename(pdf_path)
+        sha256 = file_sha256(pdf_path)
+        entry = files_manifest.get(pdf_name)
+        if entry and entry.get("sha256") == sha256:
             continue
+        to_process.append((pdf_path, sha256))
 
-        text_chunks = chunk_text(full_text)
-        logging.info(f"  Extracted text and split into {len(text_chunks)} chunks.")
+    logging.info(f"Found {len(pdf_files)} PDF files: {len(to_process)} new or changed, "
+                 f"{len(pdf_files) - len(to_process)} unchanged, {len(removed)} removed.")
 
-        if not text_chunks:
-            logging.warning(f"  No valid chunks generated for {pdf_path}. Skipping.")
-            continue
+    # 3. Drop whatever earlier versions of changed files left behind
+    for pdf_path, _ in to_process:
+        pdf_name = os.path.basename(pdf_path)
+        if pdf_name in files_manifest:
+            collection.delete(where={"source_pdf": pdf_name})
+            del files_manifest[pdf_name]
+            save_manifest(manifest, manifest_path)
+
+    # 4. Extract, chunk, embed and store new and changed PDF Files
+    def record_stored_file(pdf_name: str, entry: dict) -> None:
+        # Runs on the writer thread once all of a file's chunks are stored,
+        # so an interrupted run retries that file.
+        files_manifest[pdf_name] = entry
+        save_manifest(manifest, manifest_path)
+
+    if to_process:
+        hashes = dict(to_process)
+        encoder = encoder or CachedEncoder(embedding_model, batch_size=embed_batch_size)
+        pipeline = EmbeddingPipeline(collection, encoder, batch_size=embed_batch_size)
+        try:
+            for pdf_path, pages in iter_extracted_pages(list(hashes), workers=workers):
+                pdf_name = os.path.basename(pdf_path)
+                logging.info(f"Processing {pdf_path}...")
+
+                if not any(page.strip() for page in pages):
+                    logging.warning(f"No text extracted from {pdf_path}, or an error occurred. Skipping.")
+                    continue
+
+                text_chunks = chunk_document(pages, max_tokens=chunk_max_tokens, overlap_tokens=chunk_overlap_tokens)
+                logging.info(f"  Extracted {len(pages)} pages and split them into {len(text_chunks)} chunks.")
+
+                if not text_chunks:
+                    logging.warning(f"  No valid chunks generated for {pdf_path}. Skipping.")
+                    continue
+
+                # Prepare data for the embedding pipeline
+                source = describe_document(pdf_name, text_chunks)
+                documents_to_add = []
+                metadatas_to_add = []
+                ids_to_add = []
+
+                for i, chunk in enumerate(text_chunks):
+                    documents_to_add.append(chunk["text"])
+                    metadatas_to_add.append({
+                        "source_pdf": pdf_name,
+                        **source,
+                        "chunk_number": i + 1,
+                        "original_length_chars": len(chunk["text"]),
+                        "page_start": chunk["page_start"],
+                        "page_end": chunk["page_end"],
+                        "strand": chunk["strand"],
+                        "sub_strand": chunk["sub_strand"],
+                        "content_standard": chunk["content_standard"],
+                        "indicators": chunk["indicators"],
+                    })
+                    ids_to_add.append(make_chunk_id(pdf_name, i + 1))
+
+                entry = {
+                    "sha256": hashes[pdf_path],
+                    "size_bytes": os.path.getsize(pdf_path),
+                    "chunk_count": len(documents_to_add),
+                    "subject": source["subject"],
+                    "grade_band": source["grade_band"],
+                    "ingested_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                }
+                pipeline.add_document(ids_to_add, documents_to_add, metadatas_to_add,
+                                      on_stored=lambda name=pdf_name, entry=entry: record_stored_file(name, entry))
+        except BaseException:
+            pipeline.abort()
+            encoder.cache.save()  # Keep what was embedded before the failure
+            raise
+        pipeline.close()
+        encoder.cache.save()
+        stats = pipeline.stats
+        cache_stats = encoder.cache.stats()
+        logging.info(f"Embedded and stored {stats['chunks']} chunks in {stats['batches']} batches "
+                     f"(embedding {stats['embed_seconds']:.1f}s, writes {stats['write_seconds']:.1f}s).")
+        logging.info(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                     f"{cache_stats['evictions']} evictions, {cache_stats['entries']} entries.")
 
-        # Prepare data for ChromaDB batch insertion
-        documents_to_add = []
-        metadatas_to_add = []
-        ids_to_add = []
-
-        for i, chunk in enumerate(text_chunks):
-            documents_to_add.append(chunk)
-            metadatas_to_add.append({
-                "source_pdf": os.path.basename(pdf_path),
-                "chunk_number": i + 1,
-                "original_length_chars": len(chunk)
-            })
-            # Generate a unique ID for each chunk to prevent collisions
-            ids_to_add.append(f"{os.path.basename(pdf_path).replace('.pdf', '')}_chunk_{i+1}_{uuid.uuid4()}")
-
-        if documents_to_add:
-            collection.add(
-                documents=documents_to_add,
-                metadatas=metadatas_to_add,
-                ids=ids_to_add
-            )
-            logging.info(f"  Added {len(documents_to_add)} chunks to ChromaDB from {os.path.basename(pdf_path)}.")
+    # 5. Keep the lexical (BM25) index in step with the collection...
+    total_chunks = collection.count()
+    bm25_directory = os.path.join(db_path, bm25_index.BM25_DIRNAME)
+    if to_process or removed or not bm25_index.index_is_current(bm25_directory, total_chunks):
+        bm25_index.rebuild_from_collection(collection, bm25_directory)
+    # ...and so is the NumPy export, if one was made (numpy_index.py)
+    numpy_directory = os.path.join(db_path, numpy_index.NUMPY_INDEX_DIRNAME)
+    numpy_dtype = numpy_index.index_dtype(numpy_directory)
+    if numpy_dtype and (to_process or removed or numpy_index.index_count(numpy_directory) != total_chunks):
+        numpy_index.export_collection(collection, numpy_directory, numpy_dtype)
 
     logging.info("Finished processing all PDFs.")
-    logging.info(f"Total documents in collection '{COLLECTION_NAME}': {collection.count()}")
+    elapsed = time.perf_counter() - start_time
+    logging.info(f"Total documents in collection '{COLLECTION_NAME}': {total_chunks}")
+    logging.info(f"Ingestion took {elapsed:.1f}s.")
+    return {"seconds": elapsed, "chunks": total_chunks, "files": len(pdf_files), "processed_files": len(to_process)}
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Ingest syllabus PDFs into the ChromaDB vector store.")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore the ingest manifest and rebuild the collection from scratch.")
+    parser.add_argument("--workers", type=int, default=EXTRACTION_WORKERS,
+                        help="Number of PDF extraction processes (1 extracts in the main process).")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE,
+                        help="Number of chunks embedded per model call.")
+    args = parser.parse_args()
+    main(full_rebuild=args.full, workers=args.workers, embed_batch_size=args.batch_size)
\ No newline at end of file
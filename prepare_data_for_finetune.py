@@ -1,7 +1,13 @@
 import chromadb
+import argparse
 import json
 import logging
 import os
+from typing import Iterator, Optional
+
+from inference_scheduler import InferenceScheduler
+from instruction_synthesis import InstructionSynthesizer
+from llm_engine import find_model_file
 
 # --- Configuration ---
 # Ensure these match your existing ChromaDB setup
@@ -11,6 +17,11 @@ COLLECTION_NAME = "syllabus_collection" # Name of your collection in ChromaDB
 # Output file for the fine-tuning dataset
 OUTPUT_FINETUNE_DATA_FILE = "./syllabus_finetune_data.jsonl"
 
+# Streaming export
+PAGE_SIZE = 500  # Chunks fetched from ChromaDB per request
+SHARD_SIZE = 0  # Entries per output file; 0 writes a single file
+WRITE_BUFFER_BYTES = 1024 * 1024
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -26,29 +37,178 @@ def format_for_llama3_finetuning(chunk_text: str, source_pdf: str, chunk_num: in
 
     return f"<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\n{user_prompt}<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n{assistant_response}<|eot_id|>"
 
-def main():
+def iter_collection_pages(collection, page_size: int = PAGE_SIZE, start_offset: int = 0) -> Iterator[tuple[int, list, list, list]]:
+    """Yields (offset after the page, ids, documents, metadatas) one page at a time."""
+    offset = start_offset
+    while True:
+        page = collection.get(include=['documents', 'metadatas'], limit=page_size, offset=offset)
+        documents = page.get('documents') or []
+        if not documents:
+            return
+        offset += len(documents)
+        yield offset, page['ids'], documents, page.get('metadatas') or []
+
+def iter_finetune_entries(documents: list, metadatas: list) -> Iterator[dict]:
+    """Formats one page of chunks, skipping chunks without text or metadata."""
+    for doc_text, meta in zip(documents, metadatas):
+        if doc_text and meta: # Ensure both document text and metadata exist
+            source_pdf = meta.get('source_pdf', 'Unknown_PDF_Source')
+            chunk_num = meta.get('chunk_number', 0)
+            yield {"text": format_for_llama3_finetuning(doc_text, source_pdf, chunk_num), "source": source_pdf,
+                   "chunk": f"{source_pdf}:{chunk_num}"}
+
+def progress_path(output_path: str) -> str:
+    return output_path + ".progress.json"
+
+def shard_path(output_path: str, shard: int, shard_size: int) -> str:
+    """output.jsonl when unsharded, otherwise output-00000.jsonl, output-00001.jsonl, ..."""
+    if not shard_size:
+        return output_path
+    root, ext = os.path.splitext(output_path)
+    return f"{root}-{shard:05d}{ext}"
+
+class ShardedJsonlWriter:
+    """Buffered JSONL writer that starts a new file every shard_size entries.
+
+    position() describes everything written so far; a writer created with that position
+    truncates the current shard back to it and continues appending, which is how an
+    interrupted export resumes without duplicating or losing entries.
+    """
+
+    def __init__(self, output_path: str, shard_size: int = SHARD_SIZE, position: Optional[dict] = None):
+        self.output_path = output_path
+        self.shard_size = shard_size
+        position = position or {"shard": 0, "shard_entries": 0, "shard_bytes": 0, "written": 0}
+        self.shard = position["shard"]
+        self.shard_entries = position["shard_entries"]
+        self.written = position["written"]
+        self._file = self._open(position["shard_bytes"])
+
+    def _open(self, keep_bytes: int):
+        path = shard_path(self.output_path, self.shard, self.shard_size)
+        if keep_bytes and os.path.exists(path):
+            with open(path, 'r+b') as f:
+                f.truncate(keep_bytes)
+            return open(path, 'a', encoding='utf-8', buffering=WRITE_BUFFER_BYTES)
+        return open(path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_BYTES)
+
+    def write(self, entry: dict) -> None:
+        if self.shard_size and self.shard_entries >= self.shard_size:
+            self._file.close()
+            self.shard += 1
+            self.shard_entries = 0
+            self._file = self._open(0)
+        self._file.write(json.dumps(entry) + '\n')
+        self.shard_entries += 1
+        self.written += 1
+
+    def position(self) -> dict:
+        """Flushes to disk and returns the resume position."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"shard": self.shard, "shard_entries": self.shard_entries,
+                "shard_bytes": self._file.tell(), "written": self.written}
+
+    def close(self) -> None:
+        self._file.close()
+
+def load_progress(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_progress(progress: dict, path: str) -> None:
+    """Writes the progress file atomically so an interruption never leaves it half-written."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, path)
+
+def load_synthesis_model():
+    """The local GGUF model behind a batching scheduler, or None to synthesize from templates only."""
+    model_path = find_model_file()
+    if model_path is None:
+        logging.warning("No GGUF model found; synthesizing template pairs only.")
+        return None
+    try:
+        return InferenceScheduler.load(model_path)
+    except ImportError:
+        logging.warning("llama-cpp-python is not installed; synthesizing template pairs only.")
+        return None
+
+def iter_written_entries(output_path: str, position: dict, shard_size: int) -> Iterator[dict]:
+    """Entries already exported before `position`, shard by shard."""
+    for shard in range(position["shard"] + 1):
+        path = shard_path(output_path, shard, shard_size)
+        limit = position["shard_bytes"] if shard == position["shard"] else None
+        read = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                read += len(line)
+                if limit is not None and read > limit:
+                    break
+                yield json.loads(line)
+
+def main(output_path: str = OUTPUT_FINETUNE_DATA_FILE, page_size: int = PAGE_SIZE, shard_size: int = SHARD_SIZE,
+         restart: bool = False, synthesize: bool = True, use_model: bool = True):
     logging.info("Starting data preparation for fine-tuning...")
     client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
     logging.info(f"Attempting to connect to ChromaDB collection: '{COLLECTION_NAME}' at path '{CHROMA_DB_PATH}'")
     collection = client.get_collection(name=COLLECTION_NAME)
-    logging.info(f"Successfully connected to collection. Total documents: {collection.count()}")
+    total = collection.count()
+    logging.info(f"Successfully connected to collection. Total documents: {total}")
 
-    results = collection.get(include=['documents', 'metadatas'])
-    documents = results.get('documents', [])
-    metadatas = results.get('metadatas', [])
+    # Offsets are only meaningful for the collection they were recorded against.
+    progress_file = progress_path(output_path)
+    progress = None if restart else load_progress(progress_file)
+    if progress and (progress.get("collection_count") != total or progress.get("shard_size") != shard_size
+                     or progress.get("synthesize") != synthesize):
+        logging.warning("Collection or shard size changed since the interrupted export; starting over.")
+        progress = None
+    if progress:
+        logging.info(f"Resuming export at chunk {progress['offset']} ({progress['position']['written']} entries written).")
 
-    finetuning_data_entries = []
-    for doc_text, meta in zip(documents, metadatas):
-        if doc_text and meta: # Ensure both document text and metadata exist
-            source_pdf = meta.get('source_pdf', 'Unknown_PDF_Source')
-            chunk_num = meta.get('chunk_number', 0)
-            formatted_entry_text = format_for_llama3_finetuning(doc_text, source_pdf, chunk_num)
-            finetuning_data_entries.append({"text": formatted_entry_text})
+    synthesizer = None
+    if synthesize:
+        synthesizer = InstructionSynthesizer(model=load_synthesis_model() if use_model else None)
+        if progress:
+            # The near-duplicate filter must also see what was exported before the interruption.
+            for entry in iter_written_entries(output_path, progress["position"], shard_size):
+                synthesizer.remember(entry)
+            previous = collection.get(include=['documents', 'metadatas'], limit=page_size,
+                                      offset=max(0, progress["offset"] - page_size))
+            synthesizer.prime(previous.get('documents') or [], previous.get('metadatas') or [])
 
-    with open(OUTPUT_FINETUNE_DATA_FILE, 'w', encoding='utf-8') as f:
-        for entry in finetuning_data_entries:
-            f.write(json.dumps(entry) + '\n')
-    logging.info(f"Successfully wrote {len(finetuning_data_entries)} formatted entries to {OUTPUT_FINETUNE_DATA_FILE}")
+    offset = progress["offset"] if progress else 0
+    writer = ShardedJsonlWriter(output_path, shard_size, progress["position"] if progress else None)
+    try:
+        for offset, ids, documents, metadatas in iter_collection_pages(collection, page_size, offset):
+            entries = (synthesizer.entries(documents, metadatas, ids) if synthesizer
+                       else iter_finetune_entries(documents, metadatas))
+            for entry in entries:
+                writer.write(entry)
+            save_progress({"offset": offset, "collection_count": total, "shard_size": shard_size,
+                           "synthesize": synthesize, "position": writer.position()}, progress_file)
+            logging.info(f"Exported {offset}/{total} chunks.")
+    finally:
+        writer.close()
+    if os.path.exists(progress_file):
+        os.remove(progress_file)
+    logging.info(f"Successfully wrote {writer.written} formatted entries to "
+                 f"{writer.shard + 1 if shard_size else 1} file(s) at {output_path}")
+    if synthesizer:
+        logging.info(f"Synthesis: {synthesizer.stats}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Export the syllabus collection as a JSONL fine-tuning dataset.")
+    parser.add_argument("--output", default=OUTPUT_FINETUNE_DATA_FILE)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help="Chunks fetched per ChromaDB request.")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Entries per output file (0 = one file).")
+    parser.add_argument("--restart", action="store_true", help="Ignore any interrupted export and start over.")
+    parser.add_argument("--no-model", action="store_true", help="Synthesize template pairs only, without the local model.")
+    parser.add_argument("--single-template", action="store_true",
+                        help="Write one templated pair per chunk, without synthesis or de-duplication.")
+    args = parser.parse_args()
+    main(output_path=args.output, page_size=args.page_size, shard_size=args.shard_size, restart=args.restart,
+         synthesize=not args.single_template, use_model=not args.no_model)
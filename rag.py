@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from syllabus_catalog import grade_label, parse_grade
+from syllabus_chunker import count_tokens
+from text_utils import split_sentences
+
+# --- Configuration ---
+RAG_TOP_K = 6  # Chunks fetched per subtopic, before deduplication and budgeting
+RERANKED_TOP_K = 2  # Chunks fetched per subtopic when retrieval re-ranks with the cross-encoder
+CONTEXT_TOKEN_BUDGET = 512  # Approximate tokens of curriculum context placed in the prompt
+MIN_NEW_CONTENT_FRACTION = 0.25  # Chunks with less unseen text than this are dropped as duplicates
+MAX_CACHED_PREFIXES = 256
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def _normalize_sentence(sentence: str) -> str:
+    return ' '.join(sentence.split()).casefold()
+
+
+def dedupe_chunks(hits: list[dict], min_new_fraction: float = MIN_NEW_CONTENT_FRACTION) -> list[dict]:
+    """Removes repeated text from ranked hits.
+
+    Neighbouring chunks share the sentences the chunker carries over as overlap, so sentences
+    already seen in a higher-ranked hit are cut, and hits left with little new text are dropped.
+    """
+    seen: set[str] = set()
+    unique = []
+    for hit in hits:
+        sentences = split_sentences(hit["text"])
+        fresh = [s for s in sentences if _normalize_sentence(s) not in seen]
+        total_tokens = count_tokens(hit["text"])
+        fresh_text = ' '.join(' '.join(s.split()) for s in fresh)
+        if not fresh or (total_tokens and count_tokens(fresh_text) / total_tokens < min_new_fraction):
+            continue
+        seen.update(_normalize_sentence(s) for s in sentences)
+        unique.append({**hit, "text": fresh_text})
+    return unique
+
+
+def fit_to_budget(hits: list[dict], token_budget: int = CONTEXT_TOKEN_BUDGET) -> list[dict]:
+    """Keeps hits in rank order while they fit in token_budget, skipping any that would overflow it."""
+    kept, used = [], 0
+    for hit in hits:
+        tokens = count_tokens(hit["text"])
+        if used + tokens > token_budget:
+            continue
+        kept.append(hit)
+        used += tokens
+    return kept
+
+
+def format_source(metadata: dict) -> str:
+    source = metadata.get("source_pdf", "syllabus")
+    page_start, page_end = metadata.get("page_start"), metadata.get("page_end")
+    if page_start is None:
+        return source
+    return f"{source} p.{page_start}" if page_start == page_end else f"{source} pp.{page_start}-{page_end}"
+
+
+class FeedbackPromptBuilder:
+    """Builds retrieval-augmented feedback prompts.
+
+    A prompt is a per-subtopic prefix (instructions plus the curriculum chunks retrieved for that
+    subtopic) followed by the exercise and the student's answer. The prefix depends only on the
+    subtopic, so it is built once, reused verbatim for every answer, and can be KV-cached by the
+    model; retrieval and assembly therefore cost nothing after the first answer in a subtopic.
+    A prefix built while retrieval was failing is used but not cached, so the next answer
+    retries retrieval instead of being stuck without curriculum context.
+    """
+
+    def __init__(self, k: int = RAG_TOP_K, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 max_prefixes: int = MAX_CACHED_PREFIXES):
+        self.k = k
+        self.token_budget = token_budget
+        self.max_prefixes = max_prefixes
+        self._prefixes: OrderedDict[tuple, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _retrieve(self, query: str, subject: str, grade: str) -> Optional[list[dict]]:
+        """Top-k chunks for the subject and grade, or None if the vector store is unavailable."""
+        try:
+            import retrieval
+            k = min(self.k, RERANKED_TOP_K) if retrieval.RERANK_SEARCH else self.k
+            return retrieval.retrieve(query, subject=subject, grade=grade, k=k)
+        except Exception as e:
+            logging.warning(f"Syllabus retrieval unavailable, prompting without curriculum context: {e}")
+            return None
+
+    def prefix(self, subject: str, grade: str, topic: str, subtopic: dict) -> dict:
+        """Returns {"text", "sources", "retrieval_failed", "timings"} for a subtopic, building it on first use."""
+        key = (subject, grade, topic, subtopic["title"])
+        with self._lock:
+            cached = self._prefixes.get(key)
+            if cached is not None:
+                self._prefixes.move_to_end(key)
+                return {**cached, "timings": {"retrieve": 0.0, "assemble": 0.0}}
+
+        start = time.perf_counter()
+        hits = self._retrieve(f"{topic}: {subtopic['title']}. {subtopic.get('content', '')}", subject, grade)
+        retrieval_failed = hits is None
+        retrieve_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        context = fit_to_budget(dedupe_chunks(hits or []), self.token_budget)
+        grade_number = parse_grade(grade)
+        grade_name = grade_label(grade_number) if grade_number is not None else grade
+        lines = [
+            f"You are SuguruAI, a friendly tutor following the Ghana {grade_name} "
+            f"{subject.replace('_', ' ')} curriculum.",
+            f"Topic: {topic}",
+            f"Lesson: {subtopic['title']}",
+        ]
+        if context:
+            lines.append("")
+            lines.append("Curriculum notes:")
+            lines.extend(f"[{i}] ({format_source(hit['metadata'])}) {hit['text']}" for i, hit in enumerate(context, 1))
+        lines.append("")
+        lines.append("Using the curriculum notes, say whether the student's answer is correct and explain briefly "
+                     "in simple, encouraging language suitable for the grade.")
+        entry = {"text": "\n".join(lines) + "\n", "sources": [hit["id"] for hit in context],
+                 "retrieval_failed": retrieval_failed}
+        assemble_seconds = time.perf_counter() - start
+
+        if not retrieval_failed:
+            with self._lock:
+                self._prefixes[key] = entry
+                while len(self._prefixes) > self.max_prefixes:
+                    self._prefixes.popitem(last=False)
+        return {**entry, "timings": {"retrieve": retrieve_seconds, "assemble": assemble_seconds}}
+
+    def build(self, subject: str, grade: str, topic: str, subtopic: dict, exercise: str, answer: str) -> dict:
+        """Returns {"prefix", "suffix", "prompt", "sources", "retrieval_failed", "timings"} for one student answer."""
+        prefix = self.prefix(subject, grade, topic, subtopic)
+        suffix = f"\nExercise: '{exercise}'\nStudent answer: '{answer}'\nFeedback:"
+        return {
+            "prefix": prefix["text"],
+            "suffix": suffix,
+            "prompt": prefix["text"] + suffix,
+            "sources": prefix["sources"],
+            "retrieval_failed": prefix["retrieval_failed"],
+            "timings": dict(prefix["timings"]),
+        }
+
+
+def log_timings(timings: dict, sources: Optional[list[str]] = None) -> None:
+    stages = ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in timings.items())
+    logging.info(f"Feedback RAG timings: {stages} ({len(sources or [])} context chunks).")
@@ -0,0 +1,138 @@
+import os
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# --- Configuration ---
+RERANK_MODEL_NAME = os.environ.get("SUGURU_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_BATCH_SIZE = 8  # (query, chunk) pairs scored per model call
+RERANK_BUDGET_MS = float(os.environ.get("SUGURU_RERANK_BUDGET_MS", 150))  # Per-query time budget for scoring
+RERANK_CACHE_SIZE = 20_000  # (query, chunk) scores kept, least recently used evicted first
+RERANK_THREADS = int(os.environ.get("SUGURU_RERANK_THREADS", 0))  # torch intra-op threads; 0 keeps the default
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def score_key(model_name: str, query: str, chunk_id: str, text: str) -> str:
+    """Cache key of one (query, chunk) score; includes the chunk text so re-ingested chunks are rescored."""
+    normalized_query = ' '.join(query.casefold().split())
+    return hashlib.blake2b(f"{model_name}\0{normalized_query}\0{chunk_id}\0{text}".encode("utf-8"),
+                           digest_size=16).hexdigest()
+
+
+class CrossEncoderReranker:
+    """Re-orders retrieved chunks by a cross-encoder's (query, chunk) relevance score.
+
+    Uncached pairs are scored in retrieval order, in batches sized to fit the time left in the
+    per-query budget (from the measured time per pair). If the budget runs out first, the
+    longest fully scored run of top candidates is re-ranked and the rest keep their retrieval
+    order after it, so a slow machine gets results on time and still uses the scores it paid
+    for. Scores are cached per (query, chunk), so repeated questions are re-ranked without
+    running the model.
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL_NAME, batch_size: int = RERANK_BATCH_SIZE,
+                 budget_ms: float = RERANK_BUDGET_MS, cache_size: int = RERANK_CACHE_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, float] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._seconds_per_pair: Optional[float] = None  # Moving average of the model's time per pair
+        self.stats = {"queries": 0, "reranked": 0, "partial": 0, "fallbacks": 0, "pairs_scored": 0,
+                      "cache_hits": 0, "score_seconds": 0.0}
+
+    @property
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                if RERANK_THREADS:
+                    import torch
+                    torch.set_num_threads(RERANK_THREADS)
+                logging.info(f"Loading re-ranking model '{self.model_name}'...")
+                self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def _cached(self, key: str) -> Optional[float]:
+        with self._cache_lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _store(self, keys: list[str], scores) -> None:
+        with self._cache_lock:
+            for key, score in zip(keys, scores):
+                self._cache[key] = float(score)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _batch_limit(self, remaining: float) -> int:
+        """Pairs that fit in `remaining` seconds (at most batch_size; 0 if not even one does)."""
+        if self._seconds_per_pair is None:
+            return self.batch_size
+        return min(self.batch_size, int(remaining / self._seconds_per_pair))
+
+    def rerank(self, query: str, hits: list[dict], k: int, budget_ms: Optional[float] = None) -> list[dict]:
+        """Returns the k best hits by cross-encoder score (with "rerank_score"). If the budget ran
+        out first, only the leading hits that were all scored are re-ranked; the rest follow in
+        their given order."""
+        if not hits:
+            return hits
+        model = self.model  # Loaded outside the budget
+        budget = (self.budget_ms if budget_ms is None else budget_ms) / 1000
+        deadline = time.perf_counter() + budget
+        keys = [score_key(self.model_name, query, hit["id"], hit["text"]) for hit in hits]
+        scores = [self._cached(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        self.stats["queries"] += 1
+        self.stats["cache_hits"] += len(hits) - len(missing)
+
+        start = time.perf_counter()
+        while missing:
+            batch_start = time.perf_counter()
+            limit = self._batch_limit(deadline - batch_start)
+            if limit <= 0:
+                break
+            batch, missing = missing[:limit], missing[limit:]
+            batch_scores = model.predict([(query, hits[i]["text"]) for i in batch],
+                                         batch_size=self.batch_size, show_progress_bar=False)
+            per_pair = (time.perf_counter() - batch_start) / len(batch)
+            self._seconds_per_pair = (per_pair if self._seconds_per_pair is None
+                                      else 0.8 * self._seconds_per_pair + 0.2 * per_pair)
+            self._store([keys[i] for i in batch], batch_scores)
+            for i, score in zip(batch, batch_scores):
+                scores[i] = float(score)
+            self.stats["pairs_scored"] += len(batch)
+        self.stats["score_seconds"] += time.perf_counter() - start
+
+        # Scores are only comparable among the leading hits that were all scored: a cached score
+        # further down must not jump ahead of an unscored hit the retrieval ranked higher.
+        scored = next((i for i, score in enumerate(scores) if score is None), len(hits))
+        if scored == 0:
+            self.stats["fallbacks"] += 1
+            return hits[:k]
+        self.stats["reranked" if scored == len(hits) else "partial"] += 1
+        order = sorted(range(scored), key=lambda i: -scores[i])
+        return ([{**hits[i], "rerank_score": scores[i]} for i in order] + hits[scored:])[:k]
+
+
+_reranker: Optional[CrossEncoderReranker] = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> CrossEncoderReranker:
+    """Returns the shared re-ranker; the model is loaded on first use."""
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = CrossEncoderReranker()
+        return _reranker
@@ -0,0 +1,291 @@
+import os
+import json
+import logging
+import threading
+import urllib.error
+import urllib.request
+from typing import Optional, Union
+
+import numpy as np
+
+from bm25_index import BM25_DIRNAME, BM25Index
+from embedding_cache import CachedEncoder
+from numpy_index import NUMPY_INDEX_DIRNAME, NumpyCollection
+from syllabus_catalog import normalize_subject, parse_grade
+
+# --- Configuration ---
+# Ensure these match your ingestion script (pdftovector.py)
+CHROMA_DB_PATH = "./syllabusvectordb"
+COLLECTION_NAME = "syllabus_collection"
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+DEFAULT_K = 5
+
+# "chroma" searches the ChromaDB collection (HNSW); "numpy" does exact search over the export
+# written by numpy_index.py, which starts faster and needs far less memory on small machines.
+RETRIEVAL_BACKEND = os.environ.get("SUGURU_RETRIEVAL_BACKEND", "chroma")
+
+# Hybrid search: dense and BM25 rankings are merged by reciprocal rank fusion. Exact codes and
+# terms (indicator IDs like B5.2.1.1) that embeddings match poorly come in through BM25.
+HYBRID_SEARCH = os.environ.get("SUGURU_HYBRID_SEARCH", "1") != "0"
+FUSION_CANDIDATES = 20  # Candidates taken from each ranking before fusion
+RRF_K = 60  # Reciprocal rank fusion constant: score = sum over rankings of 1 / (RRF_K + rank)
+
+# Re-ranking: a cross-encoder (reranker.py) re-scores the top candidates against the query, so
+# callers can take fewer, more precise chunks. Off by default; it adds a model and CPU time.
+RERANK_SEARCH = os.environ.get("SUGURU_RERANK", "0") == "1"
+RERANK_CANDIDATES = 10  # Candidates retrieved for the cross-encoder to re-order
+
+# If set (e.g. "http://127.0.0.1:8765"), searches go to retrieval_server.py, which keeps the
+# model and collection warm, instead of loading them in this process.
+RETRIEVAL_SERVICE_URL = os.environ.get("SUGURU_RETRIEVAL_SERVICE_URL", "")
+SERVICE_TIMEOUT_SECONDS = 10
+
+# The encoder and collection are created on first use and shared by every caller in the process.
+_lock = threading.Lock()
+_encoder: Optional[CachedEncoder] = None
+_collection = None
+_bm25: Optional[BM25Index] = None
+_bm25_mtime: Optional[float] = None
+_reranker_failed = False
+
+
+def get_encoder() -> CachedEncoder:
+    """Returns the shared (embedding-cached) query encoder."""
+    global _encoder
+    with _lock:
+        if _encoder is None:
+            _encoder = CachedEncoder(EMBEDDING_MODEL_NAME)
+        return _encoder
+
+
+def get_collection():
+    """Returns the shared syllabus collection: ChromaDB's, or its NumPy export (RETRIEVAL_BACKEND)."""
+    global _collection
+    with _lock:
+        if _collection is None:
+            if RETRIEVAL_BACKEND == "numpy":
+                _collection = NumpyCollection(os.path.join(CHROMA_DB_PATH, NUMPY_INDEX_DIRNAME))
+                logging.info(f"Loaded NumPy index of '{COLLECTION_NAME}' ({_collection.count()} chunks).")
+            else:
+                import chromadb
+                client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+                _collection = client.get_collection(name=COLLECTION_NAME)
+                logging.info(f"Connected to collection '{COLLECTION_NAME}' ({_collection.count()} chunks).")
+        return _collection
+
+
+def configure(db_path: Optional[str] = None, encoder: Optional[CachedEncoder] = None,
+              backend: Optional[str] = None) -> None:
+    """Points this process's searches at another index, encoder and/or backend, e.g. for benchmarks.
+
+    The shared handles are reset and searches run in-process, never through the retrieval service.
+    """
+    global CHROMA_DB_PATH, RETRIEVAL_BACKEND, RETRIEVAL_SERVICE_URL, _collection, _encoder, _bm25, _bm25_mtime
+    with _lock:
+        if db_path is not None:
+            CHROMA_DB_PATH = db_path
+        if backend is not None:
+            RETRIEVAL_BACKEND = backend
+        RETRIEVAL_SERVICE_URL = ""
+        _collection = None
+        _encoder = encoder
+        _bm25 = _bm25_mtime = None
+
+
+def get_bm25_index() -> Optional[BM25Index]:
+    """Returns the shared BM25 index, reloading it after an ingest rewrote it; None if there is none."""
+    global _bm25, _bm25_mtime
+    meta_path = os.path.join(CHROMA_DB_PATH, BM25_DIRNAME, "meta.json")
+    try:
+        mtime = os.path.getmtime(meta_path)
+    except OSError:
+        if _bm25_mtime != -1:
+            logging.warning(f"No BM25 index at {os.path.dirname(meta_path)} (run pdftovector.py); using dense search only.")
+        with _lock:
+            _bm25, _bm25_mtime = None, -1
+        return None
+    with _lock:
+        if _bm25 is None or _bm25_mtime != mtime:
+            _bm25 = BM25Index(os.path.dirname(meta_path))
+            _bm25_mtime = mtime
+        return _bm25
+
+
+def build_where(subject: Optional[str] = None, grade: Union[str, int, None] = None,
+                doc_kind: Optional[str] = None) -> Optional[dict]:
+    """Builds a ChromaDB `where` filter restricting a search to one subject and/or grade.
+
+    grade accepts anything syllabus_catalog.parse_grade understands ("B5", "grade5", "jhs1", 5)
+    and matches every document whose grade band covers it.
+    """
+    conditions = []
+    subject_slug = normalize_subject(subject)
+    if subject_slug:
+        conditions.append({"subject": subject_slug})
+    if grade is not None and grade != "":
+        grade_number = parse_grade(grade)
+        if grade_number is None:
+            raise ValueError(f"Unrecognized grade: {grade!r}")
+        conditions.append({"grade_min": {"$lte": grade_number}})
+        conditions.append({"grade_max": {"$gte": grade_number}})
+    if doc_kind:
+        conditions.append({"doc_kind": doc_kind})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def embed_queries(queries: list[str]) -> list[list[float]]:
+    """Embeds queries with the same model used at ingest time."""
+    return get_encoder().encode(queries).tolist()
+
+
+def search_embeddings(query_embeddings: list[list[float]], where: Optional[dict] = None,
+                      k: int = DEFAULT_K) -> list[list[dict]]:
+    """Runs one filtered nearest-neighbour search per query embedding.
+
+    Returns, for every query, a list of hits: {"id", "text", "metadata", "distance"}.
+    """
+    results = get_collection().query(
+        query_embeddings=query_embeddings,
+        n_results=k,
+        where=where,
+        include=["documents", "metadatas", "distances"],
+    )
+    hits = []
+    for ids, documents, metadatas, distances in zip(results["ids"], results["documents"],
+                                                     results["metadatas"], results["distances"]):
+        hits.append([
+            {"id": chunk_id, "text": document, "metadata": metadata, "distance": distance}
+            for chunk_id, document, metadata, distance in zip(ids, documents, metadatas, distances)
+        ])
+    return hits
+
+
+def _cosine_distances(query_embedding: list[float], embeddings) -> list[float]:
+    query = np.asarray(query_embedding, dtype=np.float32)
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+    norms[norms == 0] = 1.0
+    return (1.0 - matrix @ query / norms).tolist()
+
+
+def fuse_rankings(rankings: list[list[str]], k: int, rrf_k: int = RRF_K) -> list[tuple[str, float]]:
+    """Reciprocal rank fusion of ranked ID lists; returns the k best (id, fused score) pairs."""
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])[:k]
+
+
+def search(queries: list[str], query_embeddings: list[list[float]], where: Optional[dict] = None,
+           k: int = DEFAULT_K, hybrid: Optional[bool] = None, rerank: Optional[bool] = None) -> list[list[dict]]:
+    """Searches for each query, hybrid (dense + BM25, fused) by default, dense-only otherwise.
+
+    Hits are {"id", "text", "metadata", "distance"} in fused order, plus "score" (the fused
+    score) for hybrid searches. Falls back to dense search when there is no BM25 index.
+    With re-ranking, RERANK_CANDIDATES hits are re-ordered by the cross-encoder (adding
+    "rerank_score"), or kept in search order if it misses its time budget.
+    """
+    global _reranker_failed
+    if not (RERANK_SEARCH if rerank is None else rerank) or _reranker_failed:
+        return _search(queries, query_embeddings, where=where, k=k, hybrid=hybrid)
+    candidates = _search(queries, query_embeddings, where=where, k=max(k, RERANK_CANDIDATES), hybrid=hybrid)
+    try:
+        from reranker import get_reranker
+        reranker = get_reranker()
+        return [reranker.rerank(query, hits, k) for query, hits in zip(queries, candidates)]
+    except (ImportError, OSError) as e:
+        logging.warning(f"Re-ranking model unavailable ({e}); using search order.")
+        _reranker_failed = True
+        return [hits[:k] for hits in candidates]
+
+
+def _search(queries: list[str], query_embeddings: list[list[float]], where: Optional[dict] = None,
+            k: int = DEFAULT_K, hybrid: Optional[bool] = None) -> list[list[dict]]:
+    index = get_bm25_index() if (HYBRID_SEARCH if hybrid is None else hybrid) else None
+    if index is None:
+        return search_embeddings(query_embeddings, where=where, k=k)
+    try:
+        mask = index.mask(where)
+    except ValueError as e:
+        logging.warning(f"{e}; using dense search only.")
+        return search_embeddings(query_embeddings, where=where, k=k)
+
+    depth = max(k, FUSION_CANDIDATES)
+    dense_results = search_embeddings(query_embeddings, where=where, k=depth)
+    fused_results, missing = [], set()
+    for query, dense_hits in zip(queries, dense_results):
+        lexical = [chunk_id for chunk_id, _ in index.search(query, depth, mask)]
+        fused = fuse_rankings([[hit["id"] for hit in dense_hits], lexical], k)
+        known = {hit["id"] for hit in dense_hits}
+        missing.update(chunk_id for chunk_id, _ in fused if chunk_id not in known)
+        fused_results.append(fused)
+
+    # Chunks found only by BM25 are fetched with their embeddings to give them a dense distance too.
+    extra = {}
+    if missing:
+        fetched = get_collection().get(ids=sorted(missing), include=["documents", "metadatas", "embeddings"])
+        extra = {chunk_id: (document, metadata, embedding) for chunk_id, document, metadata, embedding
+                 in zip(fetched["ids"], fetched["documents"], fetched["metadatas"], fetched["embeddings"])}
+
+    results = []
+    for fused, dense_hits, embedding in zip(fused_results, dense_results, query_embeddings):
+        by_id = {hit["id"]: hit for hit in dense_hits}
+        lexical_only = [chunk_id for chunk_id, _ in fused if chunk_id not in by_id and chunk_id in extra]
+        if lexical_only:
+            distances = _cosine_distances(embedding, [extra[chunk_id][2] for chunk_id in lexical_only])
+            for chunk_id, distance in zip(lexical_only, distances):
+                document, metadata, _ = extra[chunk_id]
+                by_id[chunk_id] = {"id": chunk_id, "text": document, "metadata": metadata, "distance": distance}
+        results.append([{**by_id[chunk_id], "score": score} for chunk_id, score in fused if chunk_id in by_id])
+    return results
+
+
+def _post_to_service(path: str, payload: dict) -> Optional[dict]:
+    """POSTs JSON to the retrieval service; returns None if it is unreachable."""
+    request = urllib.request.Request(RETRIEVAL_SERVICE_URL.rstrip("/") + path, data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=SERVICE_TIMEOUT_SECONDS) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        if e.code == 422:
+            raise ValueError(e.read().decode("utf-8", "replace")) from e
+        logging.warning(f"Retrieval service error {e.code}; searching locally instead.")
+    except (urllib.error.URLError, OSError) as e:
+        logging.warning(f"Retrieval service at {RETRIEVAL_SERVICE_URL} unreachable ({e}); searching locally instead.")
+    return None
+
+
+def retrieve(query: str, subject: Optional[str] = None, grade: Union[str, int, None] = None,
+             k: int = DEFAULT_K, doc_kind: Optional[str] = None, hybrid: Optional[bool] = None,
+             rerank: Optional[bool] = None) -> list[dict]:
+    """Returns the k syllabus chunks best matching `query`, searching only the given subject/grade.
+
+    hybrid and rerank override HYBRID_SEARCH and RERANK_SEARCH for this call.
+    """
+    if RETRIEVAL_SERVICE_URL and doc_kind is None and hybrid is None and rerank is None:
+        response = _post_to_service("/search", {"query": query, "subject": subject, "grade": grade, "k": k})
+        if response is not None:
+            return response["hits"]
+    where = build_where(subject=subject, grade=grade, doc_kind=doc_kind)
+    return search([query], embed_queries([query]), where=where, k=k, hybrid=hybrid, rerank=rerank)[0]
+
+
+def retrieve_many(requests: list[dict]) -> list[list[dict]]:
+    """Batch version of retrieve(): each request is a dict of retrieve() keyword arguments."""
+    if RETRIEVAL_SERVICE_URL and not any(request.get("doc_kind") or request.get("hybrid") is not None
+                                         or request.get("rerank") is not None for request in requests):
+        response = _post_to_service("/batch_search", {"queries": requests})
+        if response is not None:
+            return response["results"]
+    embeddings = embed_queries([request["query"] for request in requests])
+    results = []
+    for request, embedding in zip(requests, embeddings):
+        where = build_where(subject=request.get("subject"), grade=request.get("grade"),
+                            doc_kind=request.get("doc_kind"))
+        results.append(search([request["query"]], [embedding], where=where, k=request.get("k", DEFAULT_K),
+                              hybrid=request.get("hybrid"), rerank=request.get("rerank"))[0])
+    return results
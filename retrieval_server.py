@@ -0,0 +1,185 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Union
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
+
+import retrieval
+
+# --- Configuration ---
+HOST = "127.0.0.1"
+PORT = 8765
+
+# Concurrent queries arriving within MAX_BATCH_WAIT_MS of each other are embedded with
+# a single encoder call (up to MAX_BATCH_SIZE queries per call).
+MAX_BATCH_SIZE = 32
+MAX_BATCH_WAIT_MS = 5
+MAX_K = 50
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class SearchRequest(BaseModel):
+    query: str
+    subject: Optional[str] = None
+    grade: Optional[Union[int, str]] = None
+    k: int = Field(default=retrieval.DEFAULT_K, ge=1, le=MAX_K)
+
+
+class BatchSearchRequest(BaseModel):
+    queries: list[SearchRequest]
+
+
+class MicroBatcher:
+    """Groups concurrent search requests so each group costs one encoder call.
+
+    Requests are queued by the HTTP handlers; a single background task drains the queue,
+    embeds the whole batch at once in a worker thread and then runs one ChromaDB query
+    per distinct filter.
+    """
+
+    def __init__(self, max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_BATCH_WAIT_MS):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"requests": 0, "batches": 0, "encode_seconds": 0.0, "search_seconds": 0.0}
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, request: SearchRequest) -> list[dict]:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                outcomes = await asyncio.to_thread(self._process, [request for request, _ in batch])
+            except Exception as e:
+                logging.error(f"Search batch failed: {e}")
+                outcomes = [e] * len(batch)
+            for (_, future), outcome in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if isinstance(outcome, Exception):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result(outcome)
+
+    def _process(self, requests: list[SearchRequest]) -> list:
+        """Embeds all queries in one call, then searches once per distinct filter."""
+        outcomes: list = [None] * len(requests)
+        groups: dict[str, list[int]] = {}
+        wheres: dict[str, Optional[dict]] = {}
+        for i, request in enumerate(requests):
+            try:
+                where = retrieval.build_where(subject=request.subject, grade=request.grade)
+            except ValueError as e:
+                outcomes[i] = e
+                continue
+            key = json.dumps(where, sort_keys=True)
+            wheres[key] = where
+            groups.setdefault(key, []).append(i)
+
+        valid = [i for group in groups.values() for i in group]
+        if not valid:
+            return outcomes
+        start = time.perf_counter()
+        embeddings = retrieval.embed_queries([requests[i].query for i in valid])
+        self.stats["encode_seconds"] += time.perf_counter() - start
+        embedding_of = dict(zip(valid, embeddings))
+
+        start = time.perf_counter()
+        for key, indices in groups.items():
+            k = max(requests[i].k for i in indices)
+            hits = retrieval.search([requests[i].query for i in indices], [embedding_of[i] for i in indices],
+                                    where=wheres[key], k=k)
+            for i, query_hits in zip(indices, hits):
+                outcomes[i] = query_hits[:requests[i].k]
+        self.stats["search_seconds"] += time.perf_counter() - start
+        self.stats["requests"] += len(requests)
+        self.stats["batches"] += 1
+        return outcomes
+
+
+batcher: Optional[MicroBatcher] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Loads the embedding model and collection once, before the first request."""
+    global batcher
+    start = time.perf_counter()
+    await asyncio.to_thread(retrieval.get_collection)
+    await asyncio.to_thread(lambda: retrieval.get_encoder().model)
+    logging.info(f"Retrieval service ready in {time.perf_counter() - start:.1f}s.")
+    batcher = MicroBatcher()
+    batcher.start()
+    yield
+    await batcher.stop()
+    retrieval.get_encoder().cache.save()
+
+
+app = FastAPI(title="SuguruAI syllabus retrieval", lifespan=lifespan)
+
+
+async def _search(request: SearchRequest) -> list[dict]:
+    try:
+        return await batcher.submit(request)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.post("/search")
+async def search(request: SearchRequest) -> dict:
+    return {"hits": await _search(request)}
+
+
+@app.post("/batch_search")
+async def batch_search(request: BatchSearchRequest) -> dict:
+    # Submitted together, so they share encoder calls with each other and with concurrent /search calls.
+    return {"results": await asyncio.gather(*(_search(query) for query in request.queries))}
+
+
+@app.get("/health")
+async def health() -> dict:
+    stats = dict(batcher.stats) if batcher else {}
+    if stats.get("batches"):
+        stats["mean_batch_size"] = stats["requests"] / stats["batches"]
+    return {
+        "status": "ok",
+        "collection_count": retrieval.get_collection().count(),
+        "batching": stats,
+        "embedding_cache": retrieval.get_encoder().cache.stats(),
+    }
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=HOST, port=PORT)
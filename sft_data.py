@@ -0,0 +1,338 @@
+import os
+import argparse
+import glob
+import hashlib
+import json
+import logging
+from typing import Iterator, Optional
+
+import numpy as np
+
+# --- Configuration ---
+SFT_CACHE_DIR = "./sft_cache"  # Pre-tokenized datasets, one subdirectory per (data, tokenizer, length) combination
+CACHE_FORMAT_VERSION = 2
+TOKENIZE_BATCH_SIZE = 256
+HOLDOUT_FRACTION = 0.02  # Share of source chunks held out for evaluation
+# Custom 4D attention masks (block-diagonal masks for packed sequences) are honoured by Llama from 4.38;
+# from 4.42 they are expected already inverted (0 = attend, dtype minimum = masked) instead of 1/0.
+MIN_TRANSFORMERS_FOR_PACKING = (4, 38)
+INVERTED_4D_MASK_SINCE = (4, 42)
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def resolve_data_files(path: str) -> list[str]:
+    """The JSONL file itself, or its shards (name-00000.jsonl, ...) as written by prepare_data_for_finetune.py."""
+    if os.path.exists(path):
+        return [path]
+    root, ext = os.path.splitext(path)
+    shards = sorted(glob.glob(f"{root}-[0-9][0-9][0-9][0-9][0-9]{ext}"))
+    if not shards:
+        raise FileNotFoundError(f"No fine-tuning data at {path} (or shards {root}-NNNNN{ext}).")
+    return shards
+
+
+def iter_jsonl(paths: list[str]) -> Iterator[dict]:
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def group_hash(entry: dict) -> int:
+    """Stable 64-bit hash of the entry's source chunk (or, without one, its text), used for the holdout split.
+
+    All pairs synthesized from one chunk land in the same split, so near-identical pairs never
+    end up on both sides; hashing whole PDFs instead would hold out entire subjects or none.
+    """
+    key = entry.get("chunk") or entry["text"]
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def holdout_threshold(holdout_fraction: float = HOLDOUT_FRACTION) -> int:
+    """Group hashes below this value belong to the holdout split."""
+    return int(holdout_fraction * 2 ** 64) if holdout_fraction < 1 else 2 ** 64 - 1
+
+
+def iter_holdout_texts(data_files: list[str], holdout_fraction: float = HOLDOUT_FRACTION) -> Iterator[str]:
+    """Texts of the entries held out from training, for evaluating exported models on unseen data."""
+    threshold = holdout_threshold(holdout_fraction)
+    for entry in iter_jsonl(data_files):
+        if group_hash(entry) < threshold:
+            yield entry["text"]
+
+
+def cache_key(data_files: list[str], tokenizer, max_seq_length: int) -> str:
+    files = [(os.path.abspath(path), os.path.getsize(path), os.path.getmtime(path)) for path in data_files]
+    identity = json.dumps({
+        "version": CACHE_FORMAT_VERSION,
+        "files": files,
+        "tokenizer": getattr(tokenizer, "name_or_path", type(tokenizer).__name__),
+        "vocab_size": len(tokenizer),
+        "max_seq_length": max_seq_length,
+    }, sort_keys=True)
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:16]
+
+
+class TokenCache:
+    """Memory-mapped pre-tokenized dataset.
+
+    tokens.bin holds every sample's token IDs back to back (uint32); offsets.npy has the start
+    of each sample plus a final end offset, and groups.npy the per-sample group hash.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self.groups = np.load(os.path.join(directory, "groups.npy"), mmap_mode="r")
+        n_tokens = int(self.offsets[-1])
+        self.tokens = (np.memmap(os.path.join(directory, "tokens.bin"), dtype=np.uint32, mode="r", shape=(n_tokens,))
+                       if n_tokens else np.zeros(0, dtype=np.uint32))
+        self.lengths = np.diff(self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.tokens[self.offsets[index]:self.offsets[index + 1]]
+
+    def split(self, holdout_fraction: float = HOLDOUT_FRACTION) -> tuple[np.ndarray, np.ndarray]:
+        """(train indices, holdout indices), decided by each sample's group hash."""
+        holdout = np.asarray(self.groups) < np.uint64(holdout_threshold(holdout_fraction))
+        return np.flatnonzero(~holdout), np.flatnonzero(holdout)
+
+
+def build_token_cache(data_files: list[str], tokenizer, max_seq_length: int,
+                      cache_dir: str = SFT_CACHE_DIR) -> TokenCache:
+    """Tokenizes the JSONL "text" fields once and returns the cached, memory-mapped result.
+
+    Samples are truncated to max_seq_length. The cache is reused until the data files,
+    tokenizer or max_seq_length change.
+    """
+    directory = os.path.join(cache_dir, cache_key(data_files, tokenizer, max_seq_length))
+    if os.path.exists(os.path.join(directory, "offsets.npy")):
+        cache = TokenCache(directory)
+        logging.info(f"Using pre-tokenized dataset {directory} ({len(cache)} samples, {int(cache.offsets[-1])} tokens).")
+        return cache
+
+    os.makedirs(directory, exist_ok=True)
+    offsets, groups = [0], []
+    with open(os.path.join(directory, "tokens.bin"), "wb") as tokens_file:
+        batch: list[dict] = []
+
+        def flush():
+            encoded = tokenizer([entry["text"] for entry in batch], add_special_tokens=False)["input_ids"]
+            for entry, ids in zip(batch, encoded):
+                ids = np.asarray(ids[:max_seq_length], dtype=np.uint32)
+                tokens_file.write(ids.tobytes())
+                offsets.append(offsets[-1] + len(ids))
+                groups.append(group_hash(entry))
+            batch.clear()
+
+        for entry in iter_jsonl(data_files):
+            batch.append(entry)
+            if len(batch) >= TOKENIZE_BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+    np.save(os.path.join(directory, "groups.npy"), np.asarray(groups, dtype=np.uint64))
+    # offsets.npy is written last; its presence marks the cache as complete.
+    np.save(os.path.join(directory, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    cache = TokenCache(directory)
+    logging.info(f"Pre-tokenized {len(cache)} samples ({int(cache.offsets[-1])} tokens) into {directory}.")
+    return cache
+
+
+def pack_sequences(lengths: np.ndarray, indices: np.ndarray, max_seq_length: int) -> list[list[int]]:
+    """Groups samples into packs of at most max_seq_length tokens (first-fit decreasing)."""
+    order = sorted(indices, key=lambda i: -int(lengths[i]))
+    packs: list[list[int]] = []
+    space: list[int] = []
+    for index in order:
+        length = int(lengths[index])
+        for p, free in enumerate(space):
+            if free >= length:
+                packs[p].append(int(index))
+                space[p] -= length
+                break
+        else:
+            packs.append([int(index)])
+            space.append(max_seq_length - length)
+    return packs
+
+
+def bucket_batches(lengths: np.ndarray, indices: np.ndarray, batch_size: int, seed: int = 0,
+                   bucket_batches_per_pool: int = 50) -> list[list[int]]:
+    """Batches of similar-length samples: shuffled pools are sorted by length, cut into batches, then shuffled.
+
+    This mirrors the Trainer's group_by_length sampler, for estimating its padding ahead of training.
+    """
+    rng = np.random.default_rng(seed)
+    shuffled = rng.permutation(indices)
+    pool_size = batch_size * bucket_batches_per_pool
+    batches = []
+    for start in range(0, len(shuffled), pool_size):
+        pool = sorted(shuffled[start:start + pool_size], key=lambda i: int(lengths[i]))
+        batches.extend([int(i) for i in pool[b:b + batch_size]] for b in range(0, len(pool), batch_size))
+    rng.shuffle(batches)
+    return batches
+
+
+def padding_ratio(lengths: np.ndarray, rows: list[list[int]], row_length: Optional[int] = None) -> float:
+    """Share of padding tokens when each row (a pack, or a batch member) is padded to row_length.
+
+    With row_length None, rows are batches of single samples padded to their longest member.
+    """
+    real = padded = 0
+    for row in rows:
+        row_lengths = [int(lengths[i]) for i in row]
+        real += sum(row_lengths)
+        padded += row_length if row_length is not None else max(row_lengths) * len(row_lengths)
+    return 1 - real / padded if padded else 0.0
+
+
+def transformers_version() -> tuple[int, int]:
+    import transformers
+
+    return tuple(int(part) for part in transformers.__version__.split(".")[:2])
+
+
+def transformers_supports_packing() -> bool:
+    return transformers_version() >= MIN_TRANSFORMERS_FOR_PACKING
+
+
+class PackedDataset:
+    """Torch-style dataset whose items are packs of samples (lists of token arrays)."""
+
+    def __init__(self, cache: TokenCache, packs: list[list[int]]):
+        self.cache = cache
+        self.packs = packs
+
+    def __len__(self) -> int:
+        return len(self.packs)
+
+    def __getitem__(self, index: int) -> dict:
+        return {"samples": [self.cache[i] for i in self.packs[index]]}
+
+
+class PackedCollator:
+    """Builds attention-boundary-correct batches from packs.
+
+    Samples in a pack are concatenated; position IDs restart at 0 for each sample, a 4D
+    block-diagonal causal mask stops attention across sample boundaries, and the label of each
+    sample's first token is ignored so no sample is trained to predict its neighbour.
+    Real and total (padded) tokens are counted for throughput and padding reporting.
+    """
+
+    def __init__(self, pad_token_id: int, mask_dtype=None, inverted_mask: Optional[bool] = None):
+        self.pad_token_id = pad_token_id
+        self.mask_dtype = mask_dtype
+        self.inverted_mask = (transformers_version() >= INVERTED_4D_MASK_SINCE
+                              if inverted_mask is None else inverted_mask)
+        self.real_tokens = 0
+        self.total_tokens = 0
+
+    def __call__(self, features: list[dict]) -> dict:
+        import torch
+
+        dtype = self.mask_dtype or torch.float32
+        row_length = max(sum(len(sample) for sample in feature["samples"]) for feature in features)
+        batch_size = len(features)
+        input_ids = torch.full((batch_size, row_length), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((batch_size, row_length), -100, dtype=torch.long)
+        position_ids = torch.zeros((batch_size, row_length), dtype=torch.long)
+        allowed = torch.zeros((batch_size, row_length, row_length), dtype=torch.bool)
+        causal = torch.tril(torch.ones((row_length, row_length), dtype=torch.bool))
+        for row, feature in enumerate(features):
+            start = 0
+            for sample in feature["samples"]:
+                end = start + len(sample)
+                ids = torch.from_numpy(np.asarray(sample, dtype=np.int64))
+                input_ids[row, start:end] = ids
+                labels[row, start + 1:end] = ids[1:]
+                position_ids[row, start:end] = torch.arange(len(sample))
+                allowed[row, start:end, start:end] = causal[:len(sample), :len(sample)]
+                start = end
+            self.real_tokens += start
+            self.total_tokens += row_length
+            # Padding positions attend to themselves only, so their softmax rows stay finite.
+            padding = torch.arange(start, row_length)
+            allowed[row, padding, padding] = True
+        if self.inverted_mask:
+            attention_mask = torch.zeros((batch_size, 1, row_length, row_length), dtype=dtype)
+            attention_mask.masked_fill_(~allowed[:, None], torch.finfo(dtype).min)
+        else:
+            attention_mask = allowed[:, None].to(dtype)
+        return {"input_ids": input_ids, "labels": labels, "position_ids": position_ids,
+                "attention_mask": attention_mask}
+
+
+class PaddedDataset:
+    """Single samples, for unpacked batching.
+
+    Items carry "input_ids" so the Trainer's group_by_length sampler can bucket them by length.
+    """
+
+    def __init__(self, cache: TokenCache, indices: np.ndarray):
+        self.cache = cache
+        self.indices = indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, index: int) -> dict:
+        return {"input_ids": self.cache[self.indices[index]]}
+
+
+class PaddedCollator:
+    """Right-pads single samples to the longest in the batch, with a regular 2D attention mask."""
+
+    def __init__(self, pad_token_id: int):
+        self.pad_token_id = pad_token_id
+        self.real_tokens = 0
+        self.total_tokens = 0
+
+    def __call__(self, features: list[dict]) -> dict:
+        import torch
+
+        samples = [feature["input_ids"] for feature in features]
+        row_length = max(len(sample) for sample in samples)
+        input_ids = torch.full((len(samples), row_length), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((len(samples), row_length), -100, dtype=torch.long)
+        attention_mask = torch.zeros((len(samples), row_length), dtype=torch.long)
+        for row, sample in enumerate(samples):
+            ids = torch.from_numpy(np.asarray(sample, dtype=np.int64))
+            input_ids[row, :len(ids)] = ids
+            labels[row, :len(ids)] = ids
+            attention_mask[row, :len(ids)] = 1
+            self.real_tokens += len(ids)
+        self.total_tokens += input_ids.numel()
+        return {"input_ids": input_ids, "labels": labels, "attention_mask": attention_mask}
+
+
+if __name__ == "__main__":
+    # Reports how much padding packing and bucketing save for a tokenizer, e.g.
+    # python sft_data.py --tokenizer hf-internal-testing/llama-tokenizer
+    parser = argparse.ArgumentParser(description="Pre-tokenize fine-tuning data and report padding with and without packing.")
+    parser.add_argument("--data", default="./syllabus_finetune_data.jsonl")
+    parser.add_argument("--tokenizer", required=True, help="Hugging Face tokenizer name or path.")
+    parser.add_argument("--max-seq-length", type=int, default=1024)
+    parser.add_argument("--batch-size", type=int, default=2)
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+
+    cache = build_token_cache(resolve_data_files(args.data), AutoTokenizer.from_pretrained(args.tokenizer),
+                              args.max_seq_length)
+    train, holdout = cache.split()
+    print(f"{len(cache)} samples ({len(train)} train, {len(holdout)} holdout), "
+          f"mean length {cache.lengths.mean():.0f} tokens")
+    shuffled = np.random.default_rng(0).permutation(train)
+    naive = [list(map(int, shuffled[b:b + args.batch_size])) for b in range(0, len(shuffled), args.batch_size)]
+    print(f"Padding ratio, padded to {args.max_seq_length}: {padding_ratio(cache.lengths, [[i] for i in train], args.max_seq_length):.1%}")
+    print(f"Padding ratio, random batches padded to longest: {padding_ratio(cache.lengths, naive):.1%}")
+    print(f"Padding ratio, length-bucketed batches: {padding_ratio(cache.lengths, bucket_batches(cache.lengths, train, args.batch_size)):.1%}")
+    packs = pack_sequences(cache.lengths, train, args.max_seq_length)
+    print(f"Padding ratio, packed ({len(packs)} packs): {padding_ratio(cache.lengths, packs, args.max_seq_length):.1%}")
@@ -0,0 +1,110 @@
+import os
+import re
+from typing import Optional, Union
+
+# Grade numbering used in chunk metadata: KG1 = -1, KG2 = 0, Basic 1-9 (B1-B9) = 1-9.
+# JHS 1-3 are Basic 7-9.
+KG_GRADES = {1: -1, 2: 0}
+
+# Filename stems -> subject slugs, e.g. "MATHS-UPPER-PRIMARY-B4-B6.pdf" -> "mathematics".
+SUBJECT_ALIASES = {
+    "maths": "mathematics",
+    "math": "mathematics",
+    "english_language": "english",
+    "creative_arts_and_design": "creative_arts",
+    "physical_education_and_health": "physical_education",
+    "religious_and_moral_education": "religious_moral_education",
+    "our_world_and_our_people": "our_world_our_people",
+    "social_studies": "social_studies",
+}
+
+# Words in filenames that describe the document rather than the subject.
+NON_SUBJECT_WORDS = {"lower", "upper", "primary", "framework", "curriculum", "syllabus"}
+
+_BAND_RE = re.compile(r"\b(kg\d?|k|b\d)[-_ ]+(?:to[-_ ]+)?(b?\d)\b", re.IGNORECASE)
+_GRADE_RE = re.compile(r"^(?:(kg|k)\s*(\d)?|(?:b|basic|grade|primary|p)\s*(\d)|(?:jhs)\s*(\d))$", re.IGNORECASE)
+_CODE_GRADE_RE = re.compile(r"\b(?:(KG)(\d)|B(\d))\.\d")
+
+
+def parse_grade(value: Union[str, int, None]) -> Optional[int]:
+    """Parses a grade such as 5, "B5", "Basic 5", "grade5", "jhs1" (= 7) or "KG2" (= 0)."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, int):
+        return value
+    match = _GRADE_RE.match(str(value).strip().replace("_", ""))
+    if not match:
+        return None
+    kg, kg_level, basic, jhs = match.groups()
+    if kg:
+        return KG_GRADES.get(int(kg_level or 1), -1)
+    if basic:
+        return int(basic)
+    return int(jhs) + 6
+
+
+def grade_label(grade: int) -> str:
+    """Inverse of parse_grade: -1 -> "KG1", 0 -> "KG2", 5 -> "B5"."""
+    return f"KG{grade + 2}" if grade <= 0 else f"B{grade}"
+
+
+def normalize_subject(value: Optional[str]) -> Optional[str]:
+    """Maps a subject name ("Mathematics", "maths", "social_studies") to its catalog slug."""
+    if not value:
+        return None
+    slug = re.sub(r"[^a-z0-9]+", "_", value.lower()).strip("_")
+    return SUBJECT_ALIASES.get(slug, slug)
+
+
+def grade_range_from_codes(codes: list[str]) -> Optional[tuple[int, int]]:
+    """Lowest and highest grade mentioned in curriculum codes such as "B7.1.1.1"."""
+    grades = []
+    for code in codes:
+        for kg, kg_level, basic in _CODE_GRADE_RE.findall(code):
+            grades.append(KG_GRADES.get(int(kg_level), -1) if kg else int(basic))
+    return (min(grades), max(grades)) if grades else None
+
+
+def describe_source(filename: str) -> dict:
+    """Derives subject, grade band and document kind from a syllabus PDF filename.
+
+    grade_min/grade_max are None when the filename names no grades (e.g. "science.pdf");
+    callers can fill them in from the curriculum codes inside the document.
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0].lower()
+    stem = re.sub(r"\s*\(\d+\)$", "", stem)  # "HISTORY-B1-B6 (1)" is a copy of "HISTORY-B1-B6"
+
+    grade_min = grade_max = None
+    subject_part = stem
+    band = _BAND_RE.search(stem)
+    if band:
+        low, high = band.groups()
+        grade_min = parse_grade(low if low.lower() != "k" else "kg1")
+        grade_max = parse_grade(high if high.lower().startswith("b") else f"b{high}")
+        subject_part = stem[:band.start()]
+
+    words = [w for w in re.split(r"[^a-z0-9]+", subject_part) if w and w not in NON_SUBJECT_WORDS]
+    # Stop at trailing noise such as "3rd", "aug", dates
+    subject_words = []
+    for word in words:
+        if any(ch.isdigit() for ch in word):
+            break
+        subject_words.append(word)
+    subject = normalize_subject("_".join(subject_words)) or "unknown"
+
+    return {
+        "subject": subject,
+        "grade_band": grade_band_label(grade_min, grade_max),
+        "grade_min": grade_min,
+        "grade_max": grade_max,
+        "doc_kind": "framework" if "framework" in stem else "curriculum",
+    }
+
+
+def grade_band_label(grade_min: Optional[int], grade_max: Optional[int]) -> str:
+    """Formats a grade range as "B4-B6", "KG1-B6"; "" if unknown."""
+    if grade_min is None or grade_max is None:
+        return ""
+    if grade_min == grade_max:
+        return grade_label(grade_min)
+    return f"{grade_label(grade_min)}-{grade_label(grade_max)}"
@@ -0,0 +1,195 @@
+import bisect
+import re
+from typing import Iterator
+
+# --- Configuration ---
+# Token budget per chunk. Tokens are approximated as words and punctuation marks; with
+# all-MiniLM-L6-v2 (256 word-piece limit) this keeps chunks from being truncated.
+CHUNK_MAX_TOKENS = 200
+CHUNK_OVERLAP_TOKENS = 40  # Whole sentences carried over from the previous chunk, up to this many tokens
+
+# GES/NaCCA syllabus structure, e.g. "Strand 1: NUMBER", "Sub-strand 2: Whole Numbers Operations",
+# content standard "B4.1.1.1" and indicator "B4.1.1.1.1".
+SUB_STRAND_RE = re.compile(r"^sub[\s-]?strands?\s*\d*\s*[:.\-–]?\s*(.*)$", re.IGNORECASE)
+STRAND_RE = re.compile(r"^strands?\s*\d*\s*[:.\-–]?\s*(.*)$", re.IGNORECASE)
+TOC_LINE_RE = re.compile(r"\.{5,}\s*\d*$")  # Table of contents entry with dot leaders
+CODE_RE = re.compile(r"\b(?:KG|B)\d{1,2}(?:\.\d+){3,4}\b")
+SENTENCE_END_RE = re.compile(r"(?<=[.!?;])\s+(?=[\"'(\[]?[A-Z0-9•])|\s+(?=(?:KG|B)\d{1,2}(?:\.\d+){3,4}\b)")
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+MAX_HEADING_CHARS = 120  # Longer lines starting with "Strand" are prose, not headings
+
+# Running headers/footers and repeated table headings that carry no content.
+BOILERPLATE_RE = re.compile(
+    r"^(?:©.*|[ivxlcdm]+|\d+|√+|"
+    r"content standards?|indicators?(?: and exemplars?(?:\(s\))?)?|"
+    r"subject specific practices(?: and core competencies)?|(?:and )?core competencies|"
+    r"strands|sub-strands)$",
+    re.IGNORECASE,
+)
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count (words and punctuation marks)."""
+    return len(TOKEN_RE.findall(text))
+
+
+def _code_depth(code: str) -> int:
+    return code.count(".") + 1
+
+
+def _pages_of(page_breaks: tuple[tuple[int, int], ...], start: int, end: int) -> tuple[int, int]:
+    """First and last page of text[start:end] in a unit, from its (offset, page) line starts."""
+    offsets = [offset for offset, _ in page_breaks]
+    return (page_breaks[bisect.bisect_right(offsets, start) - 1][1],
+            page_breaks[bisect.bisect_right(offsets, max(start, end - 1)) - 1][1])
+
+
+def _iter_units(pages: list[str]) -> Iterator[tuple[str, tuple[tuple[int, int], ...], dict, bool]]:
+    """Yields (sentence, page_breaks, structure, is_heading) in document order.
+
+    Lines are joined into paragraphs (PDF text wraps mid-sentence), paragraphs are split
+    into sentences. Headings and lines starting with a curriculum code always begin a new
+    paragraph. `page_breaks` holds an (offset in the sentence, page) pair for the start of
+    each source line, so a sentence (or part of one) maps to the pages it really spans.
+    `structure` is the strand/sub-strand/content standard/indicator in effect.
+    """
+    structure = {"strand": "", "sub_strand": "", "content_standard": "", "indicator": ""}
+    paragraph: list[tuple[str, int]] = []  # (line, page it is on)
+
+    def flush_paragraph():
+        text = ' '.join(line for line, _ in paragraph)
+        line_starts, offset = [], 0
+        for line, page in paragraph:
+            line_starts.append((offset, page))
+            offset += len(line) + 1
+        paragraph.clear()
+        if not text:
+            return
+
+        def sentence(start: int, end: int):
+            first = bisect.bisect_right(line_starts, (start, float("inf"))) - 1
+            breaks = [(0, line_starts[first][1])]
+            breaks += [(line_start - start, page) for line_start, page in line_starts[first + 1:] if line_start < end]
+            return text[start:end], tuple(breaks), dict(structure), False
+
+        # Codes inside a paragraph start a new sentence, e.g. "... materials B4.1.1.1.2 Read and write ..."
+        start = 0
+        for match in SENTENCE_END_RE.finditer(text):
+            yield sentence(start, match.start())
+            start = match.end()
+        yield sentence(start, len(text))
+
+    for page_no, page_text in enumerate(pages, start=1):
+        for raw_line in page_text.splitlines():
+            line = ' '.join(raw_line.split())
+            if not line or BOILERPLATE_RE.match(line) or TOC_LINE_RE.search(line):
+                continue
+
+            heading = SUB_STRAND_RE.match(line) or STRAND_RE.match(line)
+            if heading and len(line) <= MAX_HEADING_CHARS:
+                yield from flush_paragraph()
+                key = "sub_strand" if heading.re is SUB_STRAND_RE else "strand"
+                structure[key] = heading.group(1).strip() or line
+                if key == "strand":
+                    structure["sub_strand"] = ""
+                structure["content_standard"] = ""
+                structure["indicator"] = ""
+                yield line, ((0, page_no),), dict(structure), True
+                continue
+
+            code = CODE_RE.match(line)
+            if code:
+                yield from flush_paragraph()
+                if _code_depth(code.group(0)) == 4:
+                    structure["content_standard"] = code.group(0)
+                    structure["indicator"] = ""
+                else:
+                    structure["indicator"] = code.group(0)
+            paragraph.append((line, page_no))
+    yield from flush_paragraph()
+
+
+def _split_long_unit(text: str, max_tokens: int) -> Iterator[tuple[int, int]]:
+    """Splits a sentence longer than the budget (e.g. a table row dump) at token boundaries;
+    yields the (start, end) offsets of each piece."""
+    tokens = list(TOKEN_RE.finditer(text))
+    for i in range(0, len(tokens), max_tokens):
+        window = tokens[i:i + max_tokens]
+        yield window[0].start(), window[-1].end()
+
+
+def chunk_document(pages: list[str], max_tokens: int = CHUNK_MAX_TOKENS,
+                   overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list[dict]:
+    """Splits a document (one string per page) into structure-aware chunks.
+
+    Chunks end on sentence boundaries and never exceed max_tokens; a new strand, sub-strand
+    or content standard always starts a new chunk. Each chunk is a dict with the text, the
+    first and last page it covers and the syllabus structure it belongs to. Runs in linear
+    time: every sentence is joined into at most one chunk plus the next chunk's overlap.
+    """
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens must be less than max_tokens.")
+
+    chunks: list[dict] = []
+    current: list[tuple[str, int, int, int, dict]] = []  # (sentence, tokens, page_start, page_end, structure)
+    current_tokens = 0
+    section = None
+
+    def emit():
+        text = ' '.join(unit[0] for unit in current)
+        codes = dict.fromkeys(CODE_RE.findall(text))
+        # The chunk's section is the one its last unit is in: only leading headings (kept with the
+        # content below them) can still carry the structure from before the section change.
+        section_structure = current[-1][4]
+        if section_structure["indicator"]:
+            codes = {section_structure["indicator"]: None, **codes}
+        chunks.append({
+            "text": text,
+            "page_start": min(unit[2] for unit in current),
+            "page_end": max(unit[3] for unit in current),
+            "strand": section_structure["strand"],
+            "sub_strand": section_structure["sub_strand"],
+            "content_standard": section_structure["content_standard"],
+            "indicators": ",".join(code for code in codes if _code_depth(code) == 5),
+        })
+
+    def carry_overlap():
+        kept, kept_tokens = [], 0
+        for unit in reversed(current):
+            if kept_tokens + unit[1] > overlap_tokens:
+                break
+            kept.append(unit)
+            kept_tokens += unit[1]
+        kept.reverse()
+        return kept, kept_tokens
+
+    only_headings = True  # Headings directly followed by other headings stay with the content below them
+    for sentence, page_breaks, structure, is_heading in _iter_units(pages):
+        if not sentence.strip():
+            continue
+        unit_section = (structure["strand"], structure["sub_strand"], structure["content_standard"])
+        if current and unit_section != section and not only_headings:
+            emit()
+            current, current_tokens = [], 0
+        section = unit_section
+        only_headings = is_heading and (only_headings or not current)
+
+        tokens = count_tokens(sentence)
+        spans = [(0, len(sentence))] if tokens <= max_tokens else list(_split_long_unit(sentence, max_tokens))
+        for start, end in spans:
+            piece = sentence[start:end]
+            piece_tokens = tokens if len(spans) == 1 else count_tokens(piece)
+            page_start, page_end = _pages_of(page_breaks, start, end)
+            if current and current_tokens + piece_tokens > max_tokens:
+                emit()
+                current, current_tokens = carry_overlap()
+                # The carried-over sentences must still leave room for the new one.
+                while current and current_tokens + piece_tokens > max_tokens:
+                    current_tokens -= current.pop(0)[1]
+            current.append((piece, piece_tokens, page_start, page_end, structure))
+            current_tokens += piece_tokens
+
+    if current:
+        emit()
+    return chunks
@@ -0,0 +1,203 @@
+import os
+import argparse
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import Callable, Optional
+
+# --- Configuration ---
+SYLLABUS_DB_PATH = "./data/syllabus.sqlite3"
+SYLLABUS_JSON_PATH = "./data/syllabus.json"  # Same nested layout as get_sample_syllabus() in main.py
+SCHEMA_VERSION = "2"
+NAVIGATION_CACHE_SIZE = 256  # (level, subject, grade) topic lists and option lists kept in memory
+LESSON_CACHE_SIZE = 256
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE topics (
+    level TEXT NOT NULL, subject TEXT NOT NULL, grade TEXT NOT NULL,
+    topic_idx INTEGER NOT NULL, title TEXT NOT NULL,
+    PRIMARY KEY (level, subject, grade, topic_idx)
+);
+CREATE TABLE subtopics (
+    level TEXT NOT NULL, subject TEXT NOT NULL, grade TEXT NOT NULL,
+    topic_idx INTEGER NOT NULL, subtopic_idx INTEGER NOT NULL,
+    title TEXT NOT NULL, content TEXT NOT NULL, examples_json TEXT NOT NULL, exercises_json TEXT NOT NULL,
+    PRIMARY KEY (level, subject, grade, topic_idx, subtopic_idx)
+);
+"""
+
+
+def source_signature(json_path: str) -> str:
+    """Cheap change detector for a JSON source file (size and modification time)."""
+    stat = os.stat(json_path)
+    return f"file:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def syllabus_signature(syllabus: dict) -> str:
+    return "dict:" + hashlib.sha256(json.dumps(syllabus, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def compile_syllabus(syllabus: dict, db_path: str = SYLLABUS_DB_PATH, signature: str = "") -> None:
+    """Compiles the nested level -> subject -> grade -> topics dict into an indexed SQLite file.
+
+    The database is built next to the target and swapped in atomically.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        topic_rows, subtopic_rows = [], []
+        for level, subjects in syllabus.items():
+            for subject, grades in subjects.items():
+                for grade, topics in grades.items():
+                    for topic_idx, topic in enumerate(topics):
+                        topic_rows.append((level, subject, grade, topic_idx, topic["topic"]))
+                        for subtopic_idx, subtopic in enumerate(topic["subtopics"]):
+                            subtopic_rows.append((
+                                level, subject, grade, topic_idx, subtopic_idx, subtopic["title"],
+                                subtopic.get("content", ""),
+                                json.dumps(subtopic.get("examples", [])),
+                                json.dumps(subtopic.get("exercises", [])),
+                            ))
+        conn.executemany("INSERT INTO topics VALUES (?, ?, ?, ?, ?)", topic_rows)
+        conn.executemany("INSERT INTO subtopics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", subtopic_rows)
+        conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                         [("schema_version", SCHEMA_VERSION), ("source_signature", signature)])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+    logging.info(f"Compiled syllabus store {db_path}: {len(topic_rows)} topics, {len(subtopic_rows)} subtopics.")
+
+
+class SyllabusStore:
+    """Read-only view of a compiled syllabus database.
+
+    Nothing is loaded at open time. Each navigation query (the subjects of a level, the topics
+    of a grade, ...) is a range lookup on the tables' (level, subject, grade, ...) primary keys
+    made when first needed, and lesson bodies are fetched by primary key when a lesson is
+    opened; both have LRU caches in front. Options keep the order of the source syllabus.
+    """
+
+    def __init__(self, db_path: str = SYLLABUS_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self._options = lru_cache(maxsize=NAVIGATION_CACHE_SIZE)(self._load_options)
+        self._topics = lru_cache(maxsize=NAVIGATION_CACHE_SIZE)(self._load_topics)
+        self.lesson = lru_cache(maxsize=LESSON_CACHE_SIZE)(self._load_lesson)
+
+    def signature(self) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'source_signature'").fetchone()
+        return row[0] if row else None
+
+    def _load_options(self, *path: str) -> tuple[str, ...]:
+        """Distinct values of the key column after `path` (levels, subjects or grades), in source order."""
+        column = ("level", "subject", "grade")[len(path)]
+        where = " AND ".join(f"{name} = ?" for name in ("level", "subject")[:len(path)]) or "1"
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {column} FROM topics WHERE {where} "
+                                      f"GROUP BY {column} ORDER BY MIN(rowid)", path).fetchall()
+        if path and not rows:
+            raise KeyError(path)
+        return tuple(row[0] for row in rows)
+
+    def _load_topics(self, level: str, subject: str, grade: str) -> list[dict]:
+        key = (level, subject, grade)
+        with self._lock:
+            topics = [{"topic": title, "subtopics": []} for title, in self._conn.execute(
+                "SELECT title FROM topics WHERE level = ? AND subject = ? AND grade = ? ORDER BY topic_idx", key)]
+            for topic_idx, title in self._conn.execute(
+                    "SELECT topic_idx, title FROM subtopics WHERE level = ? AND subject = ? AND grade = ? "
+                    "ORDER BY topic_idx, subtopic_idx", key):
+                topics[topic_idx]["subtopics"].append(title)
+        if not topics:
+            raise KeyError(key)
+        return topics
+
+    def levels(self) -> list[str]:
+        return list(self._options())
+
+    def subjects(self, level: str) -> list[str]:
+        return list(self._options(level))
+
+    def grades(self, level: str, subject: str) -> list[str]:
+        return list(self._options(level, subject))
+
+    def topics(self, level: str, subject: str, grade: str) -> list[dict]:
+        """Topics as {"topic": title, "subtopics": [subtopic titles]}, without lesson bodies."""
+        return self._topics(level, subject, grade)
+
+    def _load_lesson(self, level: str, subject: str, grade: str, topic_idx: int, subtopic_idx: int) -> dict:
+        """Full subtopic: {"title", "content", "examples", "exercises"}."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT title, content, examples_json, exercises_json FROM subtopics "
+                "WHERE level = ? AND subject = ? AND grade = ? AND topic_idx = ? AND subtopic_idx = ?",
+                (level, subject, grade, topic_idx, subtopic_idx)).fetchone()
+        if row is None:
+            raise KeyError((level, subject, grade, topic_idx, subtopic_idx))
+        title, content, examples_json, exercises_json = row
+        return {"title": title, "content": content,
+                "examples": json.loads(examples_json), "exercises": json.loads(exercises_json)}
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def _stored_signature(db_path: str) -> Optional[str]:
+    """Source signature recorded in an existing store, or None if it is missing or from another schema."""
+    if not os.path.exists(db_path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            rows = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    if rows.get("schema_version") != SCHEMA_VERSION:
+        return None
+    return rows.get("source_signature")
+
+
+def open_store(db_path: str = SYLLABUS_DB_PATH, json_path: str = SYLLABUS_JSON_PATH,
+               fallback: Optional[Callable[[], dict]] = None) -> SyllabusStore:
+    """Opens the compiled store, (re)compiling it first if its source changed.
+
+    The source is json_path if it exists, otherwise the dict returned by fallback().
+    """
+    if os.path.exists(json_path):
+        signature = source_signature(json_path)
+        if _stored_signature(db_path) != signature:
+            with open(json_path, "r", encoding="utf-8") as f:
+                compile_syllabus(json.load(f), db_path, signature=signature)
+    elif fallback is not None:
+        syllabus = fallback()
+        signature = syllabus_signature(syllabus)
+        if _stored_signature(db_path) != signature:
+            compile_syllabus(syllabus, db_path, signature=signature)
+    elif not os.path.exists(db_path):
+        raise FileNotFoundError(f"No compiled syllabus at {db_path} and no source at {json_path}.")
+    return SyllabusStore(db_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a syllabus JSON file into the SQLite syllabus store.")
+    parser.add_argument("--json", default=SYLLABUS_JSON_PATH, help="Nested level/subject/grade/topics JSON file.")
+    parser.add_argument("--db", default=SYLLABUS_DB_PATH, help="Output database.")
+    args = parser.parse_args()
+    with open(args.json, "r", encoding="utf-8") as f:
+        compile_syllabus(json.load(f), args.db, signature=source_signature(args.json))
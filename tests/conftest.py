@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TINY_GGUF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiny.gguf")
+
+
+@pytest.fixture(scope="session")
+def tiny_gguf() -> str:
+    """Path of the tiny test model; skips when it or llama-cpp-python is missing."""
+    if not os.path.exists(TINY_GGUF):
+        pytest.skip("tests/tiny.gguf is missing (python tests/make_tiny_gguf.py)")
+    pytest.importorskip("llama_cpp")
+    return TINY_GGUF
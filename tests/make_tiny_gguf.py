@@ -0,0 +1,59 @@
+"""Writes tests/tiny.gguf: a 2-layer llama with random weights and a ~350-token vocabulary.
+
+It only exercises the llama.cpp plumbing (loading, tokenizing, decoding, state save/restore);
+its output is gibberish. Needs the `gguf` package: python tests/make_tiny_gguf.py
+"""
+import os
+import string
+
+import gguf
+import numpy as np
+
+OUTPUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiny.gguf")
+
+vocab = [("<unk>", 2), ("<s>", 3), ("</s>", 3)] + [(f"<0x{i:02X}>", 6) for i in range(256)]
+pieces = ["\u2581"] + list(string.ascii_letters + string.digits + string.punctuation)
+pieces += ["\u2581" + word for word in "the a is to of and answer student correct exercise feedback lesson topic count numbers".split()]
+vocab += [(piece, 1) for piece in pieces]
+n_vocab, n_embd, n_layer, n_ff, n_head = len(vocab), 64, 2, 128, 4
+
+writer = gguf.GGUFWriter(OUTPUT_PATH, "llama")
+writer.add_context_length(2048)
+writer.add_embedding_length(n_embd)
+writer.add_block_count(n_layer)
+writer.add_feed_forward_length(n_ff)
+writer.add_rope_dimension_count(n_embd // n_head)
+writer.add_head_count(n_head)
+writer.add_head_count_kv(n_head)
+writer.add_layer_norm_rms_eps(1e-5)
+writer.add_tokenizer_model("llama")
+writer.add_token_list([token for token, _ in vocab])
+writer.add_token_scores([-float(i) for i in range(n_vocab)])
+writer.add_token_types([token_type for _, token_type in vocab])
+writer.add_bos_token_id(1)
+writer.add_eos_token_id(2)
+writer.add_unk_token_id(0)
+
+rng = np.random.default_rng(0)
+
+
+def weights(*shape):
+    return (rng.standard_normal(shape) * 0.02).astype(np.float32)
+
+
+writer.add_tensor("token_embd.weight", weights(n_vocab, n_embd))
+writer.add_tensor("output_norm.weight", np.ones(n_embd, np.float32))
+writer.add_tensor("output.weight", weights(n_vocab, n_embd))
+for i in range(n_layer):
+    block = f"blk.{i}."
+    writer.add_tensor(block + "attn_norm.weight", np.ones(n_embd, np.float32))
+    writer.add_tensor(block + "ffn_norm.weight", np.ones(n_embd, np.float32))
+    for name in ["attn_q", "attn_k", "attn_v", "attn_output"]:
+        writer.add_tensor(block + name + ".weight", weights(n_embd, n_embd))
+    writer.add_tensor(block + "ffn_gate.weight", weights(n_ff, n_embd))
+    writer.add_tensor(block + "ffn_up.weight", weights(n_ff, n_embd))
+    writer.add_tensor(block + "ffn_down.weight", weights(n_embd, n_ff))
+writer.write_header_to_file()
+writer.write_kv_data_to_file()
+writer.write_tensors_to_file()
+writer.close()
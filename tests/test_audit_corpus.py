@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+
+import audit_corpus
+import pdftovector
+
+# Stored chunks per file; the summary (ingest manifest) is set up to disagree for some of them.
+STORED = {"ok.pdf": 2, "changed.pdf": 1, "gone.pdf": 1, "short.pdf": 1, "extra.pdf": 2}
+SUMMARY_CHUNKS = {"ok.pdf": 2, "empty.pdf": 0, "changed.pdf": 1, "gone.pdf": 1, "short.pdf": 2, "extra.pdf": 1}
+ON_DISK = ["ok.pdf", "empty.pdf", "changed.pdf", "short.pdf", "extra.pdf", "new.pdf"]
+
+
+def _write_pdf(path, content: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n" + content)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    """A PDF directory and a database whose summary accounts for exactly the stored chunks."""
+    pdf_dir, db_path = tmp_path / "pdfs", tmp_path / "db"
+    pdf_dir.mkdir()
+    for name in ON_DISK:
+        _write_pdf(pdf_dir / name, name.encode())
+
+    summary = {}
+    for name, count in SUMMARY_CHUNKS.items():
+        path = str(pdf_dir / name)
+        summary[name] = {"sha256": pdftovector.file_sha256(path) if os.path.exists(path) else "0" * 64,
+                         "size_bytes": os.path.getsize(path) if os.path.exists(path) else 0, "chunk_count": count,
+                         "subject": "Mathematics", "grade_band": "B1-B3", "ingested_at": "2024-01-01T00:00:00+00:00"}
+    _write_pdf(pdf_dir / "changed.pdf", b"CHANGED.pdf")  # Same size, different content
+
+    collection = chromadb.PersistentClient(path=str(db_path)).get_or_create_collection(
+        audit_corpus.COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
+    for name, count in STORED.items():
+        collection.add(ids=[pdftovector.make_chunk_id(name, i) for i in range(1, count + 1)],
+                       embeddings=[[float(i), 1.0] for i in range(1, count + 1)],
+                       documents=[f"{name} chunk {i}" for i in range(1, count + 1)],
+                       metadatas=[{"source_pdf": name, "chunk_number": i} for i in range(1, count + 1)])
+    manifest = {"version": pdftovector.MANIFEST_VERSION, "config": {}, "files": summary}
+    pdftovector.save_manifest(manifest, os.path.join(db_path, os.path.basename(pdftovector.MANIFEST_PATH)))
+    return str(pdf_dir), str(db_path), collection
+
+
+def _statuses(rows: list[dict]) -> dict:
+    return {row["file"]: row["status"] for row in rows}
+
+
+EXPECTED = {"ok.pdf": "ok", "empty.pdf": "ok", "changed.pdf": "changed", "gone.pdf": "stale",
+            "short.pdf": "count_mismatch", "extra.pdf": "count_mismatch", "new.pdf": "not_ingested"}
+
+
+def test_audit_from_summary_and_id_lookups(corpus):
+    pdf_dir, db_path, _ = corpus
+    rows = audit_corpus.audit(pdf_dir, db_path)
+    assert _statuses(rows) == EXPECTED
+    details = {row["file"]: row["detail"] for row in rows}
+    assert details["short.pdf"] == "chunks missing from the collection"
+    assert details["extra.pdf"] == "more chunks stored than recorded"
+    assert all(row["stored_chunks"] is None for row in rows)  # No scan was needed
+
+
+def test_size_check_without_hashing(corpus):
+    pdf_dir, db_path, _ = corpus
+    _write_pdf(os.path.join(pdf_dir, "changed.pdf"), b"a longer replacement")
+    rows = audit_corpus.audit(pdf_dir, db_path, check_hashes=False)
+    assert _statuses(rows)["changed.pdf"] == "changed"
+    assert _statuses(rows)["ok.pdf"] == "ok"
+
+
+@pytest.mark.parametrize("scan", [False, True])
+def test_scan_counts_stored_chunks(corpus, scan):
+    pdf_dir, db_path, collection = corpus
+    if not scan:
+        # Chunks the summary doesn't account for force the paginated metadata scan.
+        collection.add(ids=["stray_chunk_1", "stray_chunk_2"], embeddings=[[0.0, 1.0], [1.0, 0.0]],
+                       documents=["stray", "no source"], metadatas=[{"source_pdf": "stray.pdf"}, {"chunk_number": 1}])
+    rows = audit_corpus.audit(pdf_dir, db_path, scan=scan)
+    statuses = _statuses(rows)
+    assert {name: statuses[name] for name in EXPECTED} == EXPECTED
+    stored = {row["file"]: row["stored_chunks"] for row in rows}
+    assert stored["ok.pdf"] == 2 and stored["empty.pdf"] == 0 and stored["short.pdf"] == 1 and stored["extra.pdf"] == 2
+    if not scan:
+        assert statuses["stray.pdf"] == "untracked" and statuses[None] == "untracked"
@@ -0,0 +1,29 @@
+import os
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache, cache_key
+
+
+def test_round_trip_and_hits_do_not_rewrite_the_index(tmp_path):
+    cache = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+    keys = [cache_key("test-model", text) for text in ["one", "two"]]
+    cache.put_many(keys, np.eye(2, 4, dtype=np.float32))
+    cache.save()
+    mtime = os.stat(cache.index_path).st_mtime_ns
+
+    reopened = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+    vectors = reopened.get_many(keys + [cache_key("test-model", "three")])
+    assert np.array_equal(vectors[1], np.eye(2, 4, dtype=np.float32)[1]) and vectors[2] is None
+    reopened.save()
+    assert os.stat(reopened.index_path).st_mtime_ns == mtime
+    assert reopened.stats()["hits"] == 2 and reopened.stats()["misses"] == 1
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache("test-model", cache_dir=str(tmp_path), max_entries=2)
+    cache.put_many(["a", "b"], np.ones((2, 3), dtype=np.float32))
+    cache.get_many(["a"])
+    cache.put_many(["c"], np.zeros((1, 3), dtype=np.float32))
+    assert cache.get_many(["b"]) == [None]
+    assert cache.get_many(["a"])[0] is not None and cache.get_many(["c"])[0] is not None
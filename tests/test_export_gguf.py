@@ -0,0 +1,49 @@
+import json
+import os
+
+import pytest
+
+from export_gguf import merge_adapter, merged_is_current
+
+
+@pytest.fixture
+def adapter(tmp_path):
+    adapter_dir = tmp_path / "adapter"
+    adapter_dir.mkdir()
+    adapter_file = adapter_dir / "adapter_model.safetensors"
+    adapter_file.write_bytes(b"weights")
+    os.utime(adapter_file, (1_000_000, 1_000_000))
+    return adapter_dir, adapter_file
+
+
+def write_merged(directory, config: dict, mtime: float) -> str:
+    directory.mkdir()
+    (directory / "config.json").write_text(json.dumps(config))
+    os.utime(directory / "config.json", (mtime, mtime))
+    return str(directory)
+
+
+def test_reuses_a_newer_float16_merge_without_merging(adapter, tmp_path):
+    adapter_dir, _ = adapter
+    merged_dir = write_merged(tmp_path / "merged_fp16", {"torch_dtype": "float16"}, 2_000_000)
+    # Returns before importing torch/peft, so this passes without them installed.
+    assert merge_adapter(str(adapter_dir), merged_dir) == merged_dir
+
+
+def test_quantized_merge_is_not_reused(adapter, tmp_path):
+    _, adapter_file = adapter
+    merged_dir = write_merged(tmp_path / "final_merged_checkpoint",
+                              {"quantization_config": {"load_in_4bit": True}}, 2_000_000)
+    assert not merged_is_current(merged_dir, adapter_file)
+
+
+def test_merge_older_than_the_adapter_is_not_reused(adapter, tmp_path):
+    _, adapter_file = adapter
+    merged_dir = write_merged(tmp_path / "merged_fp16", {"torch_dtype": "float16"}, 500_000)
+    assert not merged_is_current(merged_dir, adapter_file)
+    assert not merged_is_current(str(tmp_path / "missing"), adapter_file)
+
+
+def test_missing_adapter_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        merge_adapter(str(tmp_path), str(tmp_path / "merged_fp16"))
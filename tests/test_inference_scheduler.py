@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+import inference_scheduler
+import llm_engine
+from inference_scheduler import InferenceScheduler
+from llm_engine import LlamaCppModel
+
+LESSON = "Lesson: Counting\nExercise: "
+
+
+@pytest.fixture
+def greedy(monkeypatch):
+    # Temperature 0 makes both backends pick the top token, so their texts must agree.
+    monkeypatch.setattr(llm_engine, "TEMPERATURE", 0.0)
+    monkeypatch.setattr(inference_scheduler, "TEMPERATURE", 0.0)
+
+
+@pytest.fixture
+def scheduler(tiny_gguf):
+    scheduler = InferenceScheduler.load(tiny_gguf, slots=3, slot_ctx=256, prefix_kv_mb=1, step_tokens=64, n_threads=1)
+    yield scheduler
+    scheduler.close()
+
+
+def _wait_until_idle(scheduler: InferenceScheduler, timeout: float = 30.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = scheduler.stats()
+        if not stats["active"] and not stats["queue_depth"]:
+            return stats
+        time.sleep(0.01)
+    raise AssertionError("scheduler did not go idle")
+
+
+def test_concurrent_requests_match_single_model(tiny_gguf, greedy, scheduler):
+    prompts = [f"{LESSON}count to {i}\nFeedback:" for i in range(5)]
+    model = LlamaCppModel(tiny_gguf, n_threads=1, n_ctx=256, n_batch=64, prefix_cache_mb=0)
+    # Long enough for every answer to end on its own: create_completion may run past max_tokens
+    # to finish a multi-byte character, so cut-off answers can differ in their last bytes.
+    expected = [model.generate_response(prompt, max_tokens=150) for prompt in prompts]
+
+    results = [None] * len(prompts)
+
+    def student(i: int) -> None:
+        results[i] = scheduler.generate_response(prompts[i], max_tokens=150, session=f"student-{i}")
+
+    threads = [threading.Thread(target=student, args=(i,)) for i in range(len(prompts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == expected
+    stats = scheduler.stats()
+    assert stats["completed"] == len(prompts) and stats["failed"] == 0
+
+
+def test_prefix_is_shared_across_requests(scheduler):
+    for number in (5, 9, 7):
+        scheduler.generate_response(f"{LESSON}count to {number}", max_tokens=4, prefix=LESSON)
+    stats = scheduler.stats()
+    assert stats["resident_prefixes"] == 1
+    assert stats["prefix_hits"] == 2
+    assert stats["prefix_megabytes"] > 0
+
+
+def test_cancelled_stream_frees_its_slot(tiny_gguf):
+    scheduler = InferenceScheduler.load(tiny_gguf, slots=1, slot_ctx=256, n_threads=1)
+    try:
+        stream = scheduler.stream_response(f"{LESSON}count to 5\nFeedback:", max_tokens=200)
+        next(stream)
+        stream.close()  # The student navigated away
+        stats = _wait_until_idle(scheduler)
+        assert stats["completed"] == 1
+        assert stats["generated_tokens"] < 200
+        # The only slot is free again.
+        assert isinstance(scheduler.generate_response(f"{LESSON}count to 9", max_tokens=4), str)
+    finally:
+        scheduler.close()
+
+
+def test_full_queue_rejects_requests(tiny_gguf):
+    scheduler = InferenceScheduler.load(tiny_gguf, slots=1, slot_ctx=256, max_queued=1, n_threads=1)
+    try:
+        # Holding the scheduler's lock keeps the first request waiting in the queue.
+        with scheduler._cond:
+            request = scheduler.submit(f"{LESSON}count to 5", max_tokens=4)
+            with pytest.raises(RuntimeError):
+                scheduler.submit(f"{LESSON}count to 9", max_tokens=4)
+        while request.output.get() is not inference_scheduler._DONE:
+            pass
+        stats = _wait_until_idle(scheduler)
+        assert stats["rejected"] == 1 and stats["completed"] == 1
+    finally:
+        scheduler.close()
+
+
+def test_context_must_hold_every_slot(tiny_gguf):
+    model = LlamaCppModel(tiny_gguf, n_threads=1, n_ctx=512, n_batch=64, prefix_cache_mb=0)
+    with pytest.raises(ValueError, match="512 tokens"):
+        InferenceScheduler(model, slots=4, slot_ctx=256)
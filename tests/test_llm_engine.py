@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+
+from llm_engine import LlamaCppModel, PrefixStateCache, kv_bytes_per_token
+
+TINY_GGUF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiny.gguf")
+
+requires_tiny_model = pytest.mark.skipif(not os.path.exists(TINY_GGUF),
+                                         reason="tests/tiny.gguf is missing (python tests/make_tiny_gguf.py)")
+
+
+@pytest.fixture(scope="module")
+def model():
+    pytest.importorskip("llama_cpp")
+    return LlamaCppModel(TINY_GGUF, n_threads=1, n_ctx=256, n_batch=64, prefix_cache_mb=1)
+
+
+def test_prefix_state_cache_evicts_least_recently_used():
+    cache = PrefixStateCache(max_bytes=100)
+    tokens = np.zeros(2, dtype=np.intc)  # 8 bytes
+    cache.put("a", tokens, b"x" * 40)
+    cache.put("b", tokens, b"x" * 40)
+    assert cache.get("a") is not None
+    cache.put("c", tokens, b"x" * 40)
+    assert cache.get("b") is None and cache.get("a") is not None and cache.get("c") is not None
+    cache.put("huge", tokens, b"x" * 200)
+    assert cache.get("huge") is None
+    assert cache.stats()["evictions"] == 1
+
+
+@requires_tiny_model
+def test_generates_and_records_stats(model):
+    text = model.generate_response("What comes after 39?", max_tokens=8)
+    assert isinstance(text, str)
+    stats = model.last_stats
+    assert stats["prompt_tokens"] > 0
+    assert stats["total_seconds"] >= stats["time_to_first_token"] >= 0
+    assert stats["prefix_cache"] == "none"
+
+
+@requires_tiny_model
+def test_prefix_state_is_reused(model):
+    lesson = "Lesson: Counting\nExercise: "
+    other = "Lesson: Addition\nExercise: "
+    statuses = []
+    for prefix, rest in [(lesson, "count to 5"), (lesson, "count to 9"), (other, "add 2 and 3"), (lesson, "count to 7")]:
+        list(model.stream_response(prefix + rest, max_tokens=4, prefix=prefix))
+        statuses.append(model.last_stats["prefix_cache"])
+    assert statuses == ["miss", "resident", "miss", "hit"]
+
+
+@requires_tiny_model
+def test_prefix_must_start_the_prompt(model):
+    with pytest.raises(ValueError):
+        list(model.stream_response("Exercise: count to 5", prefix="Lesson: "))
+
+
+@requires_tiny_model
+def test_kv_bytes_per_token_from_metadata():
+    pytest.importorskip("llama_cpp")
+    # 2 layers x (keys + values) x 64 dims x 2 bytes (f16)
+    assert kv_bytes_per_token(TINY_GGUF) == 2 * 2 * 64 * 2
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from numpy_index import NumpyCollection, export_collection
+
+
+@pytest.fixture
+def collections(tmp_path):
+    chromadb = pytest.importorskip("chromadb")
+    client = chromadb.EphemeralClient()
+    chroma = client.get_or_create_collection(f"numpy_index_{tmp_path.name}", metadata={"hnsw:space": "cosine"})
+    chroma.add(ids=["a_chunk_1", "a_chunk_2", "b_chunk_1"],
+               embeddings=[[1.0, 0.0, 0.0], [0.6, 0.8, 0.0], [0.0, 0.0, 1.0]],
+               documents=["Count to 10.", "Count to 20.", "Add two numbers."],
+               metadatas=[{"subject": "Mathematics", "page_start": 1}, {"subject": "Mathematics", "page_start": 2},
+                          {"subject": "Mathematics", "page_start": 5}])
+    directory = str(tmp_path / "numpy_index")
+    assert export_collection(chroma, directory) == 3
+    yield chroma, NumpyCollection(directory)
+    client.delete_collection(chroma.name)
+
+
+def test_empty_include_returns_ids_only(collections):
+    chroma, index = collections
+    for collection in (chroma, index):
+        page = collection.get(include=[], limit=2)
+        assert page["ids"] == ["a_chunk_1", "a_chunk_2"]
+        assert page.get("documents") is None and page.get("metadatas") is None
+    hits = index.query(query_embeddings=[[1.0, 0.1, 0.0]], n_results=2, include=[])
+    assert hits == {"ids": [["a_chunk_1", "a_chunk_2"]]}
+
+
+def test_default_include_matches_chromadb(collections):
+    chroma, index = collections
+    assert index.get(ids=["b_chunk_1", "missing"])["documents"] == chroma.get(ids=["b_chunk_1"])["documents"]
+    hits = index.query(query_embeddings=[[1.0, 0.1, 0.0]], n_results=2)
+    expected = chroma.query(query_embeddings=[[1.0, 0.1, 0.0]], n_results=2)
+    assert hits["ids"] == expected["ids"] and hits["metadatas"] == expected["metadatas"]
+    assert np.allclose(hits["distances"], expected["distances"], atol=1e-3)
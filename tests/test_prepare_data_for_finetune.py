@@ -0,0 +1,19 @@
+import llm_engine
+from inference_scheduler import InferenceScheduler
+from prepare_data_for_finetune import load_synthesis_model
+
+
+def test_synthesis_model_loads_a_scheduler_sized_for_its_slots(tiny_gguf, monkeypatch):
+    monkeypatch.setattr(llm_engine, "MODEL_PATH", tiny_gguf)
+    scheduler = load_synthesis_model()
+    try:
+        assert isinstance(scheduler, InferenceScheduler)
+        assert isinstance(scheduler.generate_response("Lesson: Counting\nFeedback:", max_tokens=4), str)
+    finally:
+        scheduler.close()
+
+
+def test_synthesis_model_is_optional(monkeypatch, tmp_path):
+    monkeypatch.setattr(llm_engine, "MODEL_PATH", "")
+    monkeypatch.chdir(tmp_path)  # No models/ directory here
+    assert load_synthesis_model() is None
@@ -0,0 +1,38 @@
+from rag import FeedbackPromptBuilder
+
+SUBTOPIC = {"title": "Counting Numbers", "content": "Count from 1 to 100."}
+HIT = {"id": "b1.pdf:1", "text": "Learners count forwards and backwards to 100.",
+       "metadata": {"source_pdf": "b1.pdf", "page_start": 3, "page_end": 3}}
+
+
+class ScriptedBuilder(FeedbackPromptBuilder):
+    """Returns queued retrieval results instead of querying the vector store."""
+
+    def __init__(self, results):
+        super().__init__()
+        self.results = list(results)
+        self.calls = 0
+
+    def _retrieve(self, query, subject, grade):
+        self.calls += 1
+        return self.results.pop(0)
+
+
+def test_prefix_is_built_once_per_subtopic():
+    builder = ScriptedBuilder([[HIT]])
+    first = builder.build("mathematics", "grade1", "Numbers", SUBTOPIC, "Count to 5.", "1 2 3 4 5")
+    second = builder.build("mathematics", "grade1", "Numbers", SUBTOPIC, "Count to 9.", "1 2 3")
+    assert builder.calls == 1
+    assert first["prefix"] == second["prefix"] and "Curriculum notes:" in first["prefix"]
+    assert first["sources"] == ["b1.pdf:1"] and not first["retrieval_failed"]
+    assert second["prompt"].startswith(second["prefix"])
+
+
+def test_failed_retrieval_is_not_cached():
+    builder = ScriptedBuilder([None, [HIT]])
+    failed = builder.build("mathematics", "grade1", "Numbers", SUBTOPIC, "Count to 5.", "1 2 3 4 5")
+    assert failed["retrieval_failed"] and failed["sources"] == []
+    assert "Curriculum notes:" not in failed["prefix"]
+    retried = builder.build("mathematics", "grade1", "Numbers", SUBTOPIC, "Count to 5.", "1 2 3 4 5")
+    assert builder.calls == 2
+    assert retried["sources"] == ["b1.pdf:1"] and not retried["retrieval_failed"]
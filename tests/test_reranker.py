@@ -0,0 +1,66 @@
+import time
+
+from reranker import CrossEncoderReranker
+
+
+class SlowScorer:
+    """Stands in for the cross-encoder: scores by a number in the text, sleeping per pair."""
+
+    def __init__(self, seconds_per_pair: float = 0.0):
+        self.seconds_per_pair = seconds_per_pair
+        self.calls: list[int] = []
+
+    def predict(self, pairs, batch_size=8, show_progress_bar=False):
+        self.calls.append(len(pairs))
+        time.sleep(self.seconds_per_pair * len(pairs))
+        return [float(text.split()[-1]) for _, text in pairs]
+
+
+def make_reranker(scorer, **kwargs) -> CrossEncoderReranker:
+    reranker = CrossEncoderReranker(model_name="test", **kwargs)
+    reranker._model = scorer
+    return reranker
+
+
+def make_hits(scores):
+    return [{"id": f"c{i}", "text": f"chunk {score}"} for i, score in enumerate(scores)]
+
+
+def test_reranks_by_score_within_budget():
+    reranker = make_reranker(SlowScorer(), batch_size=4, budget_ms=1000)
+    ranked = reranker.rerank("q", make_hits([1, 5, 3, 4, 2]), k=3)
+    assert [hit["id"] for hit in ranked] == ["c1", "c3", "c2"]
+    assert ranked[0]["rerank_score"] == 5.0
+
+
+def test_partial_scores_rerank_the_scored_head_only():
+    scorer = SlowScorer(seconds_per_pair=0.01)
+    reranker = make_reranker(scorer, batch_size=2, budget_ms=35)
+    scores = [1, 2, 3, 4, 9, 9, 9, 9, 9, 9]
+    hits = make_hits(scores)
+    ranked = reranker.rerank("q", hits, k=10)
+    scored = sum("rerank_score" in hit for hit in ranked)
+    assert 0 < scored < len(hits)
+    assert reranker.stats["partial"] == 1
+    # The scored head is sorted by score; the unscored tail keeps its retrieval order.
+    assert [hit["rerank_score"] for hit in ranked[:scored]] == sorted(scores[:scored], reverse=True)
+    assert ranked[scored:] == hits[scored:]
+
+
+def test_batches_shrink_to_the_remaining_budget():
+    scorer = SlowScorer(seconds_per_pair=0.01)
+    reranker = make_reranker(scorer, batch_size=8, budget_ms=1000)
+    reranker.rerank("warm up", make_hits([1]), k=1)
+    reranker.budget_ms = 30
+    reranker.rerank("q", make_hits(range(8)), k=8)
+    # Only about three pairs fit in 30 ms at 10 ms per pair, so the batch is cut down rather than overrunning.
+    assert scorer.calls[1] < 8
+
+
+def test_cached_scores_are_reused():
+    scorer = SlowScorer()
+    reranker = make_reranker(scorer, budget_ms=1000)
+    hits = make_hits([3, 1, 2])
+    first = reranker.rerank("What is 2 + 2?", hits, k=3)
+    assert reranker.rerank("what is  2 + 2?", hits, k=3) == first
+    assert len(scorer.calls) == 1 and reranker.stats["cache_hits"] == 3
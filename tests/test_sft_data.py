@@ -0,0 +1,95 @@
+import json
+
+import numpy as np
+import pytest
+
+from sft_data import (PackedCollator, TokenCache, build_token_cache, group_hash, holdout_threshold,
+                      pack_sequences, padding_ratio)
+
+
+class TinyTokenizer:
+    """Whitespace tokenizer with a growing vocabulary; enough of the HF interface for build_token_cache."""
+
+    name_or_path = "tiny-whitespace"
+
+    def __init__(self):
+        self.vocab = {"<pad>": 0}
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {"input_ids": [[self.vocab.setdefault(word, len(self.vocab)) for word in text.split()]
+                              for text in texts]}
+
+
+@pytest.fixture
+def token_cache(tmp_path) -> TokenCache:
+    data = tmp_path / "data.jsonl"
+    rng = np.random.default_rng(0)
+    with open(data, "w", encoding="utf-8") as f:
+        for i in range(300):
+            words = " ".join(f"w{j % 37}" for j in range(int(rng.integers(1, 40))))
+            f.write(json.dumps({"text": words, "chunk": f"doc.pdf:{i // 3}"}) + "\n")
+    return build_token_cache([str(data)], TinyTokenizer(), max_seq_length=32, cache_dir=str(tmp_path / "cache"))
+
+
+def test_token_cache_truncates_and_reloads(token_cache, tmp_path):
+    assert len(token_cache) == 300
+    assert token_cache.lengths.max() <= 32
+    reloaded = TokenCache(token_cache.directory)
+    assert np.array_equal(reloaded[5], token_cache[5])
+
+
+def test_holdout_keeps_chunks_together(token_cache):
+    train, holdout = token_cache.split(holdout_fraction=0.3)
+    assert len(train) + len(holdout) == len(token_cache)
+    held_groups = set(np.asarray(token_cache.groups)[holdout].tolist())
+    assert held_groups and not held_groups & set(np.asarray(token_cache.groups)[train].tolist())
+
+
+def test_group_hash_is_per_chunk():
+    threshold = holdout_threshold(0.02)
+    held = sum(group_hash({"chunk": f"subject.pdf:{i}", "text": ""}) < threshold for i in range(5000))
+    assert 50 < held < 150
+
+
+def test_pack_sequences_places_every_sample_once_without_overflow():
+    rng = np.random.default_rng(1)
+    lengths = rng.integers(1, 65, size=500)
+    indices = np.arange(500)
+    packs = pack_sequences(lengths, indices, max_seq_length=64)
+    placed = sorted(i for pack in packs for i in pack)
+    assert placed == list(range(500))
+    assert all(sum(int(lengths[i]) for i in pack) <= 64 for pack in packs)
+    assert padding_ratio(lengths, packs, 64) < padding_ratio(lengths, [[i] for i in indices], 64)
+
+
+def test_pack_sequences_only_uses_given_indices():
+    lengths = np.array([10, 20, 30, 40])
+    packs = pack_sequences(lengths, np.array([1, 3]), max_seq_length=64)
+    assert sorted(i for pack in packs for i in pack) == [1, 3]
+
+
+@pytest.mark.parametrize("inverted", [False, True])
+def test_packed_collator_masks_positions_and_labels(inverted):
+    torch = pytest.importorskip("torch")
+    collator = PackedCollator(pad_token_id=0, inverted_mask=inverted)
+    batch = collator([{"samples": [np.array([5, 6, 7]), np.array([8, 9])]},
+                      {"samples": [np.array([11, 12])]}])
+
+    assert batch["input_ids"].tolist() == [[5, 6, 7, 8, 9], [11, 12, 0, 0, 0]]
+    assert batch["position_ids"].tolist() == [[0, 1, 2, 0, 1], [0, 1, 0, 0, 0]]
+    # The first token of each sample is never a target, so no sample predicts its neighbour.
+    assert batch["labels"].tolist() == [[-100, 6, 7, -100, 9], [-100, 12, -100, -100, -100]]
+
+    mask = batch["attention_mask"]
+    assert mask.shape == (2, 1, 5, 5)
+    allowed = (mask == 0) if inverted else (mask == 1)
+    expected = torch.zeros((5, 5), dtype=torch.bool)
+    expected[:3, :3] = torch.tril(torch.ones((3, 3), dtype=torch.bool))
+    expected[3:, 3:] = torch.tril(torch.ones((2, 2), dtype=torch.bool))
+    assert torch.equal(allowed[0, 0], expected)
+    # Padding rows attend only to themselves.
+    assert allowed[1, 0, 3].tolist() == [False, False, False, True, False]
+    assert collator.real_tokens == 7 and collator.total_tokens == 10
@@ -0,0 +1,41 @@
+from syllabus_chunker import chunk_document, count_tokens
+
+PAGES = [
+    "Strand 1: NUMBER\nSub-strand 1: Counting\nB1.1.1.1 Demonstrate understanding of numbers.\n"
+    "B1.1.1.1.1 Count forwards to 100. Learners count objects in the classroom. They count in twos.\n",
+    "Sub-strand 2: Addition\nB1.1.2.1 Add whole numbers.\nB1.1.2.1.1 Add numbers up to 20. Learners use counters.\n",
+]
+
+
+def test_headings_stay_with_their_section():
+    chunks = chunk_document(PAGES, max_tokens=40, overlap_tokens=10)
+    addition = [chunk for chunk in chunks if "Add numbers up to 20" in chunk["text"]]
+    assert addition and all(chunk["sub_strand"] == "Addition" for chunk in addition)
+    # The sub-strand heading opens the chunk of the section it introduces.
+    assert addition[0]["text"].startswith("Sub-strand 2: Addition")
+    assert all(chunk["strand"] == "NUMBER" for chunk in chunks)
+    assert all(count_tokens(chunk["text"]) <= 40 for chunk in chunks)
+
+
+def test_chunks_never_span_sections():
+    chunks = chunk_document(PAGES, max_tokens=200, overlap_tokens=10)
+    assert [chunk["sub_strand"] for chunk in chunks] == ["Counting", "Addition"]
+    assert chunks[1]["page_start"] == 2 and chunks[0]["indicators"] == "B1.1.1.1.1"
+
+
+def test_pages_follow_a_paragraph_across_page_breaks():
+    # One run of prose (no headings or codes) over three pages.
+    pages = ["\n".join(f"Learners count group {page}-{i} of objects aloud." for i in range(30)) for page in (1, 2, 3)]
+    chunks = chunk_document(pages, max_tokens=60, overlap_tokens=0)
+    assert chunks[0]["page_start"] == chunks[0]["page_end"] == 1
+    assert chunks[-1]["page_start"] == chunks[-1]["page_end"] == 3
+    assert all(chunk["page_end"] - chunk["page_start"] <= 1 for chunk in chunks)
+    crossing = [chunk for chunk in chunks if chunk["page_start"] != chunk["page_end"]]
+    assert all("group 1-29" in chunk["text"] or "group 2-29" in chunk["text"] for chunk in crossing)
+
+
+def test_long_sentence_pieces_get_their_own_pages():
+    # A sentence without any full stop (e.g. a table dump) wrapping over two pages.
+    pages = [" ".join(["alpha"] * 50), " ".join(["beta"] * 50)]
+    chunks = chunk_document(pages, max_tokens=50, overlap_tokens=0)
+    assert [(chunk["page_start"], chunk["page_end"]) for chunk in chunks] == [(1, 1), (2, 2)]
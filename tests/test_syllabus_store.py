@@ -0,0 +1,48 @@
+import pytest
+
+from syllabus_store import SyllabusStore, compile_syllabus
+
+SYLLABUS = {
+    "primary": {
+        "mathematics": {
+            "grade2": [{"topic": "Counting", "subtopics": [{"title": "To 100", "content": "Count.", "exercises": ["Count to 20."]},
+                                                          {"title": "By tens"}]},
+                       {"topic": "Addition", "subtopics": [{"title": "Sums"}]}],
+            "grade10": [{"topic": "Algebra", "subtopics": []}],
+        },
+        "english": {"grade2": [{"topic": "Reading", "subtopics": [{"title": "Phonics"}]}]},
+    },
+    "jhs": {"science": {"b7": [{"topic": "Matter", "subtopics": [{"title": "States"}]}]}},
+}
+
+
+@pytest.fixture
+def store(tmp_path):
+    db_path = str(tmp_path / "syllabus.sqlite3")
+    compile_syllabus(SYLLABUS, db_path)
+    store = SyllabusStore(db_path)
+    yield store
+    store.close()
+
+
+def test_navigation_keeps_source_order(store):
+    assert store.levels() == ["primary", "jhs"]
+    assert store.subjects("primary") == ["mathematics", "english"]
+    assert store.grades("primary", "mathematics") == ["grade2", "grade10"]
+
+
+def test_topics_and_lessons(store):
+    assert store.topics("primary", "mathematics", "grade2") == [
+        {"topic": "Counting", "subtopics": ["To 100", "By tens"]}, {"topic": "Addition", "subtopics": ["Sums"]}]
+    assert store.topics("primary", "mathematics", "grade10") == [{"topic": "Algebra", "subtopics": []}]
+    assert store.lesson("primary", "mathematics", "grade2", 0, 0) == {
+        "title": "To 100", "content": "Count.", "examples": [], "exercises": ["Count to 20."]}
+
+
+def test_unknown_keys_raise(store):
+    with pytest.raises(KeyError):
+        store.subjects("shs")
+    with pytest.raises(KeyError):
+        store.topics("primary", "mathematics", "grade9")
+    with pytest.raises(KeyError):
+        store.lesson("primary", "mathematics", "grade2", 5, 0)
@@ -0,0 +1,9 @@
+import re
+
+# Sentence boundaries in retrieved chunk text: after ., !, ?, ; or : followed by whitespace, or at line breaks.
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+
+def split_sentences(text: str) -> list[str]:
+    """Non-blank sentences of `text`, split on SENTENCE_SPLIT_RE."""
+    return [s for s in SENTENCE_SPLIT_RE.split(text) if s.strip()]
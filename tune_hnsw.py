@@ -0,0 +1,330 @@
+import os
+import argparse
+import itertools
+import json
+import logging
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import chromadb
+import numpy as np
+
+import pdftovector
+
+# --- Configuration ---
+CHROMA_DB_PATH = pdftovector.CHROMA_DB_PATH
+COLLECTION_NAME = pdftovector.COLLECTION_NAME
+REBUILD_COLLECTION_NAME = COLLECTION_NAME + "_rebuild"  # Built beside the live collection, then swapped in
+
+# Sweep grid. ChromaDB's defaults are M=16, construction_ef=100, search_ef=100.
+M_VALUES = [8, 16, 32]
+EF_CONSTRUCTION_VALUES = [100, 200]
+EF_SEARCH_VALUES = [10, 20, 50, 100]
+
+QUERY_SAMPLES = 200  # Stored chunks used as queries; each is searched with and without a subject filter
+RECALL_K = 10
+TARGET_RECALL = 0.98  # Settings reaching this recall@k (filtered and unfiltered) compete on latency
+READ_PAGE_SIZE = 1000  # Chunks read from ChromaDB per request
+SEED = 0
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def hnsw_params(m: int, ef_construction: int, ef_search: int) -> dict:
+    return {"hnsw:M": m, "hnsw:construction_ef": ef_construction, "hnsw:search_ef": ef_search}
+
+
+def load_collection_data(collection) -> dict:
+    """Every chunk of the collection (ids, float32 embeddings, documents, metadatas), read page by page."""
+    ids, embeddings, documents, metadatas = [], [], [], []
+    total = collection.count()
+    for offset in range(0, total, READ_PAGE_SIZE):
+        page = collection.get(limit=READ_PAGE_SIZE, offset=offset, include=["embeddings", "documents", "metadatas"])
+        ids.extend(page["ids"])
+        embeddings.extend(page["embeddings"])
+        documents.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+    return {"ids": ids, "embeddings": np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1),
+            "documents": documents, "metadatas": metadatas}
+
+
+def make_queries(data: dict, samples: int = QUERY_SAMPLES, seed: int = SEED) -> list[dict]:
+    """Samples stored chunks as queries; each is searched unfiltered and restricted to its own subject."""
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(data["ids"]), size=min(samples, len(data["ids"])), replace=False)
+    queries = []
+    for index in picks.tolist():
+        queries.append({"index": index, "where": None})
+        subject = (data["metadatas"][index] or {}).get("subject")
+        if subject:
+            queries.append({"index": index, "where": {"subject": subject}})
+    return queries
+
+
+def exact_neighbours(data: dict, queries: list[dict], k: int = RECALL_K) -> tuple[list[list[float]], float]:
+    """Brute-force cosine top-k similarities for every query (the query chunk itself excluded), and ms per query.
+
+    Similarities rather than IDs are kept: duplicate chunks (e.g. the same PDF uploaded twice)
+    tie, and an index returning either copy has found a true neighbour.
+    """
+    matrix = data["embeddings"] / np.maximum(np.linalg.norm(data["embeddings"], axis=1, keepdims=True), 1e-12)
+    subjects = np.asarray([(metadata or {}).get("subject") for metadata in data["metadatas"]], dtype=object)
+    neighbours = []
+    start = time.perf_counter()
+    for query in queries:
+        similarities = matrix @ matrix[query["index"]]
+        if query["where"] is not None:
+            similarities = np.where(subjects == query["where"]["subject"], similarities, -np.inf)
+        similarities[query["index"]] = -np.inf
+        candidates = np.flatnonzero(np.isfinite(similarities))
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-similarities[candidates], k - 1)[:k]]
+        top = candidates[np.argsort(-similarities[candidates])]
+        neighbours.append(similarities[top].tolist())
+    return neighbours, 1000 * (time.perf_counter() - start) / max(len(queries), 1)
+
+
+def copy_into(collection, data: dict, batch_size: int) -> None:
+    for start in range(0, len(data["ids"]), batch_size):
+        end = start + batch_size
+        collection.add(ids=data["ids"][start:end], embeddings=data["embeddings"][start:end],
+                       documents=data["documents"][start:end], metadatas=data["metadatas"][start:end])
+
+
+def _directory_mb(path: str) -> float:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names) / 2 ** 20
+
+
+def _vector_segments(db_path: str) -> dict[str, str]:
+    """Collection name -> HNSW segment directory, read from ChromaDB's SQLite catalog."""
+    connection = sqlite3.connect(f"file:{os.path.join(db_path, 'chroma.sqlite3')}?mode=ro", uri=True)
+    try:
+        rows = connection.execute("SELECT collections.name, segments.id FROM segments JOIN collections "
+                                  "ON segments.collection = collections.id WHERE segments.scope = 'VECTOR'").fetchall()
+    finally:
+        connection.close()
+    return {name: os.path.join(db_path, segment_id) for name, segment_id in rows}
+
+
+def index_mb(db_path: str, name: str = COLLECTION_NAME) -> float:
+    """On-disk size of a collection's HNSW index."""
+    directory = _vector_segments(db_path).get(name)
+    return _directory_mb(directory) if directory and os.path.isdir(directory) else 0.0
+
+
+def compact(db_path: str) -> None:
+    """Deletes HNSW segment directories no collection uses any more (ChromaDB leaves them behind
+    when a collection is deleted) and VACUUMs the SQLite store to return its free pages."""
+    live = {os.path.basename(directory) for directory in _vector_segments(db_path).values()}
+    for name in os.listdir(db_path):
+        path = os.path.join(db_path, name)
+        if os.path.isdir(path) and name not in live and os.path.exists(os.path.join(path, "header.bin")):
+            shutil.rmtree(path)
+            logging.info(f"Removed orphaned index segment {name}.")
+    connection = sqlite3.connect(os.path.join(db_path, "chroma.sqlite3"), timeout=30)
+    try:
+        connection.execute("VACUUM")
+    except sqlite3.OperationalError as e:
+        logging.warning(f"Could not VACUUM the ChromaDB store ({e}); its free pages are reused by later writes.")
+    finally:
+        connection.close()
+
+
+def evaluate(collection, data: dict, queries: list[dict], exact: list[list[float]], k: int = RECALL_K) -> dict:
+    """recall@k against the exact neighbours and per-query latency, unfiltered and filtered.
+
+    A returned chunk counts if it is at least as similar as the exact k-th neighbour.
+    """
+    recall = {"unfiltered": [], "filtered": []}
+    latency = {"unfiltered": [], "filtered": []}
+    for query, expected in zip(queries, exact):
+        kind = "unfiltered" if query["where"] is None else "filtered"
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=data["embeddings"][query["index"]:query["index"] + 1],
+                                  n_results=k + 1, where=query["where"], include=["distances"])
+        latency[kind].append(time.perf_counter() - start)
+        found = [1.0 - distance for chunk_id, distance in zip(result["ids"][0], result["distances"][0])
+                 if chunk_id != data["ids"][query["index"]]][:k]
+        if expected:
+            recall[kind].append(sum(1 for similarity in found if similarity >= expected[-1] - 1e-5) / len(expected))
+    report = {}
+    for kind in ("unfiltered", "filtered"):
+        report[f"recall_{kind}"] = float(np.mean(recall[kind])) if recall[kind] else None
+        report[f"p50_ms_{kind}"] = 1000 * float(np.percentile(latency[kind], 50)) if latency[kind] else None
+        report[f"p99_ms_{kind}"] = 1000 * float(np.percentile(latency[kind], 99)) if latency[kind] else None
+    return report
+
+
+def sweep(data: dict, queries: list[dict], exact: list[list[float]], grid: list[dict], scratch_dir: str) -> list[dict]:
+    """Builds a scratch collection per setting (HNSW settings are fixed when a collection is created)."""
+    client = chromadb.PersistentClient(path=scratch_dir)
+    results = []
+    for number, params in enumerate(grid, 1):
+        name = f"hnsw_sweep_{number}"
+        start = time.perf_counter()
+        collection = client.create_collection(name=name, metadata={"hnsw:space": "cosine", **params})
+        copy_into(collection, data, client.get_max_batch_size())
+        build_seconds = time.perf_counter() - start
+        collection.query(query_embeddings=data["embeddings"][:1], n_results=1)  # Load the index outside the timings
+        result = {"params": params, "build_seconds": build_seconds, "index_mb": index_mb(scratch_dir, name),
+                  **evaluate(collection, data, queries, exact)}
+        logging.info(f"M={params['hnsw:M']} ef_construction={params['hnsw:construction_ef']} "
+                     f"ef_search={params['hnsw:search_ef']}: recall {result['recall_unfiltered']:.3f} "
+                     f"(filtered {result['recall_filtered'] or 0:.3f}), p50 {result['p50_ms_unfiltered']:.2f} ms")
+        results.append(result)
+        client.delete_collection(name=name)
+    return results
+
+
+def _mean_p50(result: dict) -> float:
+    values = [value for value in (result["p50_ms_unfiltered"], result["p50_ms_filtered"]) if value is not None]
+    return sum(values) / len(values)
+
+
+def _min_recall(result: dict) -> float:
+    return min(value for value in (result["recall_unfiltered"], result["recall_filtered"]) if value is not None)
+
+
+def choose(results: list[dict], target_recall: float = TARGET_RECALL) -> dict:
+    """The fastest setting reaching target recall (smaller M breaks ties); the most accurate if none does."""
+    eligible = [result for result in results if _min_recall(result) >= target_recall]
+    if not eligible:
+        logging.warning(f"No setting reached recall@{RECALL_K} {target_recall}; choosing the most accurate one.")
+        return max(results, key=lambda result: (_min_recall(result), -_mean_p50(result)))
+    return min(eligible, key=lambda result: (_mean_p50(result), result["params"]["hnsw:M"]))
+
+
+def print_report(results: list[dict], chosen: Optional[dict], current: Optional[dict], exact_ms: float) -> None:
+    print(f"{'M':>4} {'ef_c':>5} {'ef_s':>5} {'recall':>7} {'filt.':>7} {'p50 ms':>7} {'p99 ms':>7} "
+          f"{'filt. p50':>9} {'build s':>8} {'index MB':>9}")
+    for result in results:
+        params = result["params"]
+        marker = "  <- chosen" if result is chosen else ""
+        print(f"{params['hnsw:M']:>4} {params['hnsw:construction_ef']:>5} {params['hnsw:search_ef']:>5} "
+              f"{result['recall_unfiltered']:>7.3f} {result['recall_filtered'] or float('nan'):>7.3f} "
+              f"{result['p50_ms_unfiltered']:>7.2f} {result['p99_ms_unfiltered']:>7.2f} "
+              f"{result['p50_ms_filtered'] or float('nan'):>9.2f} {result['build_seconds']:>8.2f} "
+              f"{result['index_mb']:>9.1f}{marker}")
+    if current is not None:
+        print(f"current collection: recall {current['recall_unfiltered']:.3f} (filtered "
+              f"{current['recall_filtered'] or float('nan'):.3f}), p50 {current['p50_ms_unfiltered']:.2f} ms")
+    print(f"exact NumPy search: {exact_ms:.2f} ms per query")
+
+
+def rebuild_collection(client, data: dict, params: dict):
+    """Recreates the collection with the given HNSW settings from its stored chunks.
+
+    Copying only live chunks also compacts the index: vectors of deleted or replaced chunks stay
+    in an HNSW index that only grows. The copy is built under another name and swapped in once
+    complete, so the live collection is never half-built.
+    """
+    try:
+        client.delete_collection(name=REBUILD_COLLECTION_NAME)  # Leftover of an interrupted rebuild
+    except Exception:
+        pass
+    rebuilt = client.create_collection(name=REBUILD_COLLECTION_NAME, metadata={"hnsw:space": "cosine", **params})
+    copy_into(rebuilt, data, client.get_max_batch_size())
+    if rebuilt.count() != len(data["ids"]):
+        raise RuntimeError(f"Rebuilt collection holds {rebuilt.count()} chunks, expected {len(data['ids'])}.")
+    client.delete_collection(name=COLLECTION_NAME)
+    rebuilt.modify(name=COLLECTION_NAME)
+    return client.get_collection(name=COLLECTION_NAME)
+
+
+def recover_interrupted_rebuild(client) -> None:
+    """Finishes a swap that was interrupted between deleting the old collection and renaming the new one."""
+    names = {collection.name for collection in client.list_collections()}
+    if COLLECTION_NAME not in names and REBUILD_COLLECTION_NAME in names:
+        logging.warning("Completing an interrupted rebuild.")
+        client.get_collection(name=REBUILD_COLLECTION_NAME).modify(name=COLLECTION_NAME)
+
+
+def pin_settings(db_path: str, params: dict, measured: Optional[dict], chunks: int) -> None:
+    """Writes the settings pdftovector.py creates collections with, and records them in the
+    ingest manifest so the next ingest does not mistake them for a settings change."""
+    settings_path = os.path.join(db_path, os.path.basename(pdftovector.HNSW_SETTINGS_PATH))
+    tmp_path = settings_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"params": params, "measured": {key: value for key, value in (measured or {}).items() if key != "params"},
+                   "chunks": chunks,
+                   "tuned_at": datetime.now(timezone.utc).isoformat(timespec="seconds")}, f, indent=2)
+    os.replace(tmp_path, settings_path)
+
+    manifest_path = os.path.join(db_path, os.path.basename(pdftovector.MANIFEST_PATH))
+    manifest = pdftovector.load_manifest(manifest_path)
+    if manifest is not None:
+        manifest["config"]["hnsw"] = params
+        pdftovector.save_manifest(manifest, manifest_path)
+    logging.info(f"Pinned {params} in {settings_path}")
+
+
+def main(db_path: str = CHROMA_DB_PATH, m_values: Optional[list[int]] = None,
+         ef_construction_values: Optional[list[int]] = None, ef_search_values: Optional[list[int]] = None,
+         target_recall: float = TARGET_RECALL, samples: int = QUERY_SAMPLES, params: Optional[dict] = None,
+         apply: bool = True) -> Optional[dict]:
+    """Sweeps HNSW settings (unless params are given), then rebuilds the collection with the chosen
+    ones and pins them. Returns the pinned (or, with apply=False, the chosen) settings."""
+    client = chromadb.PersistentClient(path=db_path)
+    recover_interrupted_rebuild(client)
+    try:
+        collection = client.get_collection(name=COLLECTION_NAME)
+    except Exception:
+        raise SystemExit(f"No collection '{COLLECTION_NAME}' in {db_path}; run pdftovector.py first.")
+    data = load_collection_data(collection)
+    if not data["ids"]:
+        raise SystemExit(f"Collection '{COLLECTION_NAME}' is empty; run pdftovector.py first.")
+    logging.info(f"Loaded {len(data['ids'])} chunks ({data['embeddings'].shape[1]} dimensions) from {db_path}")
+
+    measured = None
+    if params is None:
+        queries = make_queries(data, samples)
+        exact, exact_ms = exact_neighbours(data, queries)
+        current = evaluate(collection, data, queries, exact)
+        grid = [hnsw_params(m, ef_construction, ef_search) for m, ef_construction, ef_search in itertools.product(
+            m_values or M_VALUES, ef_construction_values or EF_CONSTRUCTION_VALUES, ef_search_values or EF_SEARCH_VALUES)]
+        logging.info(f"Sweeping {len(grid)} settings with {len(queries)} queries...")
+        scratch_dir = tempfile.mkdtemp(prefix="hnsw-sweep-")
+        try:
+            results = sweep(data, queries, exact, grid, scratch_dir)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        measured = choose(results, target_recall)
+        print_report(results, measured, current, exact_ms)
+        params = measured["params"]
+
+    if not apply:
+        return params
+    before_index_mb, before_db_mb = index_mb(db_path), _directory_mb(db_path)
+    start = time.perf_counter()
+    rebuild_collection(client, data, params)
+    del collection, client
+    chromadb.api.client.SharedSystemClient.clear_system_cache()  # Release the store before VACUUM
+    compact(db_path)
+    logging.info(f"Rebuilt '{COLLECTION_NAME}' with {params} in {time.perf_counter() - start:.1f}s "
+                 f"(index {before_index_mb:.1f} MB -> {index_mb(db_path):.1f} MB, "
+                 f"database directory {before_db_mb:.1f} MB -> {_directory_mb(db_path):.1f} MB).")
+    pin_settings(db_path, params, measured, len(data["ids"]))
+    return params
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune, rebuild and compact the syllabus collection's HNSW index.")
+    parser.add_argument("--db", default=CHROMA_DB_PATH)
+    parser.add_argument("--m", type=int, nargs="+", help=f"M values to sweep (default: {M_VALUES}).")
+    parser.add_argument("--ef-construction", type=int, nargs="+",
+                        help=f"construction_ef values to sweep (default: {EF_CONSTRUCTION_VALUES}).")
+    parser.add_argument("--ef-search", type=int, nargs="+", help=f"search_ef values to sweep (default: {EF_SEARCH_VALUES}).")
+    parser.add_argument("--target-recall", type=float, default=TARGET_RECALL)
+    parser.add_argument("--samples", type=int, default=QUERY_SAMPLES, help="Stored chunks used as queries.")
+    parser.add_argument("--pin", type=int, nargs=3, metavar=("M", "EF_CONSTRUCTION", "EF_SEARCH"),
+                        help="Skip the sweep; rebuild with and pin these settings.")
+    parser.add_argument("--dry-run", action="store_true", help="Report the sweep only; leave the collection as it is.")
+    args = parser.parse_args()
+    main(db_path=args.db, m_values=args.m, ef_construction_values=args.ef_construction, ef_search_values=args.ef_search,
+         target_recall=args.target_recall, samples=args.samples, params=hnsw_params(*args.pin) if args.pin else None,
+         apply=not args.dry_run)